@@ -194,6 +194,27 @@ ODOO_API_KEY = os.getenv("ODOO_API_KEY")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM")
 
+# Backend used for whole batch payroll calculations: "python", "columnar", "fused"
+# or "sql", a batch can override it with its calculation_backend
+PAYROLL_CALCULATION_BACKEND = os.getenv("PAYROLL_CALCULATION_BACKEND", "python")
+
+# Rows per chunk when streaming CSV imports, 0 reads the whole file at once
+PAYROLL_IMPORT_CHUNK_SIZE = int(os.getenv("PAYROLL_IMPORT_CHUNK_SIZE", 50000))
+
+# Split imports by field worker into this many shards, inserted and calculated
+# in parallel by the Celery workers. 0 or 1 imports in a single task
+PAYROLL_IMPORT_SHARDS = int(os.getenv("PAYROLL_IMPORT_SHARDS", 0))
+
+# Excel reader of the imports, "openpyxl" or "calamine" (needs python-calamine)
+PAYROLL_EXCEL_ENGINE = os.getenv("PAYROLL_EXCEL_ENGINE", "openpyxl")
+
+# Lines fetched per server-side cursor round trip by the batch exports
+PAYROLL_EXPORT_CHUNK_SIZE = int(os.getenv("PAYROLL_EXPORT_CHUNK_SIZE", 2000))
+
+# Record the tracemalloc peak of every stage in the batch metrics, the only
+# per-stage memory peak. Slows the stages down
+PAYROLL_STAGE_MEMORY_TRACING = os.getenv("PAYROLL_STAGE_MEMORY_TRACING", "False") == "True"
+
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://127.0.0.1:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://127.0.0.1:6379/0")
 CELERY_ACCEPT_CONTENT = ["json"]
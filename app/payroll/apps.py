@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class PayrollConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "payroll"
+
+    def ready(self):
+        from django.core.signals import request_started
+        from django.db.models.signals import post_delete, post_save
+        from celery.signals import task_prerun
+        from .caches import config_cache, invalidate_tariff_index
+        from .models import Tariff
+
+        # Re-check the config version once per request and per task
+        request_started.connect(config_cache.expire, dispatch_uid="payroll_config_cache_request")
+        task_prerun.connect(config_cache.expire, dispatch_uid="payroll_config_cache_task")
+
+        # Any tariff change, from the API, the admin or a shell, reloads the tariff indexes
+        post_save.connect(invalidate_tariff_index, sender=Tariff, dispatch_uid="payroll_tariff_index_save")
+        post_delete.connect(invalidate_tariff_index, sender=Tariff, dispatch_uid="payroll_tariff_index_delete")
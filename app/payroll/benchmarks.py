@@ -0,0 +1,196 @@
+"""
+Synthetic payroll workloads and timing helpers for the calculation benchmarks
+"""
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, List
+import numpy as np
+import pandas as pd
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .models import (
+    Activity,
+    ActivityGroup,
+    Farm,
+    FieldWorker,
+    LaborType,
+    PayrollBatch,
+    PayrollBatchLine,
+    Tariff,
+    Uom,
+)
+
+BENCHMARK_PREFIX = "BENCH"
+# A Monday far from real payroll weeks
+BENCHMARK_WEEK_START = date(2000, 1, 3)
+
+
+class SyntheticPayrollWorkload:
+    """
+    Generates a farm with its activities and tariffs, N workers and a
+    week of payroll lines: N workers x 7 days x k activities per day.
+    Values are drawn from a seeded generator so runs are comparable.
+    """
+
+    def __init__(self, workers=100, activities_per_day=2, activities=10, seed=0):
+        if activities_per_day > activities:
+            raise ValueError("activities_per_day can't be greater than activities")
+
+        self.worker_count = workers
+        self.activities_per_day = activities_per_day
+        self.activity_count = activities
+        self.rng = np.random.default_rng(seed)
+
+        self.farm = None
+        self.workers = []
+        self.activities = []
+
+    @property
+    def line_count(self) -> int:
+        return self.worker_count * 7 * self.activities_per_day
+
+    def create_reference_data(self) -> None:
+        """Create the farm, activities, tariffs and workers"""
+        self.farm = Farm.objects.create(name=f"{BENCHMARK_PREFIX} Farm", code=BENCHMARK_PREFIX)
+        activity_group = ActivityGroup.objects.create(
+            name=f"{BENCHMARK_PREFIX} Activity Group", code=BENCHMARK_PREFIX
+        )
+        uom = Uom.objects.create(name=f"{BENCHMARK_PREFIX} Units")
+        work = LaborType.objects.create(name=f"{BENCHMARK_PREFIX} Work", code="BENCHW")
+        leave = LaborType.objects.create(
+            name=f"{BENCHMARK_PREFIX} Leave",
+            code="BENCHL",
+            calculates_integral=False,
+            calculates_thirteenth_bonus=False,
+            calculates_fourteenth_bonus=False,
+        )
+
+        # Every fifth activity is a leave without tariff
+        self.activities = Activity.objects.bulk_create([
+            Activity(
+                name=f"{BENCHMARK_PREFIX} Activity {i}",
+                activity_group=activity_group,
+                labor_type=leave if i % 5 == 4 else work,
+                uom=uom,
+            )
+            for i in range(self.activity_count)
+        ])
+        prices = self.rng.uniform(0.5, 5, self.activity_count).round(2)
+        Tariff.objects.bulk_create([
+            Tariff(
+                name=f"{BENCHMARK_PREFIX} Tariff {i}",
+                activity=activity,
+                farm=self.farm,
+                cost_per_unit=Decimal(str(prices[i])),
+            )
+            for i, activity in enumerate(self.activities)
+            if activity.labor_type_id == work.pk
+        ])
+
+        wages = self.rng.uniform(450, 900, self.worker_count).round(2)
+        self.workers = FieldWorker.objects.bulk_create([
+            FieldWorker(
+                name=f"{BENCHMARK_PREFIX} Worker {i}",
+                odoo_employee_id=-(i + 1),
+                identification_number=f"9{i:09d}",
+                wage=Decimal(str(wages[i])),
+                contract_status="open",
+            )
+            for i in range(self.worker_count)
+        ], batch_size=1000)
+
+    def create_batch(self, name=None) -> PayrollBatch:
+        return PayrollBatch.objects.create(
+            name=name or f"{BENCHMARK_PREFIX} Batch",
+            farm=self.farm,
+            start_date=BENCHMARK_WEEK_START,
+            end_date=BENCHMARK_WEEK_START + timedelta(days=6),
+        )
+
+    def build_frame(self) -> pd.DataFrame:
+        """Payroll lines in the import file layout"""
+        worker_ids = np.repeat(
+            [worker.identification_number for worker in self.workers], 7 * self.activities_per_day
+        )
+        days = np.tile(np.repeat(np.arange(7), self.activities_per_day), self.worker_count)
+        # k distinct activities per worker and day
+        first_activity = self.rng.integers(0, self.activity_count, self.worker_count * 7)
+        offsets = np.tile(np.arange(self.activities_per_day), self.worker_count * 7)
+        activity_indexes = (np.repeat(first_activity, self.activities_per_day) + offsets) % self.activity_count
+        activity_names = np.array([activity.name for activity in self.activities])
+
+        return pd.DataFrame({
+            'date': [
+                (BENCHMARK_WEEK_START + timedelta(days=int(day))).isoformat() for day in days
+            ],
+            'field_worker': worker_ids,
+            'activity': activity_names[activity_indexes],
+            'quantity': self.rng.uniform(0, 40, self.line_count).round(3),
+        })
+
+    def create_lines(self, batch, batch_size=1000) -> None:
+        """
+        Insert the lines directly, without going through the import.
+        Only batch_size lines are built at a time, so a million lines fit in memory.
+        """
+        workers = {worker.identification_number: worker for worker in self.workers}
+        activities = {activity.name: activity for activity in self.activities}
+        df = self.build_frame()
+        year, week, _ = BENCHMARK_WEEK_START.isocalendar()
+
+        for start in range(0, len(df), batch_size):
+            PayrollBatchLine.objects.bulk_create([
+                PayrollBatchLine(
+                    payroll_batch=batch,
+                    date=date.fromisoformat(row.date),
+                    field_worker=workers[row.field_worker],
+                    activity=activities[row.activity],
+                    quantity=Decimal(str(row.quantity)),
+                    iso_week=week,
+                    iso_year=year,
+                )
+                for row in df.iloc[start:start + batch_size].itertuples(index=False)
+            ])
+
+
+class BenchmarkRunner:
+    """
+    Records wall time, query count and peak memory of callables.
+    tracemalloc slows Python code down several times, so the peak memory
+    comes from a second, traced run that is not timed.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.results: List[Dict[str, Any]] = []
+
+    def run(self, name: str, func: Callable, setup: Callable = None) -> Dict[str, Any]:
+        """
+        Run func(*setup()) and record its measures.
+        setup prepares the state and returns the arguments of every run.
+        """
+        args = setup() if setup else ()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            func(*args)
+            wall_time = time.perf_counter() - started
+
+        result = {
+            'name': name,
+            'wall_time': round(wall_time, 6),
+            'queries': len(queries),
+            'peak_memory': None,
+        }
+        if self.trace_memory:
+            args = setup() if setup else ()
+            tracemalloc.start()
+            try:
+                func(*args)
+                _current, result['peak_memory'] = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.results.append(result)
+        return result
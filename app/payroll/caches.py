@@ -0,0 +1,209 @@
+"""
+Shared caches for the reference data used by payroll calculations
+"""
+import time
+from decimal import Decimal
+from typing import Dict
+from django.core.cache import cache
+from django.db import connection, transaction
+from .models import Tariff, PayrollConfiguration
+from .summaries import summarize_batch
+
+TARIFF_VERSION_KEY = "payroll:tariff-index:version"
+TARIFF_INDEX_KEY = "payroll:tariff-index:{version}:{farm_id}"
+TARIFF_INDEX_TIMEOUT = 60 * 15 # 15 minutes
+
+CONFIG_VERSION_KEY = "payroll:config:version"
+CONFIG_SNAPSHOT_KEY = "payroll:config:snapshot:{version}"
+CONFIG_SNAPSHOT_TIMEOUT = 60 * 60 * 24 # 1 day
+# Upper bound for reusing the in-process copy outside of requests and tasks
+CONFIG_LOCAL_TTL = 5 # seconds
+
+BATCH_VERSION_KEY = "payroll:batch:{batch_id}:version"
+BATCH_SUMMARY_KEY = "payroll:batch:{batch_id}:summary:{version}"
+BATCH_SUMMARY_TIMEOUT = 60 * 60 * 24 # 1 day
+
+
+class TariffIndex:
+    """
+    (activity_id, farm_id) -> cost_per_unit map.
+    Each farm's tariffs are loaded with a single query the first time
+    they are needed and shared between processes through the cache,
+    under a version that every tariff save or delete publishes anew.
+    """
+
+    def __init__(self):
+        self._prices = {}
+        self._loaded_farms = set()
+
+    def load_farm(self, farm_id) -> None:
+        if farm_id in self._loaded_farms:
+            return
+
+        version = cache.get_or_set(TARIFF_VERSION_KEY, time.time_ns, None)
+        key = TARIFF_INDEX_KEY.format(version=version, farm_id=farm_id)
+        prices = cache.get(key)
+        if prices is None:
+            prices = dict(
+                Tariff.objects.filter(farm_id=farm_id).values_list('activity_id', 'cost_per_unit')
+            )
+            if _can_cache(TARIFF_VERSION_KEY):
+                cache.set(key, prices, TARIFF_INDEX_TIMEOUT)
+
+        for activity_id, cost_per_unit in prices.items():
+            self._prices[(activity_id, farm_id)] = cost_per_unit
+        self._loaded_farms.add(farm_id)
+
+    def get_price(self, activity_id, farm_id) -> Decimal:
+        self.load_farm(farm_id)
+        return self._prices.get((activity_id, farm_id), Decimal(0))
+
+
+def invalidate_tariff_index(**kwargs) -> None:
+    """
+    Publish a new tariff version to every process, connected to the Tariff
+    save and delete signals. Call it after queryset updates of tariffs,
+    they send no signal.
+    """
+    _publish_version(TARIFF_VERSION_KEY)
+
+
+def _publish_version(key) -> None:
+    """
+    Publish a new version right away, so the cached values are not read
+    again, and once more when the transaction commits. Until then, what
+    this connection reads may be rolled back, so it is not cached under
+    the new version, see _can_cache.
+    """
+    _incr_version(key)
+    if not connection.in_atomic_block:
+        return
+
+    def publish_committed():
+        publish_committed.pending = False
+        _incr_version(key)
+
+    publish_committed.version_key = key
+    publish_committed.pending = True
+    transaction.on_commit(publish_committed)
+
+
+def _incr_version(key) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Counter was evicted, restart it from a value no process has seen
+        cache.set(key, time.time_ns(), None)
+
+
+def _can_cache(key) -> bool:
+    """
+    False while the open transaction has published a new version of key
+    that isn't committed yet. A rollback drops the commit callbacks, so
+    the check ends with the transaction either way.
+    """
+    return not any(
+        getattr(func, 'version_key', None) == key and func.pending
+        for _sids, func, _robust in connection.run_on_commit
+    )
+
+
+class PayrollConfigCache:
+    """
+    Versioned snapshot cache for the PayrollConfiguration singleton.
+
+    The version counter and the snapshots live in Redis, every process
+    keeps a short-lived copy of the last snapshot it read. The copy is
+    expired at the start of every request and task, so a new config is
+    picked up after a single version read instead of a database query.
+    """
+
+    def __init__(self, local_ttl=CONFIG_LOCAL_TTL):
+        self.local_ttl = local_ttl
+        self._config = None
+        self._version = None
+        self._expires_at = 0
+
+    def get(self) -> PayrollConfiguration:
+        now = time.monotonic()
+        if self._config is not None and now < self._expires_at:
+            return self._config
+
+        if not _can_cache(CONFIG_VERSION_KEY):
+            # Changed by the open transaction, neither cached nor kept
+            return PayrollConfiguration.objects.get_config()
+        version = self._get_version()
+        if self._config is None or version != self._version:
+            self._config = self._load_snapshot(version)
+            self._version = version
+
+        self._expires_at = now + self.local_ttl
+        return self._config
+
+    def expire(self, **kwargs) -> None:
+        """Force a version check on the next read, used as a signal receiver"""
+        self._expires_at = 0
+
+    def clear(self) -> None:
+        self._config = None
+        self._version = None
+        self._expires_at = 0
+
+    def invalidate(self) -> None:
+        """Publish a new config version to every process"""
+        _publish_version(CONFIG_VERSION_KEY)
+        self.clear()
+        transaction.on_commit(self.clear)
+
+    def _get_version(self) -> int:
+        return cache.get_or_set(CONFIG_VERSION_KEY, time.time_ns, None)
+
+    def _load_snapshot(self, version) -> PayrollConfiguration:
+        key = CONFIG_SNAPSHOT_KEY.format(version=version)
+        values = cache.get(key)
+        if values is None:
+            config = PayrollConfiguration.objects.get_config()
+            values = {
+                field.attname: getattr(config, field.attname)
+                for field in PayrollConfiguration._meta.concrete_fields
+            }
+            cache.set(key, values, CONFIG_SNAPSHOT_TIMEOUT)
+        return PayrollConfiguration(**values)
+
+
+config_cache = PayrollConfigCache()
+
+
+def get_payroll_config() -> PayrollConfiguration:
+    """
+    Read-only snapshot of the payroll configuration.
+    Use PayrollConfiguration.get_config() when the row must be written.
+    """
+    return config_cache.get()
+
+
+def get_batch_version(batch_id) -> int:
+    return cache.get_or_set(BATCH_VERSION_KEY.format(batch_id=batch_id), time.time_ns, None)
+
+
+def bump_batch_version(batch_id) -> None:
+    """
+    Publish a new version of the lines of a batch, call it whenever a line
+    is created, updated, deleted or recalculated. Summaries cached under
+    an older version are never read again and expire on their own.
+    """
+    _publish_version(BATCH_VERSION_KEY.format(batch_id=batch_id))
+
+
+def get_batch_summary(batch_id) -> Dict:
+    """
+    Per-worker and per-activity totals of a batch, cached under the
+    current batch version. A miss runs a single grouped query.
+    """
+    key = BATCH_SUMMARY_KEY.format(batch_id=batch_id, version=get_batch_version(batch_id))
+    summary = cache.get(key)
+    if summary is None:
+        summary = summarize_batch(batch_id)
+        if _can_cache(BATCH_VERSION_KEY.format(batch_id=batch_id)):
+            cache.set(key, summary, BATCH_SUMMARY_TIMEOUT)
+    return summary
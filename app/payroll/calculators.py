@@ -1,13 +1,13 @@
 from abc import ABC, abstractmethod
-from django.db import transaction
+from collections import defaultdict
+from django.db import connection, transaction
 from typing import Dict, Any, List
-from django.db.models import Sum
+from django.db.models import Count
 from decimal import Decimal
-from .models import (
-    PayrollBatchLine,
-    Tariff,
-    PayrollConfiguration
-)
+import numpy as np
+import pandas as pd
+from .models import PayrollBatchLine
+from .caches import TariffIndex, get_payroll_config
 from .constants import DAYS_OF_THE_MONTH, WORK_HOURS_PER_DAY, MONTHS_IN_YEAR
 import logging
 
@@ -24,15 +24,14 @@ class BasePayrollCalculator(PayrollCalculatorInterface):
     """
     Base calculator with shared calculations
     """
+    def __init__(self, tariff_index: TariffIndex = None):
+        self.tariff_index = tariff_index or TariffIndex()
+
     def _get_daily_wage(self, worker):
         return (worker.wage or Decimal(0)) / Decimal(DAYS_OF_THE_MONTH)
     
     def _get_tariff_price(self, line):
-        try:
-            tariff = Tariff.objects.get(activity= line.activity, farm = line.payroll_batch.farm)
-            return tariff.cost_per_unit
-        except Tariff.DoesNotExist:
-            return Decimal(0)
+        return self.tariff_index.get_price(line.activity_id, line.payroll_batch.farm_id)
     
     def _is_weekend(self, line):
         return line.date.weekday() >= 5
@@ -44,12 +43,12 @@ class BasePayrollCalculator(PayrollCalculatorInterface):
             return max(Decimal(0), total_cost - daily_wage)
     
     def _calculate_mobilization(self, surplus):
-        config = PayrollConfiguration.get_config()
+        config = get_payroll_config()
         mobilization = surplus * (config.mobilization_percentage / 100)
         return mobilization
 
     def _calculate_extra_hours(self, surplus):
-        config = PayrollConfiguration.get_config()
+        config = get_payroll_config()
         extra_hours_value = surplus * (config.extra_hours_percentage / 100)
 
         return extra_hours_value
@@ -58,7 +57,7 @@ class BasePayrollCalculator(PayrollCalculatorInterface):
         if extra_hours_value <= 0:
             return Decimal(0)
         
-        config = PayrollConfiguration.get_config()
+        config = get_payroll_config()
         hourly_wage = (worker.wage / DAYS_OF_THE_MONTH) / WORK_HOURS_PER_DAY
         extra_hour_wage = hourly_wage * config.extra_hour_multiplier
         extra_hours_qty = extra_hours_value / extra_hour_wage
@@ -71,7 +70,7 @@ class BasePayrollCalculator(PayrollCalculatorInterface):
         return extra_hours_value + (daily_thirteenth_bonus if not is_weekend else Decimal(0))
         
     def _calculate_fourteenth_bonus(self, worker):
-        config = PayrollConfiguration.get_config()
+        config = get_payroll_config()
         basic_wage = config.basic_monthly_wage
 
         daily_fourteenth_bonus = (basic_wage / MONTHS_IN_YEAR) / DAYS_OF_THE_MONTH
@@ -82,6 +81,26 @@ class InlineCalculator(BasePayrollCalculator):
 
     def calculate(self, context: Dict[str, Any]) -> None:
         line = context['line']
+        self.apply(line)
+        line.save()
+
+    def calculate_batch(self, lines):
+        updated_lines = []
+
+        for line in lines:
+            self.apply(line)
+            updated_lines.append(line)
+
+        PayrollBatchLine.objects.bulk_update(
+            updated_lines, 
+            ['total_cost', 'salary_surplus', 'mobilization_bonus', 'extra_hours_value', 
+             'extra_hours_qty', 'thirteenth_bonus', 'fourteenth_bonus']
+        )
+
+        return updated_lines
+
+    def apply(self, line) -> None:
+        """Calculate the inline fields of a line in memory, without saving it"""
         worker = line.field_worker
 
         daily_wage = self._get_daily_wage(worker)
@@ -96,37 +115,113 @@ class InlineCalculator(BasePayrollCalculator):
         line.thirteenth_bonus = self._calculate_thirteenth_bonus(daily_wage, line.extra_hours_value, is_weekend)
         line.fourteenth_bonus = self._calculate_fourteenth_bonus(worker)
 
-        line.save()
-    
-    def calculate_batch(self, lines):
-        updated_lines = []
+class ColumnarInlineCalculator(InlineCalculator):
+    """
+    Columnar version of the InlineCalculator for whole batches.
+    Loads the batch into a DataFrame once and computes every output
+    field with vectorized operations instead of line by line.
+    """
+    OUTPUT_FIELDS = [
+        'total_cost', 'salary_surplus', 'mobilization_bonus', 'extra_hours_value',
+        'extra_hours_qty', 'thirteenth_bonus', 'fourteenth_bonus'
+    ]
 
-        for line in lines:
-            worker = line.field_worker
-            daily_wage = self._get_daily_wage(worker)
-            tariff_price = self._get_tariff_price(line)
-            is_weekend = self._is_weekend(line)
-
-            line.total_cost = line.quantity * tariff_price
-            line.salary_surplus = self._get_surplus(line.total_cost, daily_wage, is_weekend)
-            line.mobilization_bonus = self._calculate_mobilization(line.salary_surplus)
-            line.extra_hours_value = self._calculate_extra_hours(line.salary_surplus)
-            line.extra_hours_qty = self._calculate_extra_hours_qty(line.extra_hours_value, worker)
-            line.thirteenth_bonus = self._calculate_thirteenth_bonus(daily_wage, line.extra_hours_value, is_weekend)
-            line.fourteenth_bonus = self._calculate_fourteenth_bonus(worker)
+    def __init__(self, tariff_index: TariffIndex = None, bulk_batch_size=1000):
+        super().__init__(tariff_index)
+        self.bulk_batch_size = bulk_batch_size
 
-            updated_lines.append(line)
+    def calculate_batch(self, lines):
+        df = self.load_frame(lines)
+        if df.empty:
+            return df
+
+        df = self.calculate_frame(df, get_payroll_config())
+        self._write_frame(df)
+
+        return df
+
+    def load_frame(self, lines) -> pd.DataFrame:
+        """Load the columns needed for the calculation in a single query"""
+        df = pd.DataFrame.from_records(
+            lines.values_list(
+                'id', 'date', 'quantity', 'activity_id',
+                'field_worker__wage', 'payroll_batch__farm_id'
+            ),
+            columns=['id', 'date', 'quantity', 'activity_id', 'wage', 'farm_id']
+        )
+        if df.empty:
+            return df
+
+        df['tariff_price'] = self._get_tariff_prices(df)
+        return df
+
+    def _get_tariff_prices(self, df):
+        return [
+            self.tariff_index.get_price(activity_id, farm_id)
+            for activity_id, farm_id in zip(df['activity_id'].tolist(), df['farm_id'].tolist())
+        ]
+
+    def calculate_frame(self, df: pd.DataFrame, config) -> pd.DataFrame:
+        """
+        Vectorized equivalent of InlineCalculator.apply.
+        The columns hold Decimals and every operation runs in the same order
+        as the per-line path, so the stored values are identical to it.
+        """
+        zero = Decimal(0)
+        quantity = df['quantity'].to_numpy(dtype=object)
+        tariff_price = df['tariff_price'].to_numpy(dtype=object)
+        wage = df['wage'].to_numpy(dtype=object)
+        has_wage = df['wage'].notna().to_numpy()
+        daily_wage = np.where(has_wage, wage, zero) / Decimal(DAYS_OF_THE_MONTH)
+        is_weekend = (pd.to_datetime(df['date']).dt.weekday >= 5).to_numpy()
+
+        total_cost = quantity * tariff_price
+        weekday_surplus = total_cost - daily_wage
+        salary_surplus = np.where(
+            is_weekend, total_cost, np.where(weekday_surplus > zero, weekday_surplus, zero)
+        )
+        extra_hours_value = salary_surplus * (config.extra_hours_percentage / 100)
 
+        # Only lines with extra hours and a wage are divided
+        with_extra_hours = (extra_hours_value > zero) & has_wage
+        extra_hours_qty = np.full(len(df), zero, dtype=object)
+        extra_hour_wage = (
+            wage[with_extra_hours] / DAYS_OF_THE_MONTH / WORK_HOURS_PER_DAY * config.extra_hour_multiplier
+        )
+        extra_hours_qty[with_extra_hours] = extra_hours_value[with_extra_hours] / extra_hour_wage
+
+        df['total_cost'] = total_cost
+        df['salary_surplus'] = salary_surplus
+        df['mobilization_bonus'] = salary_surplus * (config.mobilization_percentage / 100)
+        df['extra_hours_value'] = extra_hours_value
+        df['extra_hours_qty'] = extra_hours_qty
+        df['thirteenth_bonus'] = extra_hours_value + np.where(
+            is_weekend, zero, daily_wage / MONTHS_IN_YEAR
+        )
+        df['fourteenth_bonus'] = (config.basic_monthly_wage / MONTHS_IN_YEAR) / DAYS_OF_THE_MONTH
+        return df
+
+    def _write_frame(self, df: pd.DataFrame) -> None:
+        """Write the calculated columns back with a single bulk update"""
+        columns = [df['id'].tolist()] + [df[field].tolist() for field in self.OUTPUT_FIELDS]
+        updated_lines = [
+            PayrollBatchLine(pk=values[0], **dict(zip(self.OUTPUT_FIELDS, values[1:])))
+            for values in zip(*columns)
+        ]
         PayrollBatchLine.objects.bulk_update(
-            updated_lines, 
-            ['total_cost', 'salary_surplus', 'mobilization_bonus', 'extra_hours_value', 
-             'extra_hours_qty', 'thirteenth_bonus', 'fourteenth_bonus']
+            updated_lines, self.OUTPUT_FIELDS, batch_size=self.bulk_batch_size
         )
 
-        return updated_lines
-        
 class DayLevelCalculator(BasePayrollCalculator):
     """Single Responsability: Calculate proportional bonuse for same-day lines"""
+    OUTPUT_FIELDS = [
+        'salary_surplus', 'mobilization_bonus', 'extra_hours_value', 'extra_hours_qty',
+        'thirteenth_bonus', 'fourteenth_bonus', 'integral_bonus'
+    ]
+
+    def __init__(self, tariff_index: TariffIndex = None, bulk_batch_size=1000):
+        super().__init__(tariff_index)
+        self.bulk_batch_size = bulk_batch_size
 
     def calculate(self, context: Dict[str, Any]) -> None:
         worker = context['worker']
@@ -135,23 +230,66 @@ class DayLevelCalculator(BasePayrollCalculator):
 
         self._recalculate_same_day_proportions(worker, payroll_batch, date)
     
-    def _recalculate_same_day_proportions(self, worker, payroll, date) -> None:
-        is_weekend = date.weekday() >= 5
-        daily_wage = worker.wage / DAYS_OF_THE_MONTH
+    def calculate_batch(self, lines):
+        """
+        Day-level pass over lines already in memory.
+        Writes every line of a split day with a single bulk update,
+        no per-group queries.
+        """
+        updated_lines = self.apply_batch(lines)
+        if updated_lines:
+            PayrollBatchLine.objects.bulk_update(
+                updated_lines, self.OUTPUT_FIELDS, batch_size=self.bulk_batch_size
+            )
+
+        return updated_lines
 
-        fw_lines = PayrollBatchLine.objects.filter(
+    def apply_batch(self, lines) -> List:
+        """
+        Group the lines by (worker, date) and distribute every split day
+        in memory. Returns the lines that were changed.
+        """
+        day_groups = defaultdict(list)
+        for line in lines:
+            day_groups[(line.field_worker_id, line.date)].append(line)
+
+        updated_lines = []
+        for (_worker_id, date), day_lines in day_groups.items():
+            if len(day_lines) < 2:
+                continue
+            if self._apply_same_day_proportions(day_lines, day_lines[0].field_worker, date):
+                updated_lines.extend(day_lines)
+
+        return updated_lines
+
+    def apply_day(self, day_lines) -> bool:
+        """Distribute a single (worker, date) group in memory"""
+        return self._apply_same_day_proportions(day_lines, day_lines[0].field_worker, day_lines[0].date)
+
+    def _recalculate_same_day_proportions(self, worker, payroll, date) -> None:
+        fw_lines = list(PayrollBatchLine.objects.filter(
             payroll_batch=payroll,
             date=date,
             field_worker=worker
-        )
-        if not fw_lines.exists():
-            return
-        
-        lines_total_cost = fw_lines.aggregate(total_cost=Sum('total_cost'))['total_cost']
+        ).select_related('field_worker'))
+        if self._apply_same_day_proportions(fw_lines, worker, date):
+            for line in fw_lines:
+                line.save()
+
+    def _apply_same_day_proportions(self, lines, worker, date) -> bool:
+        """Distribute the day totals between the lines, returns False if nothing to distribute"""
+        is_weekend = date.weekday() >= 5
+        daily_wage = self._get_daily_wage(worker)
+
+        lines_total_cost = sum(line.total_cost for line in lines)
+        if not lines_total_cost:
+            return False
+
         total_salary_surplus = (lines_total_cost - daily_wage) if not is_weekend else lines_total_cost
-        for line in fw_lines:
+        for line in lines:
             proportion = line.total_cost / lines_total_cost
             self._update_line_with_proportion(line, proportion, total_salary_surplus, daily_wage, is_weekend)
+        return True
     
     def _update_line_with_proportion(self, line, proportion, total_salary_surplus, daily_wage, is_weekend):
         line.salary_surplus = total_salary_surplus * proportion
@@ -167,8 +305,6 @@ class DayLevelCalculator(BasePayrollCalculator):
         line.fourteenth_bonus = self._calculate_fourteenth_bonus(line.field_worker) * proportion
         line.integral_bonus = line.integral_bonus * proportion
 
-        line.save()
-
 class WeekLevelCalculator(BasePayrollCalculator):
     """Calculate proportional bonuses for same-week worker lines"""
     
@@ -177,7 +313,83 @@ class WeekLevelCalculator(BasePayrollCalculator):
         payroll_batch = context['payroll_batch']
 
         self._calculate_weekly_integral_for_worker(worker, payroll_batch)
-    
+
+    UPDATE_INTEGRAL_SQL = """
+        UPDATE payroll_payrollbatchline line
+        SET integral_bonus = CASE
+            WHEN labor_type.calculates_integral THEN COALESCE(bonus.integral_bonus, 0)
+            ELSE 0
+        END
+        FROM payroll_payrollbatchline batch_line
+        JOIN payroll_activity activity ON activity.id = batch_line.activity_id
+        JOIN payroll_labortype labor_type ON labor_type.id = activity.labor_type_id
+        LEFT JOIN (VALUES {bonuses}) AS bonus (field_worker_id, integral_bonus)
+            ON bonus.field_worker_id = batch_line.field_worker_id
+        WHERE line.id = batch_line.id AND batch_line.payroll_batch_id = %s
+    """
+
+    def calculate_batch(self, payroll_batch) -> int:
+        """
+        Weekly integral for every worker of the batch with a constant number
+        of queries: one grouped count of worked days and one UPDATE joined
+        to the per worker bonuses. Returns the number of updated lines.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(*self._update_integral_sql(payroll_batch))
+            return cursor.rowcount
+
+    def _update_integral_sql(self, payroll_batch):
+        """The UPDATE with the bonus of every worker who gets one as a VALUES list"""
+        worked_days_by_worker = PayrollBatchLine.objects.filter(
+            payroll_batch=payroll_batch,
+            activity__labor_type__calculates_integral=True
+        ).values('field_worker_id', 'field_worker__wage')\
+            .annotate(worked_days=Count('date', distinct=True))\
+            .order_by()
+
+        integral_bonus_field = PayrollBatchLine._meta.get_field('integral_bonus')
+        bonuses = []
+        for row in worked_days_by_worker:
+            daily_wage = (row['field_worker__wage'] or Decimal(0)) / Decimal(DAYS_OF_THE_MONTH)
+            integral_bonus = self._get_integral_bonus(daily_wage, row['worked_days'])
+            if integral_bonus > 0:
+                distributed_integral_bonus = Decimal(integral_bonus / row['worked_days'])
+                # Rounded like the per worker queryset update
+                bonuses += [
+                    row['field_worker_id'],
+                    integral_bonus_field.get_db_prep_save(distributed_integral_bonus, connection),
+                ]
+
+        # A row that matches no worker keeps the VALUES list valid without bonuses
+        rows = len(bonuses) // 2 or 1
+        bonuses = bonuses or [None, None]
+        sql = self.UPDATE_INTEGRAL_SQL.format(bonuses=", ".join(["(%s::bigint, %s::numeric)"] * rows))
+        return sql, [*bonuses, getattr(payroll_batch, 'pk', payroll_batch)]
+
+    def apply_batch(self, lines) -> None:
+        """
+        Weekly integral in memory for lines with their activity's labor type loaded.
+        Every worker's lines of the batch must be included.
+        """
+        worker_groups = defaultdict(list)
+        for line in lines:
+            worker_groups[line.field_worker_id].append(line)
+
+        for worker_lines in worker_groups.values():
+            integral_lines = [
+                line for line in worker_lines
+                if line.activity.labor_type.calculates_integral
+            ]
+            worked_days = len({line.date for line in integral_lines})
+            integral_bonus = self._calculate_integral_bonus(worker_lines[0].field_worker, worked_days)
+
+            for line in worker_lines:
+                line.integral_bonus = Decimal(0)
+            if integral_bonus > 0:
+                distributed_integral_bonus = Decimal(integral_bonus / worked_days)
+                for line in integral_lines:
+                    line.integral_bonus = distributed_integral_bonus
+
     def _calculate_weekly_integral_for_worker(self, worker, payroll_batch):
         # Clear all integral bonuses
         self._clear_integral_bonuses(worker, payroll_batch)
@@ -203,6 +415,9 @@ class WeekLevelCalculator(BasePayrollCalculator):
     
     def _calculate_integral_bonus(self, worker_wage, worked_days):
         worker_daily_wage = self._get_daily_wage(worker_wage)
+        return self._get_integral_bonus(worker_daily_wage, worked_days)
+
+    def _get_integral_bonus(self, worker_daily_wage, worked_days):
         if worked_days >= 5:
             return worker_daily_wage * 2
         elif worked_days == 4:
@@ -224,3 +439,115 @@ class WeekLevelCalculator(BasePayrollCalculator):
 
     
 
+class SqlBatchCalculator(BasePayrollCalculator):
+    """
+    In-database version of the inline, day and week calculators.
+    A whole batch is calculated by a single UPDATE: window sums over
+    (worker, date) give the same-day proportions and a grouped count of
+    distinct dates gives the weekly integral. Lines never leave PostgreSQL.
+    """
+    CALCULATE_BATCH_SQL = """
+        WITH batch_lines AS (
+            SELECT
+                line.id,
+                line.field_worker_id,
+                line.date,
+                COALESCE(worker.wage, 0) / %(days_of_the_month)s AS daily_wage,
+                worker.wage / %(days_of_the_month)s / %(work_hours_per_day)s
+                    * %(extra_hour_multiplier)s AS extra_hour_wage,
+                line.quantity * COALESCE(tariff.cost_per_unit, 0) AS total_cost,
+                EXTRACT(ISODOW FROM line.date) >= 6 AS is_weekend,
+                labor_type.calculates_integral
+            FROM payroll_payrollbatchline line
+            JOIN payroll_payrollbatch batch ON batch.id = line.payroll_batch_id
+            JOIN payroll_fieldworker worker ON worker.id = line.field_worker_id
+            JOIN payroll_activity activity ON activity.id = line.activity_id
+            JOIN payroll_labortype labor_type ON labor_type.id = activity.labor_type_id
+            LEFT JOIN payroll_tariff tariff
+                ON tariff.activity_id = line.activity_id AND tariff.farm_id = batch.farm_id
+            WHERE line.payroll_batch_id = %(batch_id)s
+        ),
+        worked_days AS (
+            SELECT field_worker_id, COUNT(DISTINCT date) AS worked_days
+            FROM batch_lines
+            WHERE calculates_integral
+            GROUP BY field_worker_id
+        ),
+        day_totals AS (
+            SELECT
+                batch_lines.*,
+                COUNT(*) OVER same_day AS day_lines,
+                SUM(total_cost) OVER same_day AS day_total_cost
+            FROM batch_lines
+            WINDOW same_day AS (PARTITION BY field_worker_id, date)
+        ),
+        proportions AS (
+            SELECT
+                day_totals.*,
+                CASE
+                    WHEN day_lines > 1 AND day_total_cost <> 0 THEN total_cost / day_total_cost
+                    ELSE 1
+                END AS proportion,
+                CASE
+                    WHEN day_lines > 1 AND day_total_cost <> 0 THEN
+                        CASE WHEN is_weekend THEN day_total_cost ELSE day_total_cost - daily_wage END
+                        * total_cost / day_total_cost
+                    WHEN is_weekend THEN total_cost
+                    ELSE GREATEST(total_cost - daily_wage, 0)
+                END AS salary_surplus
+            FROM day_totals
+        ),
+        results AS (
+            SELECT
+                proportions.*,
+                salary_surplus * %(extra_hours_percentage)s / 100 AS extra_hours_value,
+                COALESCE(worked_days.worked_days, 0) AS worked_days
+            FROM proportions
+            LEFT JOIN worked_days USING (field_worker_id)
+        )
+        UPDATE payroll_payrollbatchline line
+        SET
+            total_cost = results.total_cost,
+            salary_surplus = results.salary_surplus,
+            mobilization_bonus = results.salary_surplus * %(mobilization_percentage)s / 100,
+            extra_hours_value = results.extra_hours_value,
+            extra_hours_qty = CASE
+                WHEN results.extra_hours_value > 0
+                THEN COALESCE(results.extra_hours_value / NULLIF(results.extra_hour_wage, 0), 0)
+                ELSE 0
+            END,
+            thirteenth_bonus = results.extra_hours_value + CASE
+                WHEN results.is_weekend THEN 0
+                ELSE results.daily_wage * results.proportion / %(months_in_year)s
+            END,
+            fourteenth_bonus = %(basic_monthly_wage)s / %(months_in_year)s
+                / %(days_of_the_month)s * results.proportion,
+            integral_bonus = CASE
+                WHEN NOT results.calculates_integral THEN 0
+                WHEN results.worked_days >= 5 THEN results.daily_wage * 2 / results.worked_days
+                WHEN results.worked_days = 4 THEN results.daily_wage / results.worked_days
+                ELSE 0
+            END
+        FROM results
+        WHERE line.id = results.id
+    """
+
+    def calculate(self, context: Dict[str, Any]) -> None:
+        self.calculate_batch(context['payroll_batch'].pk)
+
+    def calculate_batch(self, batch_id:int) -> int:
+        """Calculate every line of the batch in place, returns the number of updated lines"""
+        config = get_payroll_config()
+        params = {
+            'batch_id': batch_id,
+            'mobilization_percentage': config.mobilization_percentage,
+            'extra_hours_percentage': config.extra_hours_percentage,
+            'extra_hour_multiplier': config.extra_hour_multiplier,
+            'basic_monthly_wage': config.basic_monthly_wage,
+            'days_of_the_month': DAYS_OF_THE_MONTH,
+            'work_hours_per_day': WORK_HOURS_PER_DAY,
+            'months_in_year': MONTHS_IN_YEAR,
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(self.CALCULATE_BATCH_SQL, params)
+            return cursor.rowcount
@@ -1,3 +1,23 @@
 WORK_HOURS_PER_DAY = 8
 DAYS_OF_THE_MONTH = 30
 MONTHS_IN_YEAR = 12
+
+# Calculation backends for whole batch calculations
+CALCULATION_BACKEND_PYTHON = "python"
+CALCULATION_BACKEND_COLUMNAR = "columnar"
+CALCULATION_BACKEND_FUSED = "fused"
+CALCULATION_BACKEND_SQL = "sql"
+
+CALCULATION_BACKEND_CHOICES = [
+    (CALCULATION_BACKEND_PYTHON, 'Python'),
+    (CALCULATION_BACKEND_COLUMNAR, 'Columnar'),
+    (CALCULATION_BACKEND_FUSED, 'Fused'),
+    (CALCULATION_BACKEND_SQL, 'SQL'),
+]
+
+# Stages of a batch import, as reported by its progress record
+IMPORT_STAGE_QUEUED = "queued"
+IMPORT_STAGE_READING = "reading"
+IMPORT_STAGE_CALCULATING = "calculating"
+IMPORT_STAGE_DONE = "done"
+IMPORT_STAGE_ERROR = "error"
@@ -0,0 +1,82 @@
+"""
+Streamed spreadsheet exports of the payroll lines
+"""
+import csv
+import tempfile
+from typing import Iterator
+from django.conf import settings
+
+# (header, lookup) of the exported columns. The first four are the import
+# columns, so an edited export can be uploaded back as a re-import
+EXPORT_COLUMNS = [
+    ("date", "date"),
+    ("field_worker", "field_worker__identification_number"),
+    ("activity", "activity__name"),
+    ("quantity", "quantity"),
+    ("field_worker_name", "field_worker__name"),
+    ("labor_type", "activity__labor_type__code"),
+    ("iso_week", "iso_week"),
+    ("total_cost", "total_cost"),
+    ("salary_surplus", "salary_surplus"),
+    ("mobilization_bonus", "mobilization_bonus"),
+    ("extra_hours_value", "extra_hours_value"),
+    ("extra_hours_qty", "extra_hours_qty"),
+    ("thirteenth_bonus", "thirteenth_bonus"),
+    ("fourteenth_bonus", "fourteenth_bonus"),
+    ("integral_bonus", "integral_bonus"),
+]
+EXPORT_FORMATS = ("csv", "xlsx")
+EXPORT_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+class _Echo:
+    """File-like object that hands back what it is given to write"""
+
+    def write(self, value):
+        return value
+
+
+class PayrollLineExporter:
+    """
+    Writes the lines of a queryset as CSV or XLSX rows.
+    Lines are read as value tuples through a server-side cursor,
+    chunk_size rows at a time, so memory stays flat whatever the batch size.
+    XLSX needs openpyxl, imported when used.
+    """
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or settings.PAYROLL_EXPORT_CHUNK_SIZE
+
+    def iter_rows(self, queryset) -> Iterator[tuple]:
+        rows = queryset.order_by('date', 'field_worker__identification_number', 'id')\
+            .values_list(*(lookup for _header, lookup in EXPORT_COLUMNS))
+        return rows.iterator(chunk_size=self.chunk_size)
+
+    def stream_csv(self, queryset) -> Iterator[str]:
+        """CSV lines, the header goes out before the first query runs"""
+        writer = csv.writer(_Echo())
+        yield writer.writerow([header for header, _lookup in EXPORT_COLUMNS])
+        for row in self.iter_rows(queryset):
+            yield writer.writerow(row)
+
+    def write_xlsx(self, queryset):
+        """
+        A zip archive can't be streamed while it's written, the workbook is
+        written row by row to a temporary file that is then streamed.
+        """
+        from openpyxl import Workbook
+
+        # Write-only sheets keep no rows in memory
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("Payroll lines")
+        sheet.append([header for header, _lookup in EXPORT_COLUMNS])
+        for row in self.iter_rows(queryset):
+            sheet.append(row)
+
+        export_file = tempfile.TemporaryFile()
+        workbook.save(export_file)
+        export_file.seek(0)
+        return export_file
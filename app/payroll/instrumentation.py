@@ -0,0 +1,123 @@
+"""
+Per-stage metrics of the batch import and calculation tasks
+"""
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, JSONField, Value
+from django.db.models.expressions import CombinedExpression
+from django.utils import timezone
+from .models import PayrollBatch
+
+
+class StageMetrics:
+    """
+    Measures of a stage, rows must be set by the stage itself.
+    A stage can be measured several times, e.g. once per chunk of a
+    streamed file, and its measures add up.
+
+    Memory measures:
+    - peak_memory: peak of the Python allocations of the stage, the real
+      per-stage peak. Only taken with PAYROLL_STAGE_MEMORY_TRACING.
+    - rss_growth: how much the stage raised the resident memory high-water
+      mark of the process. 0 when the stage stayed under an earlier peak,
+      e.g. in a long-lived worker, so it is a lower bound of its needs.
+    - process_max_rss: high-water mark of the process when the stage ended,
+      it includes every earlier stage and task of the process.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.queries = 0
+        self.duration = None
+        self.peak_memory = None
+        self.rss_growth = None
+        self.process_max_rss = None
+        self.failed = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper, counts the queries of the stage
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def add_rows(self, rows) -> None:
+        self.rows = (self.rows or 0) + rows
+
+    @contextmanager
+    def measure(self):
+        """
+        Add the duration, queries and memory of the block to the stage.
+        tracemalloc peaks are only taken with PAYROLL_STAGE_MEMORY_TRACING,
+        tracing slows the stage down several times.
+        """
+        trace_memory = settings.PAYROLL_STAGE_MEMORY_TRACING and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start()
+
+        started = time.perf_counter()
+        max_rss_before = _get_max_rss()
+        try:
+            with connection.execute_wrapper(self):
+                yield self
+        except Exception:
+            self.failed = True
+            raise
+        finally:
+            self.duration = round((self.duration or 0) + time.perf_counter() - started, 6)
+            if trace_memory:
+                _current, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.peak_memory = max(self.peak_memory or 0, peak_memory)
+            self.process_max_rss = _get_max_rss()
+            self.rss_growth = (self.rss_growth or 0) + self.process_max_rss - max_rss_before
+
+    def as_dict(self):
+        return {
+            'duration': self.duration,
+            'queries': self.queries,
+            'rows': self.rows,
+            'peak_memory': self.peak_memory,
+            'rss_growth': self.rss_growth,
+            'process_max_rss': self.process_max_rss,
+            'failed': self.failed,
+            'recorded_at': timezone.now().isoformat(),
+        }
+
+
+@contextmanager
+def measure_stage(batch_id, name):
+    """
+    Record the duration, query count, rows touched and memory of a stage
+    and store them in the batch metrics under the stage name.
+    """
+    stage = StageMetrics(name)
+    try:
+        with stage.measure():
+            yield stage
+    finally:
+        record_stage(batch_id, stage)
+
+
+def record_stage(batch_id, stage: StageMetrics) -> None:
+    # Merge in the database, stages of a batch may run in different workers
+    PayrollBatch.objects.filter(pk=batch_id).update(
+        metrics=CombinedExpression(
+            F('metrics'), '||', Value({stage.name: stage.as_dict()}, output_field=JSONField())
+        )
+    )
+
+
+def reset_metrics(batch_id) -> None:
+    PayrollBatch.objects.filter(pk=batch_id).update(metrics={})
+
+
+def _get_max_rss() -> int:
+    """Peak resident memory of the process in bytes"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
@@ -0,0 +1,179 @@
+"""
+Benchmark of the payroll calculation hot paths on a synthetic workload.
+Everything runs inside a transaction that is rolled back at the end.
+The calculation tasks dispatched by the import run in process, so the
+import figures include them.
+The line searches of the API filters run last, on the lines of the workload.
+
+    python manage.py benchmark_payroll --workers 1000 --activities-per-day 3 --output report.json
+
+Searches on a million lines, inserted directly instead of imported:
+
+    python manage.py benchmark_payroll --workers 48000 --activities-per-day 3 --skip-calculation --skip-memory
+"""
+import json
+import platform
+import django
+from celery import current_app
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from payroll.benchmarks import SyntheticPayrollWorkload, BenchmarkRunner
+from payroll.caches import TariffIndex, get_payroll_config
+from payroll.calculators import InlineCalculator
+from payroll.filters import FieldWorkerFilter, PayrollLineFilter
+from payroll.models import FieldWorker, PayrollBatchLine
+from payroll.orchestrators import PayrollCalculationOrchestrator
+from payroll.tasks import (
+    batch_day_level_calculation_task,
+    batch_week_level_calculation_task,
+    import_payroll_file,
+)
+
+
+class Command(BaseCommand):
+    help = "Time the payroll calculation hot paths on a synthetic workload"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=100)
+        parser.add_argument("--activities-per-day", type=int, default=2)
+        parser.add_argument("--activities", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--skip-memory", action="store_true", help="Don't run the traced pass for peak memory"
+        )
+        parser.add_argument(
+            "--skip-calculation",
+            action="store_true",
+            help="Insert the lines directly and only time the searches",
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        workload = SyntheticPayrollWorkload(
+            workers=options["workers"],
+            activities_per_day=options["activities_per_day"],
+            activities=options["activities"],
+            seed=options["seed"],
+        )
+        runner = BenchmarkRunner(trace_memory=not options["skip_memory"])
+
+        # Calculation tasks dispatched by the import run in process
+        eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True
+        try:
+            with transaction.atomic():
+                workload.create_reference_data()
+                batch = workload.create_batch()
+                if options["skip_calculation"]:
+                    workload.create_lines(batch)
+                else:
+                    self._run(workload, batch, runner)
+                self._run_searches(workload, batch, runner)
+                transaction.set_rollback(True)
+        finally:
+            current_app.conf.task_always_eager = eager
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "database_version": ".".join(map(str, connection.get_database_version())),
+            },
+            "parameters": {
+                "workers": workload.worker_count,
+                "activities_per_day": workload.activities_per_day,
+                "activities": workload.activity_count,
+                "lines": workload.line_count,
+                "seed": options["seed"],
+                "skip_calculation": options["skip_calculation"],
+            },
+            "results": runner.results,
+        }
+        output = json.dumps(report, indent=2)
+
+        if options["output"]:
+            with open(options["output"], "w") as report_file:
+                report_file.write(output)
+            self.stdout.write(f"Benchmark report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    def _run(self, workload, batch, runner):
+        csv_content = workload.build_frame().to_csv(index=False).encode()
+        lines = PayrollBatchLine.objects.filter(payroll_batch=batch)
+
+        def upload_file():
+            lines.delete()
+            temp_path = default_storage.save(
+                "temp_payroll_files/benchmark.csv", ContentFile(csv_content)
+            )
+            return batch.pk, temp_path
+
+        # Warm the shared caches like a running worker would have them
+        get_payroll_config()
+        TariffIndex().load_farm(batch.farm_id)
+
+        runner.run("import_payroll_file", import_payroll_file, upload_file)
+        runner.run(
+            "InlineCalculator.calculate_batch",
+            InlineCalculator().calculate_batch,
+            lambda: (lines.select_related('field_worker', 'payroll_batch'),),
+        )
+        runner.run(
+            "batch_day_level_calculation_task",
+            batch_day_level_calculation_task,
+            lambda: (batch.pk,),
+        )
+        runner.run(
+            "batch_week_level_calculation_task",
+            batch_week_level_calculation_task,
+            lambda: (batch.pk,),
+        )
+
+        line = lines.order_by('pk')[workload.line_count // 2]
+
+        def edit_line():
+            line.quantity += 1
+            line.save(update_fields=['quantity'])
+            return (line.pk,)
+
+        runner.run("recalculate_line", PayrollCalculationOrchestrator().recalculate_line, edit_line)
+
+    def _run_searches(self, workload, batch, runner):
+        """First page and count of the icontains searches of the API filters"""
+        # Fresh statistics, the planner would guess on the new lines otherwise
+        with connection.cursor() as cursor:
+            for model in (FieldWorker, PayrollBatchLine):
+                cursor.execute(f'ANALYZE "{model._meta.db_table}"')
+
+        worker = workload.workers[len(workload.workers) // 2]
+        line_searches = {
+            "field_worker__name": worker.name,
+            "field_worker__id": worker.identification_number[-6:],
+            "activity__name": workload.activities[-1].name,
+            "payroll_batch__name": batch.name,
+        }
+        for field, value in line_searches.items():
+            runner.run(
+                f"PayrollLineFilter.{field}",
+                self._search,
+                lambda field=field, value=value: (PayrollLineFilter, PayrollBatchLine, {field: value}),
+            )
+        runner.run(
+            "FieldWorkerFilter.name",
+            self._search,
+            lambda: (FieldWorkerFilter, FieldWorker, {"name": worker.name}),
+        )
+
+    @staticmethod
+    def _search(filterset_class, model, params):
+        # What a limit/offset page of the API runs
+        queryset = filterset_class(params, queryset=model.objects.all()).qs
+        queryset.count()
+        list(queryset[:api_settings.PAGE_SIZE])
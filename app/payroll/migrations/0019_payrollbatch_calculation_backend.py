@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-17 00:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payroll", "0018_payrollbatch_error_message"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payrollbatch",
+            name="calculation_backend",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("python", "Python"),
+                    ("columnar", "Columnar"),
+                    ("fused", "Fused"),
+                    ("sql", "SQL"),
+                ],
+                max_length=20,
+                null=True,
+            ),
+        ),
+    ]
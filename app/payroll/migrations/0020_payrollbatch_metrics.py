@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 01:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payroll", "0019_payrollbatch_calculation_backend"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payrollbatch",
+            name="metrics",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-17 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payroll", "0020_payrollbatch_metrics"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payrollbatchline",
+            index=models.Index(
+                fields=["date", "created_at", "id"], name="payroll_line_keyset_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payrollbatchline",
+            index=models.Index(
+                fields=["payroll_batch", "date", "created_at", "id"],
+                name="payroll_line_batch_keyset_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+def trigram_index(field_name, name):
+    # Same expression as payroll.models.trigram_index, frozen for this migration
+    return django.contrib.postgres.indexes.GinIndex(
+        django.contrib.postgres.indexes.OpClass(
+            django.db.models.functions.text.Upper(
+                django.db.models.functions.comparison.Cast(field_name, models.TextField())
+            ),
+            name="gin_trgm_ops",
+        ),
+        name=name,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payroll", "0021_payrollbatchline_keyset_indexes"),
+    ]
+
+    operations = [
+        # CREATE EXTENSION pg_trgm needs the CREATE privilege on the database,
+        # a deploy role without it fails here. Have a superuser run
+        # "CREATE EXTENSION IF NOT EXISTS pg_trgm" first, this step then
+        # does nothing.
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name="activity",
+            index=trigram_index("name", "payroll_activity_name_trgm_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="fieldworker",
+            index=trigram_index("name", "payroll_worker_name_trgm_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="fieldworker",
+            index=trigram_index("identification_number", "payroll_worker_idnum_trgm_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="payrollbatch",
+            index=trigram_index("name", "payroll_batch_name_trgm_idx"),
+        ),
+    ]
@@ -1,8 +1,22 @@
 from decimal import Decimal
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Cast, Upper
 from django.forms import ValidationError
 from django.utils import timezone
 from django.conf import settings
+from .constants import CALCULATION_BACKEND_CHOICES
+
+
+def trigram_index(field_name, name) -> GinIndex:
+    """
+    pg_trgm index for the icontains lookups on a column, e.g. search as you type.
+    It indexes the UPPER(column::text) expression the lookups compare on.
+    """
+    return GinIndex(
+        OpClass(Upper(Cast(field_name, models.TextField())), name='gin_trgm_ops'),
+        name=name,
+    )
 
 
 class PayrollConfigurationManager(models.Manager):
@@ -36,9 +50,12 @@ class PayrollConfiguration(models.Model):
     objects = PayrollConfigurationManager()
 
     def save(self, *args, **kwags):
+        from .caches import config_cache
+
         # Ensure only one instance exists
         self.pk = 1
         super().save(*args, **kwags)
+        config_cache.invalidate()
 
     def delete(self, *args, **kwags):
         # Prevent deletion
@@ -80,6 +97,8 @@ class FieldWorker(models.Model):
             models.Index(fields=['odoo_employee_id']),
             models.Index(fields=['odoo_contract_id']),
             models.Index(fields=['is_active']),
+            trigram_index('name', 'payroll_worker_name_trgm_idx'),
+            trigram_index('identification_number', 'payroll_worker_idnum_trgm_idx'),
         ]
 
 class Farm(models.Model):
@@ -153,6 +172,7 @@ class Activity(models.Model):
         indexes = [
             models.Index(fields=['activity_group']),
             models.Index(fields=['labor_type']),
+            trigram_index('name', 'payroll_activity_name_trgm_idx'),
         ]
 
 class Tariff(models.Model):
@@ -190,6 +210,12 @@ class PayrollBatch(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
     error_message = models.TextField(null=True, blank=True)
+    # Overrides settings.PAYROLL_CALCULATION_BACKEND for this batch
+    calculation_backend = models.CharField(
+        max_length=20, choices=CALCULATION_BACKEND_CHOICES, null=True, blank=True
+    )
+    # Duration, queries, rows and memory of the last import and calculation stages
+    metrics = models.JSONField(default=dict, blank=True)
 
     def save(self, *args, **kwags):
         year, week, _weekday = self.start_date.isocalendar()
@@ -197,6 +223,14 @@ class PayrollBatch(models.Model):
         self.iso_year = year
         super().save(*args, **kwags)
 
+    def get_calculation_backend(self) -> str:
+        return self.calculation_backend or settings.PAYROLL_CALCULATION_BACKEND
+
+    class Meta:
+        indexes = [
+            trigram_index('name', 'payroll_batch_name_trgm_idx'),
+        ]
+
 class PayrollBatchLine(models.Model):
     # Input fields
     payroll_batch = models.ForeignKey(PayrollBatch, on_delete=models.CASCADE)
@@ -233,10 +267,12 @@ class PayrollBatchLine(models.Model):
         super().save(*args, **kwags)
     
     def clean(self):
+        from .caches import get_payroll_config
+
         super().clean()
 
         # Get daily limit from Payroll config
-        daily_limit = PayrollConfiguration.objects.get_config().daily_payroll_line_worker_limit
+        daily_limit = get_payroll_config().daily_payroll_line_worker_limit
 
         if daily_limit and daily_limit > 0:
             existing_count = PayrollBatchLine.objects.filter(
@@ -254,6 +290,11 @@ class PayrollBatchLine(models.Model):
             models.Index(fields=['payroll_batch']),
             models.Index(fields=['field_worker']),
             models.Index(fields=['date']),
+            # Keyset pagination in the default ordering, over all lines and per batch
+            models.Index(fields=['date', 'created_at', 'id'], name='payroll_line_keyset_idx'),
+            models.Index(
+                fields=['payroll_batch', 'date', 'created_at', 'id'], name='payroll_line_batch_keyset_idx'
+            ),
         ]
         constraints = [
             models.UniqueConstraint(
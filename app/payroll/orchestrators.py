@@ -1,71 +1,303 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List
 from django.db import transaction
-from .calculators import InlineCalculator, DayLevelCalculator, WeekLevelCalculator
-from .models import PayrollBatchLine
+from django.db.models import Subquery
+from .calculators import (
+    InlineCalculator,
+    DayLevelCalculator,
+    WeekLevelCalculator,
+    SqlBatchCalculator
+)
+from .models import Activity, FieldWorker, PayrollBatch, PayrollBatchLine
+from .caches import TariffIndex, bump_batch_version, get_payroll_config
+from .payroll_processor import (
+    DuplicateRowFilter,
+    PayrollFileProcessor,
+    PayrollFileValidator,
+    ReferenceResolver,
+)
+
+OUTPUT_FIELDS = [
+    'total_cost',
+    'salary_surplus',
+    'mobilization_bonus',
+    'extra_hours_value',
+    'extra_hours_qty',
+    'thirteenth_bonus',
+    'fourteenth_bonus',
+    'integral_bonus',
+]
+OUTPUT_PRECISION = Decimal('0.001')
 
 class PayrollCalculationOrchestrator:
     """
     Orchestrates the calculation flow
     """
 
-    def __init__(self):
-        self.inline_calculator = InlineCalculator()
-        self.day_calculator = DayLevelCalculator()
-        self.week_calculator = WeekLevelCalculator()
+    def __init__(self, tariff_index: TariffIndex = None):
+        # All calculators share one tariff index
+        self.tariff_index = tariff_index or TariffIndex()
+        self.inline_calculator = InlineCalculator(self.tariff_index)
+        self.day_calculator = DayLevelCalculator(self.tariff_index)
+        self.week_calculator = WeekLevelCalculator(self.tariff_index)
     
     @transaction.atomic
-    def recalculate_line(self, line_id:int, recalc_week:bool=True) -> None:
-        """Main entry point for line recalculation"""
-        line = PayrollBatchLine.objects.select_related(
-            'field_worker',
-            'payroll_batch',
-            'activity'
-        ).get(id=line_id)
+    def calculate_batch(self, batch_id:int, bulk_batch_size:int=1000) -> int:
+        """
+        Fused calculation of a whole batch.
+        Loads the lines once, runs the inline, day and week stages in memory
+        and persists everything with one bulk write. The batch is marked
+        ready in the same commit.
+        """
+        lines = self._load_worker_lines(payroll_batch_id=batch_id)
+
+        self.calculate_lines(lines)
+        PayrollBatchLine.objects.bulk_update(lines, OUTPUT_FIELDS, batch_size=bulk_batch_size)
+
+        PayrollBatch.objects.filter(pk=batch_id).update(status='ready', error_message=None)
+        bump_batch_version(batch_id)
+        return len(lines)
+
+    @transaction.atomic
+    def calculate_workers(self, batch_id:int, field_worker_ids, bulk_batch_size:int=1000) -> int:
+        """
+        Fused calculation of some workers of a batch, the batch status is
+        left alone. Day and week values never cross workers, so disjoint
+        sets of workers can be calculated in parallel.
+        """
+        lines = self._load_worker_lines(payroll_batch_id=batch_id, field_worker_id__in=field_worker_ids)
+
+        self.calculate_lines(lines)
+        PayrollBatchLine.objects.bulk_update(lines, OUTPUT_FIELDS, batch_size=bulk_batch_size)
+        bump_batch_version(batch_id)
+        return len(lines)
+
+    @transaction.atomic
+    def calculate_batch_in_database(self, batch_id:int) -> int:
+        """
+        Same as calculate_batch, but the calculation runs inside
+        PostgreSQL and no line is loaded into Python.
+        """
+        line_count = SqlBatchCalculator(self.tariff_index).calculate_batch(batch_id)
+
+        PayrollBatch.objects.filter(pk=batch_id).update(status='ready', error_message=None)
+        bump_batch_version(batch_id)
+        return line_count
+
+    def calculate_lines(self, lines) -> None:
+        """Run every calculation stage in memory, in order"""
+        for line in lines:
+            self.inline_calculator.apply(line)
+
+        self.day_calculator.apply_batch(lines)
+        self.week_calculator.apply_batch(lines)
+
+    @transaction.atomic
+    def recalculate_line(self, line_id:int, recalc_week:bool=True) -> int:
+        """
+        Main entry point for line recalculation.
+        Loads the worker's lines of the batch once, recalculates the line,
+        its day and optionally its week in memory and writes only the lines
+        whose values changed. Returns the number of written lines.
+        """
+        line_slice = PayrollBatchLine.objects.filter(pk=line_id)
+        lines = self._load_worker_lines(
+            field_worker_id=Subquery(line_slice.values('field_worker_id')),
+            payroll_batch_id=Subquery(line_slice.values('payroll_batch_id')),
+        )
+        line = next((line for line in lines if line.pk == line_id), None)
+        if line is None:
+            raise PayrollBatchLine.DoesNotExist(f"PayrollBatchLine {line_id} does not exist")
+
+        previous_values = self._get_output_values(lines)
 
         # Step 1: Inline calculations
-        self.inline_calculator.calculate({
-            'line': line
-        })
+        self.inline_calculator.apply(line)
 
         # Step 2: Day-level recalculation if needed
-        if self._needs_day_recalculation(line):
-            self._apply_day_calculations(line)
+        day_lines = [day_line for day_line in lines if day_line.date == line.date]
+        if len(day_lines) > 1:
+            self.day_calculator.apply_day(day_lines)
 
         # Step 3: Week-level recalculation if needed
         if recalc_week:
-            self._apply_week_recalculation(line)
-    
-    def _needs_day_recalculation(self, line) -> bool:
-        return PayrollBatchLine.objects.filter(
-            field_worker=line.field_worker,
-            payroll_batch=line.payroll_batch,
-            date=line.date
-        ).count() > 1
-
-    def _apply_day_calculations(self, line):
-        self.day_calculator.calculate({
-            'worker': line.field_worker,
-            'payroll_batch': line.payroll_batch,
-            'date': line.date
-        })
-    
-    def _apply_week_recalculation(self, line):
-        self.week_calculator.calculate({
-            'worker': line.field_worker,
-            'payroll_batch': line.payroll_batch
-        })
-    
+            self.week_calculator.apply_batch(lines)
+
+        return self._write_changed_lines(lines, previous_values)
+
     @transaction.atomic
-    def recalculate_after_deletion(self, worker, payroll_batch, date):
-        """Recalculate after a line is deleted"""
+    def recalculate_after_deletion(self, worker, payroll_batch, date) -> int:
+        """Recalculate after a line is deleted, returns the number of written lines"""
+        lines = self._load_worker_lines(field_worker=worker, payroll_batch=payroll_batch)
+        previous_values = self._get_output_values(lines)
+
         # Recalculate day porportions for remaining lines
-        self.day_calculator.calculate({
-            'worker': worker,
-            'payroll_batch': payroll_batch,
-            'date': date
-        })
+        day_lines = [line for line in lines if line.date == date]
+        if day_lines:
+            self.day_calculator.apply_day(day_lines)
 
         # Recalculate week bonuses
-        self.week_calculator.calculate({
-            'worker': worker,
-            'payroll_batch': payroll_batch
-        })
\ No newline at end of file
+        self.week_calculator.apply_batch(lines)
+
+        return self._write_changed_lines(lines, previous_values)
+
+    @transaction.atomic
+    def recalculate_worker_days(self, batch_id:int, worker_days) -> int:
+        """
+        Recalculate the given (field_worker_id, date) pairs of a batch and the
+        weeks of their workers, e.g. after a re-import. Lines of other days
+        keep their values. Returns the number of written lines.
+        """
+        worker_ids = {worker_id for worker_id, _date in worker_days}
+        if not worker_ids:
+            return 0
+        lines = self._load_worker_lines(payroll_batch_id=batch_id, field_worker_id__in=worker_ids)
+        previous_values = self._get_output_values(lines)
+
+        day_groups = defaultdict(list)
+        for line in lines:
+            if (line.field_worker_id, line.date) in worker_days:
+                day_groups[(line.field_worker_id, line.date)].append(line)
+
+        for day_lines in day_groups.values():
+            for line in day_lines:
+                self.inline_calculator.apply(line)
+            if len(day_lines) > 1:
+                self.day_calculator.apply_day(day_lines)
+
+        self.week_calculator.apply_batch(lines)
+
+        return self._write_changed_lines(lines, previous_values)
+
+    def _load_worker_lines(self, **filters) -> List[PayrollBatchLine]:
+        return list(
+            PayrollBatchLine.objects.filter(**filters).select_related(
+                'field_worker',
+                'payroll_batch',
+                'activity__labor_type'
+            )
+        )
+
+    def _get_output_values(self, lines) -> Dict[int, tuple]:
+        return {
+            line.pk: tuple(_round_output(getattr(line, field)) for field in OUTPUT_FIELDS)
+            for line in lines
+        }
+
+    def _write_changed_lines(self, lines, previous_values) -> int:
+        current_values = self._get_output_values(lines)
+        changed_lines = [
+            line for line in lines
+            if current_values[line.pk] != previous_values[line.pk]
+        ]
+        if changed_lines:
+            PayrollBatchLine.objects.bulk_update(changed_lines, OUTPUT_FIELDS)
+            bump_batch_version(changed_lines[0].payroll_batch_id)
+
+        return len(changed_lines)
+
+class PayrollImportPreview:
+    """
+    Validates an import file and runs it through every calculation stage
+    in memory, with the tariffs, wages and config preloaded.
+    Nothing is written to the database.
+    """
+
+    def __init__(self, orchestrator: PayrollCalculationOrchestrator = None):
+        self.orchestrator = orchestrator or PayrollCalculationOrchestrator()
+
+    def preview_file(self, batch: PayrollBatch, full_path: str) -> Dict:
+        """Errors of the file and projected totals of its valid rows"""
+        processor = PayrollFileProcessor()
+        df = processor.clean_columns(processor.read_file(full_path))
+        row_count = len(df)
+
+        resolver = ReferenceResolver()
+        validator = PayrollFileValidator(
+            start_date=batch.start_date, end_date=batch.end_date, resolver=resolver, payroll_batch=batch
+        )
+        errors = validator.validate_structure(df)
+        if errors:
+            return self._build_preview(row_count, errors, [])
+
+        # Dates are parsed after validation, so bad ones are reported by row
+        df = DuplicateRowFilter().drop_duplicates(df)
+        errors = validator.validate_data(df)
+        # Rows with errors are left out of the totals
+        invalid_rows = {error.row_number - 2 for error in errors}
+        df = processor.clean_data(df[~df.index.isin(invalid_rows)].copy())
+
+        lines = self._build_lines(batch, df, resolver)
+        self.orchestrator.calculate_lines(lines)
+        return self._build_preview(row_count, errors, lines)
+
+    def _build_lines(self, batch, df, resolver) -> List[PayrollBatchLine]:
+        """Unsaved lines with their workers, activities and batch attached"""
+        workers = FieldWorker.objects.in_bulk(
+            [resolver.field_worker_ids[key] for key in df['field_worker'].unique()]
+        )
+        activities = Activity.objects.select_related('labor_type').in_bulk(
+            [resolver.activity_ids[key] for key in df['activity'].unique()]
+        )
+        self.orchestrator.tariff_index.load_farm(batch.farm_id)
+        get_payroll_config()
+
+        return [
+            PayrollBatchLine(
+                payroll_batch=batch,
+                field_worker=workers[resolver.field_worker_ids[row.field_worker]],
+                activity=activities[resolver.activity_ids[row.activity]],
+                date=row.date.date(),
+                quantity=Decimal(str(row.quantity)),
+            )
+            for row in df.itertuples(index=False)
+        ]
+
+    def _build_preview(self, row_count, errors, lines) -> Dict:
+        totals = _LineTotals()
+        workers = {}
+        activities = {}
+        for line in lines:
+            totals.add(line)
+            worker = line.field_worker
+            workers.setdefault(
+                worker.pk,
+                _LineTotals(field_worker=worker.identification_number, name=worker.name),
+            ).add(line)
+            activities.setdefault(line.activity_id, _LineTotals(activity=line.activity.name)).add(line)
+
+        return {
+            "rows": row_count,
+            "valid_rows": len(lines),
+            "errors": [{"row": error.row_number, "message": error.message} for error in errors],
+            "totals": totals.as_dict(),
+            "workers": [worker.as_dict() for worker in workers.values()],
+            "activities": [activity.as_dict() for activity in activities.values()],
+        }
+
+class _LineTotals:
+    """Running sums of the quantity and output fields of some lines"""
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.lines = 0
+        self.sums = dict.fromkeys(['quantity', *OUTPUT_FIELDS], Decimal(0))
+
+    def add(self, line) -> None:
+        self.lines += 1
+        for field in self.sums:
+            self.sums[field] += getattr(line, field) or Decimal(0)
+
+    def as_dict(self) -> Dict:
+        return {
+            **self.labels,
+            "lines": self.lines,
+            **{field: _round_output(total) for field, total in self.sums.items()},
+        }
+
+def _round_output(value):
+    # Compare at the precision the database stores
+    if value is None:
+        return None
+    return Decimal(value).quantize(OUTPUT_PRECISION)
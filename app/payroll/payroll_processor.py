@@ -1,12 +1,32 @@
-from dataclasses import dataclass
-from typing import List
+import io
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+from typing import Iterator, List, Set, Tuple
+import numpy as np
 import pandas as pd
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from .caches import get_payroll_config
 from .models import (
     FieldWorker, 
     Activity,
     PayrollBatchLine
 )
 
+# Largest value of PayrollBatchLine.quantity, DecimalField(max_digits=10, decimal_places=3)
+MAX_QUANTITY = 9999999.999
+
+FILE_COLUMNS = ("date", "field_worker", "activity", "quantity")
+FILE_DATE_FORMAT = "%Y-%m-%d"
+# Columns kept as categoricals when reading columnar files
+CATEGORICAL_COLUMNS = ("field_worker", "activity")
+EXCEL_EXTENSIONS = ('.xls', '.xlsx')
+PARQUET_EXTENSIONS = ('.parquet',)
+# Arrow IPC files, feather v2 is the same format
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
 
 @dataclass
 class ValidationError:
@@ -16,24 +36,72 @@ class ValidationError:
     def __str__(self) -> str:
         return f"Row {self.row_number}: {self.message}"
 
+class ReferenceResolver:
+    """
+    Resolves the field workers and activities of a file to their ids.
+    Only the keys found in the file are fetched, as (identification_number, id)
+    and (name, id) pairs, so the cost follows the file and not the size of
+    the reference tables. Keys already looked up are not fetched again,
+    one resolver serves every chunk of a file.
+    """
+
+    def __init__(self):
+        self.field_worker_ids = {}
+        self.activity_ids = {}
+        self._looked_up_workers = set()
+        self._looked_up_activities = set()
+
+    def load(self, df: pd.DataFrame) -> None:
+        """Fetch the ids of the keys of df that were not looked up yet"""
+        workers = set(df['field_worker'].dropna().unique()) - self._looked_up_workers
+        if workers:
+            self.field_worker_ids.update(
+                FieldWorker.objects.filter(identification_number__in=workers)
+                .values_list('identification_number', 'id')
+            )
+            self._looked_up_workers |= workers
+
+        activities = set(df['activity'].dropna().unique()) - self._looked_up_activities
+        if activities:
+            self.activity_ids.update(
+                Activity.objects.filter(name__in=activities).values_list('name', 'id')
+            )
+            self._looked_up_activities |= activities
+
 class PayrollFileValidator:
     """Handles validation of payroll file data"""
 
-    def __init__(self, required_columns=None, valid_workers=None, valid_activities=None):
+    def __init__(self, required_columns=None, valid_workers=None, valid_activities=None,
+                 start_date=None, end_date=None, resolver=None, payroll_batch=None,
+                 existing_daily_counts=None):
         self.required_columns = required_columns or {"date", 'field_worker', 'activity', 'quantity'}
         self._valid_workers = valid_workers
         self._valid_activities = valid_activities
+        # Batch period, dates outside of it are rejected
+        self.start_date = start_date
+        self.end_date = end_date
+        # Shared with the batch creator, so references are fetched once
+        self.resolver = resolver or ReferenceResolver()
+        # Lines already in the batch count towards the daily limit, unless
+        # their counts per (identification_number, date) are given
+        self.payroll_batch = payroll_batch
+        self.existing_daily_counts = existing_daily_counts
+        # Rows per (field_worker, date) in the chunks already validated
+        self._daily_counts = _empty_daily_counts()
     
-    def _load_reference_data(self):
-        """Load reference data once for validation"""
-        if self._valid_workers is None:
-            self._valid_workers = set(
-                FieldWorker.objects.values_list('identification_number', flat=True)
-            )
-        if self._valid_activities is None:
-            self._valid_activities = set(
-                Activity.objects.values_list('name', flat=True)
-            )
+    def _load_reference_data(self, df: pd.DataFrame):
+        """Valid worker and activity keys of df, unless given"""
+        if self._valid_workers is None or self._valid_activities is None:
+            self.resolver.load(df)
+
+        valid_workers = self._valid_workers
+        if valid_workers is None:
+            valid_workers = self.resolver.field_worker_ids.keys()
+        valid_activities = self._valid_activities
+        if valid_activities is None:
+            valid_activities = self.resolver.activity_ids.keys()
+
+        return valid_workers, valid_activities
 
     def validate_structure(self, df: pd.DataFrame) -> List[ValidationError]:
         """Validate Dataframe structure and required columns"""
@@ -46,48 +114,206 @@ class PayrollFileValidator:
         return errors
 
     def validate_data(self, df: pd.DataFrame) -> List[ValidationError]:
-        """Validate data content row by row"""
-        self._load_reference_data()
-        errors = []
-        
-        for idx, row in df.iterrows():
-            row_num = idx + 2 # Account for header row and 0-indexing
+        """
+        Validate data content with column-wise checks.
+        Errors are ordered by row, then blank fields, references,
+        quantity, date and daily limit, like a row by row pass would
+        report them.
+        """
+        if df.empty:
+            return []
+        valid_workers, valid_activities = self._load_reference_data(df)
 
-            # Check for blank required fields
-            if pd.isna(row["date"]) or pd.isna(row["field_worker"]) or \
-            pd.isna(row["activity"]) or pd.isna(row["quantity"]):
-                errors.append(ValidationError(row_num, "One of the required fields is blank"))
-                continue
+        blank = df[["date", "field_worker", "activity", "quantity"]].isna().any(axis=1)
+        filled = ~blank
+        quantity = pd.to_numeric(df["quantity"], errors="coerce")
+        numeric_quantity = quantity.notna()
+        dates = pd.to_datetime(df["date"], format=FILE_DATE_FORMAT, errors="coerce")
+        valid_worker = df["field_worker"].isin(valid_workers)
 
-            # Validate references
-            if row['field_worker'] not in self._valid_workers:
-                errors.append(ValidationError(row_num, f"Invalid field worker: {row['field_worker']}"))
-            if row['activity'] not in self._valid_activities:
-                errors.append(ValidationError(row_num, f"Invalid activity: {row['activity']}"))
+        # (mask, message) per check, in reporting order
+        checks = [
+            (blank, pd.Series("One of the required fields is blank", index=df.index)),
+            (
+                filled & ~valid_worker,
+                "Invalid field worker: " + df["field_worker"].astype(str),
+            ),
+            (
+                filled & ~df["activity"].isin(valid_activities),
+                "Invalid activity: " + df["activity"].astype(str),
+            ),
+            (
+                filled & ~numeric_quantity,
+                "Invalid quantity: " + df["quantity"].astype(str),
+            ),
+            (
+                filled & numeric_quantity & ~quantity.between(0, MAX_QUANTITY),
+                f"Quantity must be between 0 and {MAX_QUANTITY}: " + df["quantity"].astype(str),
+            ),
+            # Dates are parsed already, unless the file is previewed
+            (filled & dates.isna(), "Invalid date: " + df["date"].astype(str)),
+        ]
+        if self.start_date and self.end_date:
+            checks.append((
+                filled & dates.notna()
+                & ~dates.between(pd.Timestamp(self.start_date), pd.Timestamp(self.end_date)),
+                "Date outside of the batch period "
+                f"{self.start_date.isoformat()} - {self.end_date.isoformat()}: "
+                + dates.dt.strftime("%Y-%m-%d"),
+            ))
+        # Like the row by row pass, only rows with a known worker and a valid date count
+        daily_limit_check = self._check_daily_limit(df, dates, filled & valid_worker & dates.notna())
+        if daily_limit_check:
+            checks.append(daily_limit_check)
 
-        return errors
+        failed = pd.concat([
+            pd.DataFrame({
+                "row_number": df.index[mask.to_numpy()] + 2, # Account for header row and 0-indexing
+                "check": order,
+                "message": messages[mask],
+            })
+            for order, (mask, messages) in enumerate(checks)
+        ]).sort_values(["row_number", "check"], kind="stable")
+
+        return [
+            ValidationError(int(row_number), message)
+            for row_number, message in zip(failed["row_number"], failed["message"])
+        ]
+
+    def _check_daily_limit(self, df: pd.DataFrame, dates: pd.Series, counted_rows: pd.Series):
+        """
+        (mask, messages) of the rows over the daily_payroll_line_worker_limit.
+        Rows are counted per worker and date with grouped counts, on top of
+        the lines already in the batch, fetched once with a grouped query.
+        Counts carry over between calls, so the chunks of a file are checked
+        as a whole. Only the counted rows are checked.
+        """
+        limit = get_payroll_config().daily_payroll_line_worker_limit
+        if not limit or limit <= 0:
+            return None
+
+        keys = pd.MultiIndex.from_arrays([
+            df["field_worker"][counted_rows].astype(str).to_numpy(),
+            dates[counted_rows].dt.normalize().to_numpy(),
+        ])
+        # Position of every row in its worker day, after the lines counted before
+        counted = (
+            self._get_existing_daily_counts().reindex(keys, fill_value=0).to_numpy()
+            + self._daily_counts.reindex(keys, fill_value=0).to_numpy()
+        )
+        positions = counted + pd.Series(0, index=keys).groupby(level=[0, 1]).cumcount().to_numpy() + 1
+        chunk_counts = pd.Series(1, index=keys).groupby(level=[0, 1]).sum()
+        self._daily_counts = self._daily_counts.add(chunk_counts, fill_value=0).astype("int64")
+
+        over_limit = pd.Series(False, index=df.index)
+        over_limit[counted_rows] = positions > limit
+        messages = (
+            f"Daily limit of {limit} lines per worker has been reached: "
+            + df["field_worker"].astype(str) + " on "
+            + dates.dt.strftime("%Y-%m-%d")
+        )
+        return over_limit, messages
+
+    def _get_existing_daily_counts(self) -> pd.Series:
+        if self.existing_daily_counts is None:
+            self.existing_daily_counts = _empty_daily_counts()
+            if self.payroll_batch is not None:
+                self.existing_daily_counts = count_daily_lines(
+                    PayrollBatchLine.objects.filter(payroll_batch=self.payroll_batch)
+                )
+        return self.existing_daily_counts
 
 class PayrollFileProcessor:
-    """Handles reading and cleaning of payroll files"""
+    """
+    Handles reading and cleaning of payroll files.
+    Parquet and Arrow files need pyarrow, the calamine Excel engine needs
+    python-calamine. Both are imported when used.
+    """
+
+    def __init__(self, excel_engine=None):
+        # "openpyxl" through pandas or "calamine", much faster on large sheets
+        self.excel_engine = excel_engine or settings.PAYROLL_EXCEL_ENGINE
 
     @staticmethod
-    def read_file(file_path: str) -> pd.DataFrame:
-        """Reads CSV or Excel fil into a DataFrame"""
-        if file_path.endswith(('.xls', '.xlsx')):
-            return pd.read_excel(file_path, dtype={"field_worker": str})
-        else:
-            return pd.read_csv(file_path, dtype={"field_worker": str})
-    
+    def can_read_in_chunks(file_path: str) -> bool:
+        return file_path.endswith(('.csv', *PARQUET_EXTENSIONS))
+
+    def read_chunks(self, file_path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """
+        Reads a CSV or Parquet file chunk_size rows at a time.
+        The index keeps counting across chunks, so row numbers stay file wide.
+        """
+        if file_path.endswith(PARQUET_EXTENSIONS):
+            yield from self._read_parquet_chunks(file_path, chunk_size)
+            return
+
+        with pd.read_csv(file_path, dtype={"field_worker": str}, chunksize=chunk_size) as reader:
+            yield from reader
+
+    def read_file(self, file_path: str) -> pd.DataFrame:
+        """Reads CSV, Excel, Parquet or Arrow file into a DataFrame"""
+        if file_path.endswith(EXCEL_EXTENSIONS):
+            return self._read_excel(file_path)
+        if file_path.endswith(PARQUET_EXTENSIONS):
+            import pyarrow.parquet as pq
+
+            columns = _select_columns(pq.read_schema(file_path).names)
+            return _table_to_frame(pq.read_table(file_path, columns=columns))
+        if file_path.endswith(ARROW_EXTENSIONS):
+            import pyarrow.feather as feather
+
+            # Memory mapped, only the selected columns are read
+            table = feather.read_table(file_path, memory_map=True)
+            return _table_to_frame(table.select(_select_columns(table.column_names)))
+        return pd.read_csv(file_path, dtype={"field_worker": str})
+
+    def _read_excel(self, file_path: str) -> pd.DataFrame:
+        if self.excel_engine != "calamine":
+            return pd.read_excel(file_path, dtype={"field_worker": str}, engine=self.excel_engine)
+
+        from python_calamine import CalamineWorkbook
+
+        rows = CalamineWorkbook.from_path(file_path).get_sheet_by_index(0).to_python()
+        if not rows:
+            return pd.DataFrame()
+        df = pd.DataFrame(rows[1:], columns=[str(column) for column in rows[0]])
+        # Calamine reads empty cells as "" and every number as a float
+        df = df.replace("", np.nan)
+        worker_column = next(
+            (column for column in df.columns if column.strip().lower() == "field_worker"), None
+        )
+        if worker_column:
+            df[worker_column] = df[worker_column].map(_cell_to_str)
+        return df
+
+    def _read_parquet_chunks(self, file_path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(file_path)
+        columns = _select_columns(parquet_file.schema_arrow.names)
+        start = 0
+        for record_batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            df = _table_to_frame(record_batch)
+            df.index = pd.RangeIndex(start, start + len(df))
+            start += len(df)
+            yield df
+
+    @staticmethod
+    def clean_columns(df: pd.DataFrame) -> pd.DataFrame:
+        """Column names stripped and lower cased, as the validator expects them"""
+        df.columns = df.columns.str.strip().str.lower()
+        return df
+
     @staticmethod
     def clean_data(df: pd.DataFrame) -> pd.DataFrame:
         """Cleans and prepare data from file"""
-        df.columns = df.columns.str.strip().str.lower()
+        df = PayrollFileProcessor.clean_columns(df)
 
         # Convert date column to proper format
          # 1) parse your date‐column into actual datetimes:
         df['date'] = pd.to_datetime(
             df['date'],
-            format="%Y-%m-%d",   # ← change this to whatever your incoming format is,
+            format=FILE_DATE_FORMAT,   # ← change this to whatever your incoming format is,
             errors="raise"       # or 'coerce' if you want invalid → NaT
         )
 
@@ -95,29 +321,57 @@ class PayrollFileProcessor:
 
         return df
 
+class DuplicateRowFilter:
+    """
+    Drops rows already seen in previous chunks of a file.
+    Keeps a sorted array of 64-bit row hashes, 8 bytes per unique row.
+    """
+
+    def __init__(self, columns=("date", "field_worker", "activity", "quantity")):
+        self.columns = list(columns)
+        self._seen = np.array([], dtype=np.uint64)
+
+    def drop_duplicates(self, df: pd.DataFrame) -> pd.DataFrame:
+        hashes = self._hash_rows(df)
+        duplicated = pd.Series(hashes).duplicated().to_numpy() | np.isin(hashes, self._seen)
+        self._seen = np.union1d(self._seen, hashes[~duplicated])
+
+        return df[~duplicated]
+
+    def _hash_rows(self, df: pd.DataFrame) -> np.ndarray:
+        # Same values must hash the same in every chunk, whatever dtype pandas inferred
+        columns = df[self.columns].copy()
+        columns["quantity"] = pd.to_numeric(columns["quantity"], errors="coerce").astype(float)
+        columns["field_worker"] = columns["field_worker"].astype(str)
+        columns["activity"] = columns["activity"].astype(str)
+
+        return pd.util.hash_pandas_object(columns, index=False).to_numpy()
+
 class PayrollBatchCreator:
-    """Handles bulk creation of PayrollBatchLine objects"""
+    """
+    Handles bulk creation of PayrollBatchLine objects.
+    On PostgreSQL the lines are streamed with COPY FROM STDIN,
+    other databases fall back to bulk_create.
+    """
 
-    def __init__(self, batch_size=500):
+    def __init__(self, batch_size=500, copy_batch_size=50000, use_copy=True, resolver=None):
         self.batch_size = batch_size
-        self._field_workers_cache = None
-        self._activities_cache = None
-    
-    def _load_refences_objects(self):
-        """Load full object for foreign key relationships"""
-        if self._field_workers_cache is None:
-            self._field_workers_cache = {
-                fw.identification_number: fw for fw in FieldWorker.objects.all()
-            }
-        if self._activities_cache is None:
-            self._activities_cache = {
-                a.name: a for a in Activity.objects.all()
-            }
+        self.copy_batch_size = copy_batch_size
+        self.use_copy = use_copy
+        self.resolver = resolver or ReferenceResolver()
 
     def _create_batch_lines(self, batch, df):
         """Create PayrollBatchLine objects in batches"""
-        self._load_refences_objects()
-        
+        if self.use_copy and connection.vendor == 'postgresql':
+            self._copy_batch_lines(batch, df)
+        else:
+            self._bulk_create_batch_lines(batch, df)
+
+    def _bulk_create_batch_lines(self, batch, df):
+        self.resolver.load(df)
+        field_worker_ids = self.resolver.field_worker_ids
+        activity_ids = self.resolver.activity_ids
+
         lines = []
 
         for row in df.itertuples(index=False):
@@ -130,8 +384,8 @@ class PayrollBatchCreator:
                     PayrollBatchLine(
                         payroll_batch=batch,
                         date=row.date,
-                        field_worker=self._field_workers_cache[row.field_worker],
-                        activity=self._activities_cache[row.activity],
+                        field_worker_id=field_worker_ids[row.field_worker],
+                        activity_id=activity_ids[row.activity],
                         quantity=row.quantity,
                         iso_week=week,
                         iso_year=year
@@ -147,4 +401,253 @@ class PayrollBatchCreator:
                 raise Exception(f"Reference not found: {e}")
 
         if lines:
-            PayrollBatchLine.objects.bulk_create(lines)
\ No newline at end of file
+            PayrollBatchLine.objects.bulk_create(lines)
+
+    def _copy_batch_lines(self, batch, df):
+        """Stream the lines into the table with COPY, copy_batch_size rows at a time"""
+        frame = self._build_line_frame(batch, df)
+        columns = ", ".join(connection.ops.quote_name(column) for column in frame.columns)
+        sql = (
+            f"COPY {connection.ops.quote_name(PayrollBatchLine._meta.db_table)} ({columns}) "
+            "FROM STDIN WITH (FORMAT csv)"
+        )
+
+        with connection.cursor() as cursor:
+            for start in range(0, len(frame), self.copy_batch_size):
+                buffer = io.StringIO()
+                frame.iloc[start:start + self.copy_batch_size].to_csv(buffer, header=False, index=False)
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+
+    def _build_line_frame(self, batch, df) -> pd.DataFrame:
+        """Table columns of the lines, foreign keys resolved through the id maps"""
+        self.resolver.load(df)
+
+        field_worker_ids = df['field_worker'].map(self.resolver.field_worker_ids)
+        activity_ids = df['activity'].map(self.resolver.activity_ids)
+        for column, ids in (('field_worker', field_worker_ids), ('activity', activity_ids)):
+            missing = ids.isna()
+            if missing.any():
+                key = repr(df[column][missing].iloc[0])
+                batch.error_message = key
+                raise Exception(f"Reference not found: {key}")
+
+        dates = pd.to_datetime(df['date'])
+        iso_calendar = dates.dt.isocalendar()
+        now = timezone.now()
+
+        frame = pd.DataFrame({
+            'payroll_batch_id': batch.pk,
+            'date': dates.dt.strftime('%Y-%m-%d'),
+            'field_worker_id': field_worker_ids.astype('int64'),
+            'activity_id': activity_ids.astype('int64'),
+            'quantity': df['quantity'],
+            'iso_week': iso_calendar['week'],
+            'iso_year': iso_calendar['year'],
+            'created_at': now,
+            'updated_at': now,
+        })
+        # Output fields start at their model defaults, like with bulk_create
+        for model_field in PayrollBatchLine._meta.concrete_fields:
+            if model_field.attname not in frame.columns and not model_field.primary_key:
+                frame[model_field.attname] = model_field.get_default()
+
+        return frame
+
+
+@dataclass
+class BatchLineChanges:
+    """What a re-import changed, worker_days holds (field_worker_id, date) pairs"""
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    worker_days: Set[Tuple[int, date]] = field(default_factory=set)
+
+class PayrollBatchUpdater:
+    """
+    Applies a corrected file to a batch that already has lines.
+    Rows are hashed on (field worker, activity, date) and on their quantity
+    and compared with the hashes of the existing lines: new rows and changed
+    quantities are written with a single ON CONFLICT upsert and, optionally,
+    lines missing from the file are deleted. Unchanged rows are not touched.
+    """
+    KEY_COLUMNS = ['field_worker_id', 'activity_id', 'date']
+
+    def __init__(self, resolver=None, delete_missing=False, batch_size=1000):
+        self.resolver = resolver or ReferenceResolver()
+        self.delete_missing = delete_missing
+        self.batch_size = batch_size
+
+    def find_conflicts(self, batch, df: pd.DataFrame) -> List[ValidationError]:
+        """
+        Rows the upsert can't apply: keys repeated in the file with different
+        quantities, and keys that already belong to a line of another batch
+        """
+        frame = self._resolve(df)
+        errors = [
+            ValidationError(int(row_number) + 2, "Duplicate line for the same field worker, activity and date")
+            for row_number in frame.index[frame.duplicated('key', keep='first')]
+        ]
+
+        if not frame.empty:
+            other_batches = PayrollBatchLine.objects.filter(
+                field_worker_id__in=frame['field_worker_id'].unique().tolist(),
+                date__range=(frame['date'].min().date(), frame['date'].max().date()),
+            ).exclude(payroll_batch=batch)
+            existing = self._hash_lines(other_batches)
+            taken = frame[frame['key'].isin(existing['key'])]
+            errors += [
+                ValidationError(int(row_number) + 2, "Line already belongs to another payroll batch")
+                for row_number in taken.index
+            ]
+
+        return sorted(errors, key=lambda error: error.row_number)
+
+    def count_kept_lines(self, batch, df: pd.DataFrame) -> pd.Series:
+        """
+        Daily line counts of the batch lines the re-import keeps as they are:
+        none with delete_missing, else the lines missing from the file
+        """
+        if self.delete_missing:
+            return _empty_daily_counts()
+        frame = self._resolve(df)
+        existing = pd.DataFrame.from_records(
+            PayrollBatchLine.objects.filter(payroll_batch=batch)
+            .values_list('field_worker__identification_number', *self.KEY_COLUMNS),
+            columns=['identification_number', *self.KEY_COLUMNS],
+        )
+        if existing.empty:
+            return _empty_daily_counts()
+        existing['date'] = pd.to_datetime(existing['date'])
+
+        kept = existing[~self._hash_keys(existing).isin(frame['key'])]
+        return kept.groupby(['identification_number', 'date']).size()
+
+    def apply(self, batch, df: pd.DataFrame) -> BatchLineChanges:
+        frame = self._resolve(df)
+        existing = self._hash_lines(PayrollBatchLine.objects.filter(payroll_batch=batch))
+        merged = frame.merge(existing, on='key', how='left', suffixes=('', '_existing'))
+
+        new = merged['id'].isna()
+        changed = ~new & (merged['row'] != merged['row_existing'])
+        missing = existing[~existing['key'].isin(frame['key'])]
+
+        upserts = merged[new | changed]
+        if not upserts.empty:
+            # Django renders update_conflicts as ON CONFLICT (...) DO UPDATE
+            PayrollBatchLine.objects.bulk_create(
+                [self._build_line(batch, row) for row in upserts.itertuples(index=False)],
+                batch_size=self.batch_size,
+                update_conflicts=True,
+                unique_fields=['field_worker', 'activity', 'date'],
+                update_fields=['quantity', 'updated_at'],
+            )
+
+        changes = BatchLineChanges(
+            inserted=int(new.sum()),
+            updated=int(changed.sum()),
+            unchanged=int((~new & ~changed).sum()),
+        )
+        changes.worker_days.update(
+            zip(upserts['field_worker_id'].tolist(), upserts['date'].dt.date.tolist())
+        )
+        if self.delete_missing and not missing.empty:
+            PayrollBatchLine.objects.filter(pk__in=missing['id'].tolist()).delete()
+            changes.deleted = len(missing)
+            changes.worker_days.update(
+                zip(missing['field_worker_id'].tolist(), missing['date'].dt.date.tolist())
+            )
+        return changes
+
+    def _resolve(self, df: pd.DataFrame) -> pd.DataFrame:
+        self.resolver.load(df)
+        frame = pd.DataFrame({
+            'field_worker_id': df['field_worker'].map(self.resolver.field_worker_ids).astype('int64'),
+            'activity_id': df['activity'].map(self.resolver.activity_ids).astype('int64'),
+            'date': pd.to_datetime(df['date']).dt.normalize(),
+            'quantity': pd.to_numeric(df['quantity']).astype(float),
+        }, index=df.index)
+        return self._add_hashes(frame)
+
+    def _hash_lines(self, lines) -> pd.DataFrame:
+        frame = pd.DataFrame.from_records(
+            lines.values_list('id', *self.KEY_COLUMNS, 'quantity'),
+            columns=['id', *self.KEY_COLUMNS, 'quantity'],
+        )
+        frame['date'] = pd.to_datetime(frame['date'])
+        frame['quantity'] = frame['quantity'].astype(float)
+        return self._add_hashes(frame)
+
+    def _add_hashes(self, frame: pd.DataFrame) -> pd.DataFrame:
+        # Quantities are stored with 3 decimals
+        quantity = frame['quantity'].round(3)
+        frame['key'] = self._hash_keys(frame)
+        frame['row'] = pd.util.hash_pandas_object(
+            frame[self.KEY_COLUMNS].assign(quantity=quantity), index=False
+        )
+        return frame
+
+    def _hash_keys(self, frame: pd.DataFrame) -> pd.Series:
+        return pd.util.hash_pandas_object(frame[self.KEY_COLUMNS], index=False)
+
+    def _build_line(self, batch, row) -> PayrollBatchLine:
+        line_date = row.date.date()
+        year, week, _ = line_date.isocalendar()
+        return PayrollBatchLine(
+            payroll_batch=batch,
+            field_worker_id=row.field_worker_id,
+            activity_id=row.activity_id,
+            date=line_date,
+            quantity=Decimal(str(round(row.quantity, 3))),
+            iso_week=week,
+            iso_year=year,
+        )
+
+def count_daily_lines(lines) -> pd.Series:
+    """Line counts of a queryset indexed by (identification_number, date), one grouped query"""
+    rows = list(
+        lines.values_list('field_worker__identification_number', 'date')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    if not rows:
+        return _empty_daily_counts()
+    field_workers, dates, counts = zip(*rows)
+    return pd.Series(
+        counts, index=pd.MultiIndex.from_arrays([list(field_workers), pd.to_datetime(list(dates))])
+    )
+
+def _empty_daily_counts() -> pd.Series:
+    return pd.Series(dtype="int64", index=pd.MultiIndex.from_arrays([[], []]))
+
+def _select_columns(names) -> List[str]:
+    """File columns that clean_data maps to one of FILE_COLUMNS"""
+    return [name for name in names if name.strip().lower() in FILE_COLUMNS]
+
+def _table_to_frame(table) -> pd.DataFrame:
+    """
+    Arrow table or record batch to a DataFrame, field workers and activities
+    as categoricals. Field workers are read as strings whatever their type
+    in the file, like the CSV reader does.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    arrays = []
+    for name, column in zip(table.schema.names, table.columns):
+        if name.strip().lower() in CATEGORICAL_COLUMNS:
+            if pa.types.is_dictionary(column.type):
+                column = column.cast(column.type.value_type)
+            column = pc.dictionary_encode(pc.cast(column, pa.string()))
+        arrays.append(column)
+
+    return pa.table(arrays, names=table.schema.names).to_pandas(date_as_object=False)
+
+def _cell_to_str(value):
+    if isinstance(value, float):
+        if np.isnan(value):
+            return value
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
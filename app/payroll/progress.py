@@ -0,0 +1,43 @@
+"""
+Progress of the batch imports.
+Kept in the cache rather than in the batch row, so it can be read while the
+import transaction is still open and written from any worker.
+"""
+from django.core.cache import cache
+from django.utils import timezone
+from .constants import IMPORT_STAGE_QUEUED
+
+IMPORT_PROGRESS_KEY = "payroll:import-progress:{batch_id}"
+IMPORT_PROGRESS_TIMEOUT = 60 * 60 * 24 # 1 day
+
+
+def start_import_progress(batch_id) -> dict:
+    """Start a fresh progress record for a queued import"""
+    progress = {
+        'stage': IMPORT_STAGE_QUEUED,
+        'rows_read': 0,
+        'rows_inserted': 0,
+        'rows_calculated': 0,
+        'updated_at': timezone.now().isoformat(),
+    }
+    cache.set(IMPORT_PROGRESS_KEY.format(batch_id=batch_id), progress, IMPORT_PROGRESS_TIMEOUT)
+    return progress
+
+
+def update_import_progress(batch_id, stage=None, **rows) -> None:
+    """
+    Set the stage and row counts of an import.
+    Stages of an import run one after the other, so there is a single
+    writer at a time and a plain read and write is enough.
+    """
+    key = IMPORT_PROGRESS_KEY.format(batch_id=batch_id)
+    progress = cache.get(key) or start_import_progress(batch_id)
+    if stage:
+        progress['stage'] = stage
+    progress.update(rows)
+    progress['updated_at'] = timezone.now().isoformat()
+    cache.set(key, progress, IMPORT_PROGRESS_TIMEOUT)
+
+
+def get_import_progress(batch_id):
+    return cache.get(IMPORT_PROGRESS_KEY.format(batch_id=batch_id))
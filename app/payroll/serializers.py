@@ -1,3 +1,4 @@
+from django.db.models import F
 from rest_framework import serializers
 from .models import (
     FieldWorker,
@@ -11,6 +12,7 @@ from .models import (
     PayrollBatchLine, 
     PayrollConfiguration,
 )
+from .caches import get_payroll_config
 
 import logging
 
@@ -88,7 +90,7 @@ class TariffSerializer(serializers.ModelSerializer):
 class PayrollBatchSerializer(serializers.ModelSerializer):
     class Meta:
         model = PayrollBatch
-        fields = ['id','name', 'start_date', 'end_date', 'status', 'farm']
+        fields = ['id','name', 'start_date', 'end_date', 'status', 'farm', 'calculation_backend']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 class PayrollConfigurationSerializer(serializers.ModelSerializer):
@@ -144,7 +146,7 @@ class PayrollBatchLineWriteSerializer(serializers.ModelSerializer):
             return attrs
 
         # Check daily limit 
-        daily_limit = PayrollConfiguration.objects.get_config().daily_payroll_line_worker_limit
+        daily_limit = get_payroll_config().daily_payroll_line_worker_limit
         if daily_limit and daily_limit > 0:
             qs = PayrollBatchLine.objects.filter(
                 field_worker=attrs['field_worker'],
@@ -195,5 +197,66 @@ class PayrollBatchLineSerializer(serializers.ModelSerializer):
             'fourteenth_bonus',
         ]
 
+class PayrollBatchLineFlatSerializer(serializers.Serializer):
+    """
+    Compact read representation of the lines, ?view=flat.
+    Serializes the rows of PayrollBatchLine.objects.values(*VALUES) with
+    foreign keys as ids and a few denormalized labels, no model instances.
+    """
+    VALUES = {
+        'id': 'id',
+        'payroll_batch': 'payroll_batch',
+        'field_worker': 'field_worker',
+        'field_worker_name': 'field_worker__name',
+        'identification_number': 'field_worker__identification_number',
+        'date': 'date',
+        'iso_week': 'iso_week',
+        'activity': 'activity',
+        'activity_name': 'activity__name',
+        'labor_type': 'activity__labor_type__code',
+        'quantity': 'quantity',
+        'total_cost': 'total_cost',
+        'salary_surplus': 'salary_surplus',
+        'integral_bonus': 'integral_bonus',
+        'mobilization_bonus': 'mobilization_bonus',
+        'extra_hours_value': 'extra_hours_value',
+        'extra_hours_qty': 'extra_hours_qty',
+        'thirteenth_bonus': 'thirteenth_bonus',
+        'fourteenth_bonus': 'fourteenth_bonus',
+        # Key of the cursor pagination
+        'created_at': 'created_at',
+    }
+    DECIMAL_FIELDS = [
+        'quantity',
+        'total_cost',
+        'salary_surplus',
+        'integral_bonus',
+        'mobilization_bonus',
+        'extra_hours_value',
+        'extra_hours_qty',
+        'thirteenth_bonus',
+        'fourteenth_bonus',
+    ]
+
+    def to_representation(self, instance):
+        # Plain dict copy, decimals as strings like the nested representation
+        row = {field: instance[field] for field in self.VALUES if field != 'created_at'}
+        row['date'] = row['date'].isoformat()
+        for field in self.DECIMAL_FIELDS:
+            if row[field] is not None:
+                row[field] = str(row[field])
+        return row
+
+    @classmethod
+    def values(cls, queryset):
+        """The values() query the serializer reads from"""
+        fields = [name for name, lookup in cls.VALUES.items() if name == lookup]
+        labels = {name: F(lookup) for name, lookup in cls.VALUES.items() if name != lookup}
+        return queryset.values(*fields, **labels)
+
 class PayrollBatchImportSerializer(serializers.Serializer):
-    file = serializers.FileField()
\ No newline at end of file
+    file = serializers.FileField()
+    # Apply the file as a correction of the lines already in the batch
+    reimport = serializers.BooleanField(default=False)
+    # On re-import, delete the lines missing from the file
+    delete_missing = serializers.BooleanField(default=False)
@@ -0,0 +1,69 @@
+"""
+Database-side totals of the lines of a batch
+"""
+from typing import Dict
+from django.db import connection
+
+SUMMARY_FIELDS = [
+    'quantity',
+    'total_cost',
+    'salary_surplus',
+    'mobilization_bonus',
+    'extra_hours_value',
+    'extra_hours_qty',
+    'thirteenth_bonus',
+    'fourteenth_bonus',
+    'integral_bonus',
+]
+
+# One grouped pass gives the worker rows, the activity rows and the batch row,
+# GROUPING() tells them apart since their keys are NULL outside their set
+BATCH_SUMMARY_SQL = f"""
+    SELECT
+        GROUPING(line.field_worker_id, worker.identification_number, worker.name) AS worker_grouped,
+        GROUPING(line.activity_id, activity.name) AS activity_grouped,
+        line.field_worker_id,
+        worker.identification_number,
+        worker.name,
+        line.activity_id,
+        activity.name,
+        COUNT(*) AS lines,
+        {", ".join(f"COALESCE(SUM(line.{field}), 0)" for field in SUMMARY_FIELDS)}
+    FROM payroll_payrollbatchline line
+    JOIN payroll_fieldworker worker ON worker.id = line.field_worker_id
+    JOIN payroll_activity activity ON activity.id = line.activity_id
+    WHERE line.payroll_batch_id = %(batch_id)s
+    GROUP BY GROUPING SETS (
+        (line.field_worker_id, worker.identification_number, worker.name),
+        (line.activity_id, activity.name),
+        ()
+    )
+    ORDER BY worker.identification_number, activity.name
+"""
+
+
+def summarize_batch(batch_id) -> Dict:
+    """
+    Line count and sums of the quantity and output fields of a batch,
+    in total, per worker and per activity, from a single query.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(BATCH_SUMMARY_SQL, {'batch_id': batch_id})
+        rows = cursor.fetchall()
+
+    summary = {"batch": batch_id, "totals": None, "workers": [], "activities": []}
+    for (worker_grouped, activity_grouped, worker_id, identification_number, worker_name,
+         activity_id, activity_name, lines, *sums) in rows:
+        totals = {"lines": lines, **dict(zip(SUMMARY_FIELDS, sums))}
+        if not worker_grouped:
+            summary["workers"].append({
+                "field_worker_id": worker_id,
+                "field_worker": identification_number,
+                "name": worker_name,
+                **totals,
+            })
+        elif not activity_grouped:
+            summary["activities"].append({"activity_id": activity_id, "activity": activity_name, **totals})
+        else:
+            summary["totals"] = totals
+    return summary
@@ -1,9 +1,11 @@
-from collections import defaultdict
-from typing import List
+from typing import List, Tuple
+import pandas as pd
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
-from celery import shared_task, group, chain
+from celery import shared_task, group, chain, chord
 from logging import getLogger
 from datetime import datetime
 from .orchestrators import PayrollCalculationOrchestrator
@@ -13,16 +15,33 @@ from payroll.models import (
     FieldWorker,
 )
 from payroll.payroll_processor import (
+    FILE_COLUMNS,
+    DuplicateRowFilter,
     PayrollBatchCreator,
     PayrollFileProcessor,
+    PayrollBatchUpdater,
     PayrollFileValidator,
+    ReferenceResolver,
     ValidationError
 )
 from payroll.calculators import (
+    ColumnarInlineCalculator,
     DayLevelCalculator,
     InlineCalculator,
     WeekLevelCalculator
 )
+from payroll.constants import (
+    CALCULATION_BACKEND_COLUMNAR,
+    CALCULATION_BACKEND_FUSED,
+    CALCULATION_BACKEND_SQL,
+    IMPORT_STAGE_CALCULATING,
+    IMPORT_STAGE_DONE,
+    IMPORT_STAGE_ERROR,
+    IMPORT_STAGE_READING
+)
+from payroll.caches import TariffIndex, bump_batch_version
+from payroll.instrumentation import StageMetrics, measure_stage, record_stage, reset_metrics
+from payroll.progress import update_import_progress
 
 logger = getLogger(__name__)
 
@@ -180,17 +199,19 @@ def recalc_delete_task(self, worker_id, batch_id, date_iso):
     batch.save(update_fields=['status'])
 
 @shared_task
-def batch_inline_calculation_task(batch_id):
+def batch_inline_calculation_task(batch_id, backend=None):
     """
     Task that calculates inline fields for all lines in a batch
     """
     try:
-        lines = PayrollBatchLine.objects.filter(payroll_batch__id=batch_id)
-        calculator = InlineCalculator()
+        lines = PayrollBatchLine.objects.filter(payroll_batch__id=batch_id)\
+            .select_related('field_worker', 'payroll_batch')
+        calculator = _get_inline_calculator(backend or settings.PAYROLL_CALCULATION_BACKEND)
 
-        calculator.calculate_batch(lines)
+        with measure_stage(batch_id, 'inline_calculation') as stage:
+            stage.rows = len(calculator.calculate_batch(lines))
         
-        logger.info(f"Calculated inline fields for {lines.count()} lines in batch {batch_id}")
+        logger.info(f"Calculated inline fields for {stage.rows} lines in batch {batch_id}")
         return batch_id
     
     except Exception as e:
@@ -204,24 +225,13 @@ def batch_day_level_calculation_task(batch_id):
     Groups by (worker, date) and distributes proportionally
     """
     try:
-        day_groups = defaultdict(list)
         lines = PayrollBatchLine.objects.filter(payroll_batch__id=batch_id).select_related('field_worker')
 
-        for line in lines:
-            key = (line.field_worker.id, line.date)
-            day_groups[key].append(line)
-        
-        # Filter to only groups with multiple lines per day
-        multi_line_days = {k: v for k, v in day_groups.items() if len(v) > 1}
-
         calculator = DayLevelCalculator()
+        with measure_stage(batch_id, 'day_calculation') as stage:
+            stage.rows = len(calculator.calculate_batch(lines))
 
-        for (worker_id, date), lines_for_day in multi_line_days.items():
-            worker = lines_for_day[0].field_worker
-            context = {'worker': worker, 'payroll_batch': batch_id, 'date': date}
-            calculator.calculate(context)
-
-        logger.info(f"Calculated day-level proportional bonuses for {len(multi_line_days)} days in batch {batch_id}")
+        logger.info(f"Calculated day-level proportional bonuses for {stage.rows} lines in batch {batch_id}")
         return batch_id
 
     except Exception as e:
@@ -235,18 +245,13 @@ def batch_week_level_calculation_task(batch_id):
     Groups by worker and calculates weekly
     """
     try:
-        payroll_batch = PayrollBatch.objects.get(pk=batch_id)
-        lines_by_worker = PayrollBatchLine.objects.filter(payroll_batch=payroll_batch)\
-            .order_by('field_worker')\
-            .distinct('field_worker')
-
         calculator = WeekLevelCalculator()
+        with measure_stage(batch_id, 'week_calculation') as stage:
+            stage.rows = calculator.calculate_batch(batch_id)
+        # Last stage of the chain, every line of the batch is calculated
+        update_import_progress(batch_id, rows_calculated=stage.rows)
 
-        for line in lines_by_worker:
-            context = {'worker': line.field_worker, 'payroll_batch': batch_id}
-            calculator.calculate(context)
-
-        logger.info(f"Calculated week-level proportional bonuses for {lines_by_worker.count()} workers in batch {batch_id}")
+        logger.info(f"Calculated week-level integral bonuses for {stage.rows} lines in batch {batch_id}")
         return batch_id
 
     except Exception as e:
@@ -254,49 +259,127 @@ def batch_week_level_calculation_task(batch_id):
         raise
 
 
+@shared_task
+def batch_calculation_task(batch_id, backend=CALCULATION_BACKEND_FUSED):
+    """
+    Task that runs the single pass calculation of a batch:
+    inline, day and week stages in memory with a single write,
+    or inside the database for the sql backend
+    """
+    try:
+        orchestrator = PayrollCalculationOrchestrator()
+        with measure_stage(batch_id, 'calculation') as stage:
+            if backend == CALCULATION_BACKEND_SQL:
+                stage.rows = orchestrator.calculate_batch_in_database(batch_id)
+            else:
+                stage.rows = orchestrator.calculate_batch(batch_id)
+        update_import_progress(batch_id, IMPORT_STAGE_DONE, rows_calculated=stage.rows)
+
+        logger.info(f"Calculated {stage.rows} lines in batch {batch_id}")
+        return batch_id
+
+    except Exception as e:
+        logger.error(f"Error calculating batch {batch_id}: {e}")
+        PayrollBatch.objects.filter(pk=batch_id).update(status='error', error_message=str(e))
+        update_import_progress(batch_id, IMPORT_STAGE_ERROR)
+        raise
+
 @shared_task
 def finalize_batch_task(batch_id):
     try:
         PayrollBatch.objects.filter(pk=batch_id).update(status='ready', error_message=None)
+        # The stages of the chain write with their own calculators
+        bump_batch_version(batch_id)
+        update_import_progress(batch_id, IMPORT_STAGE_DONE)
 
     except Exception as e:
         logger.error(f"Error finalizing batch {batch_id}: {e}")
         raise
 
+@shared_task
+def import_payroll_shard_task(batch_id, shard_path, shard):
+    """
+    Insert and calculate the lines of one shard of a sharded import.
+    A shard holds every line of its workers, so it is calculated on its own.
+    The shards of a batch import all of their lines or none of them:
+    a shard that fails deletes the lines the others committed.
+    """
+    batch = PayrollBatch.objects.get(pk=batch_id)
+    try:
+        with measure_stage(batch_id, f'shard_{shard}') as stage, transaction.atomic():
+            processor = PayrollFileProcessor()
+            df = processor.clean_data(processor.read_file(default_storage.path(shard_path)))
+
+            resolver = ReferenceResolver()
+            PayrollBatchCreator(resolver=resolver)._create_batch_lines(batch, df)
+            stage.rows = PayrollCalculationOrchestrator().calculate_workers(
+                batch_id, list(resolver.field_worker_ids.values())
+            )
+
+            # Lock the batch until commit, a failed shard cleans up under the same lock
+            status = PayrollBatch.objects.select_for_update().values_list('status', flat=True).get(pk=batch_id)
+            if status == 'error':
+                transaction.set_rollback(True)
+                stage.rows = 0
+                logger.info(f"Rolled back shard {shard} of batch {batch_id}, another shard failed")
+                return 0
+
+        logger.info(f"Imported and calculated {stage.rows} lines of shard {shard} in batch {batch_id}")
+        return stage.rows
+
+    except Exception as e:
+        logger.error(f"Error importing shard {shard} of batch {batch_id}: {e}")
+        _fail_sharded_import(batch_id, str(e))
+        raise
+    finally:
+        default_storage.delete(shard_path)
+
+@shared_task
+def finalize_sharded_import_task(shard_rows, batch_id):
+    """Chord callback of a sharded import, runs once every shard is done"""
+    try:
+        PayrollBatch.objects.filter(pk=batch_id).update(status='ready', error_message=None)
+        rows = sum(shard_rows)
+        update_import_progress(batch_id, IMPORT_STAGE_DONE, rows_inserted=rows, rows_calculated=rows)
+
+    except Exception as e:
+        logger.error(f"Error finalizing sharded import of batch {batch_id}: {e}")
+        raise
+
 @shared_task
 def import_payroll_file(batch_id, temp_path):
     """Main task for importing payroll files"""
     batch = PayrollBatch.objects.get(pk=batch_id)
     full_path = default_storage.path(temp_path)
+    shard_paths = []
 
     try:
-        # Read and clean file
-        processor = PayrollFileProcessor()
-        df = processor.read_file(full_path)
-        df = processor.clean_data(df)
+        reset_metrics(batch_id)
+        update_import_progress(batch_id, IMPORT_STAGE_READING)
 
-        # Validate file
-        validator = PayrollFileValidator()
+        processor = PayrollFileProcessor()
+        shards = settings.PAYROLL_IMPORT_SHARDS
+        chunk_size = settings.PAYROLL_IMPORT_CHUNK_SIZE
+        if shards > 1:
+            errors, shard_paths = _split_file_in_shards(batch, full_path, shards)
+        elif chunk_size and processor.can_read_in_chunks(full_path):
+            errors = _import_file_in_chunks(batch, full_path, chunk_size)
+        else:
+            errors = _import_file(batch, full_path)
 
-        structure_errors = validator.validate_structure(df)
-        if structure_errors:
-            _handle_batch_error(batch, structure_errors)
+        if errors:
+            _handle_batch_error(batch, errors)
             return
+        bump_batch_version(batch_id)
 
-        # Create batch lines
-
-        batch_creator = PayrollBatchCreator()
-        batch_creator._create_batch_lines(batch, df)
-
-        # Chain calculation tasks efficiently
-        calculation_chain = chain(
-            batch_inline_calculation_task.s(batch_id),
-            batch_day_level_calculation_task.s(),
-            batch_week_level_calculation_task.s(),
-            finalize_batch_task.s()
-        )
+        # Warm the shared tariff index before the calculation tasks need it
+        TariffIndex().load_farm(batch.farm_id)
 
-        calculation_chain.apply_async()
+        update_import_progress(batch_id, IMPORT_STAGE_CALCULATING)
+        if shard_paths:
+            _dispatch_shards(batch, shard_paths)
+        else:
+            _dispatch_batch_calculation(batch)
 
         logger.info(f"Started calculation tasks for batch {batch_id}")
 
@@ -305,11 +388,303 @@ def import_payroll_file(batch_id, temp_path):
         batch.status = 'error'
         batch.error_message = str(e)
         batch.save(update_fields=['status', 'error_message'])
+        update_import_progress(batch_id, IMPORT_STAGE_ERROR)
+        # Shards that never ran leave their files behind
+        for shard_path in shard_paths:
+            default_storage.delete(shard_path)
         raise
     finally:
         # Delete temp file
         default_storage.delete(temp_path)
 
+@shared_task
+def reimport_payroll_file(batch_id, temp_path, delete_missing=False):
+    """
+    Apply a corrected file to a batch that already has lines.
+    Only new, changed and, with delete_missing, removed lines are written,
+    and only their worker days and worker weeks are recalculated.
+    """
+    batch = PayrollBatch.objects.get(pk=batch_id)
+    full_path = default_storage.path(temp_path)
+
+    try:
+        reset_metrics(batch_id)
+        update_import_progress(batch_id, IMPORT_STAGE_READING)
+
+        with measure_stage(batch_id, 'import') as stage:
+            processor = PayrollFileProcessor()
+            df = processor.clean_data(processor.read_file(full_path))
+            stage.rows = len(df)
+        update_import_progress(batch_id, rows_read=len(df))
+
+        resolver = ReferenceResolver()
+        updater = PayrollBatchUpdater(resolver=resolver, delete_missing=delete_missing)
+        with measure_stage(batch_id, 'validation') as stage:
+            validator = PayrollFileValidator(
+                start_date=batch.start_date, end_date=batch.end_date, resolver=resolver
+            )
+            errors = validator.validate_structure(df)
+            if not errors:
+                df = DuplicateRowFilter().drop_duplicates(df)
+                # Only the lines the re-import keeps count towards the daily limit
+                validator.existing_daily_counts = updater.count_kept_lines(batch, df)
+                errors = validator.validate_data(df)
+            if not errors:
+                errors = updater.find_conflicts(batch, df)
+            stage.rows = len(df)
+
+        if errors:
+            _handle_batch_error(batch, errors)
+            return
+
+        with transaction.atomic():
+            with measure_stage(batch_id, 'line_update') as stage:
+                changes = updater.apply(batch, df)
+                stage.rows = changes.inserted + changes.updated + changes.deleted
+            bump_batch_version(batch_id)
+
+            with measure_stage(batch_id, 'calculation') as stage:
+                stage.rows = PayrollCalculationOrchestrator().recalculate_worker_days(
+                    batch_id, changes.worker_days
+                )
+
+            PayrollBatch.objects.filter(pk=batch_id).update(status='ready', error_message=None)
+
+        update_import_progress(
+            batch_id,
+            IMPORT_STAGE_DONE,
+            rows_inserted=changes.inserted,
+            rows_updated=changes.updated,
+            rows_deleted=changes.deleted,
+            rows_calculated=stage.rows,
+        )
+        logger.info(
+            f"Re-imported batch {batch_id}: {changes.inserted} inserted, {changes.updated} updated, "
+            f"{changes.deleted} deleted, {changes.unchanged} unchanged lines"
+        )
+
+    except Exception as e:
+        logger.error(f"Error re-importing payroll file for batch {batch_id}: {e}")
+        batch.status = 'error'
+        batch.error_message = str(e)
+        batch.save(update_fields=['status', 'error_message'])
+        update_import_progress(batch_id, IMPORT_STAGE_ERROR)
+        raise
+    finally:
+        default_storage.delete(temp_path)
+
+def _import_file(batch: PayrollBatch, full_path: str) -> List[ValidationError]:
+    """Import a whole file at once, returns the validation errors"""
+    # Read and clean file
+    with measure_stage(batch.pk, 'import') as stage:
+        processor = PayrollFileProcessor()
+        df = processor.read_file(full_path)
+        df = processor.clean_data(df)
+        stage.rows = len(df)
+    update_import_progress(batch.pk, rows_read=len(df))
+
+    # Validate file
+    resolver = ReferenceResolver()
+    with measure_stage(batch.pk, 'validation') as stage:
+        validator = PayrollFileValidator(
+            start_date=batch.start_date, end_date=batch.end_date, resolver=resolver, payroll_batch=batch
+        )
+        errors = validator.validate_structure(df)
+        if not errors:
+            df = DuplicateRowFilter().drop_duplicates(df)
+            errors = validator.validate_data(df)
+        stage.rows = len(df)
+
+    if errors:
+        return errors
+
+    # Create batch lines
+    with measure_stage(batch.pk, 'line_creation') as stage:
+        batch_creator = PayrollBatchCreator(resolver=resolver)
+        batch_creator._create_batch_lines(batch, df)
+        stage.rows = len(df)
+    update_import_progress(batch.pk, rows_inserted=len(df))
+
+    return []
+
+def _import_file_in_chunks(batch: PayrollBatch, full_path: str, chunk_size: int) -> List[ValidationError]:
+    """
+    Stream a CSV file: every chunk is cleaned, validated and inserted before
+    the next one is read, so memory stays flat whatever the file size.
+    Nothing is inserted if any chunk is invalid.
+    """
+    processor = PayrollFileProcessor()
+    # Validation and line creation share the ids of the file references
+    resolver = ReferenceResolver()
+    validator = PayrollFileValidator(
+        start_date=batch.start_date, end_date=batch.end_date, resolver=resolver, payroll_batch=batch
+    )
+    batch_creator = PayrollBatchCreator(resolver=resolver)
+    duplicate_filter = DuplicateRowFilter()
+    stages = [StageMetrics('import'), StageMetrics('validation'), StageMetrics('line_creation')]
+    read_stage, validation_stage, creation_stage = stages
+    errors = []
+
+    try:
+        with transaction.atomic():
+            chunks = processor.read_chunks(full_path, chunk_size)
+            while True:
+                # Read and clean chunk
+                with read_stage.measure():
+                    df = next(chunks, None)
+                    if df is None:
+                        break
+                    df = processor.clean_data(df)
+                    read_stage.add_rows(len(df))
+                update_import_progress(batch.pk, rows_read=read_stage.rows)
+
+                # Validate chunk
+                with validation_stage.measure():
+                    errors = validator.validate_structure(df)
+                    if not errors:
+                        df = duplicate_filter.drop_duplicates(df)
+                        errors = validator.validate_data(df)
+                    validation_stage.add_rows(len(df))
+
+                if errors:
+                    transaction.set_rollback(True)
+                    break
+
+                # Create chunk lines
+                with creation_stage.measure():
+                    batch_creator._create_batch_lines(batch, df)
+                    creation_stage.add_rows(len(df))
+                update_import_progress(batch.pk, rows_inserted=creation_stage.rows)
+    finally:
+        for stage in stages:
+            record_stage(batch.pk, stage)
+
+    if errors:
+        # Inserted chunks were rolled back
+        update_import_progress(batch.pk, rows_inserted=0)
+    return errors
+
+def _split_file_in_shards(batch: PayrollBatch, full_path: str, shards: int) -> Tuple[List[ValidationError], List[str]]:
+    """
+    Validate the file and split its rows by field worker into at most
+    `shards` files, so every worker's lines of the batch end up in the same
+    shard. CSV and Parquet files are streamed a chunk at a time like an
+    unsharded import, other formats are read whole.
+    The split runs in a single task, it only reads and writes files.
+    Returns the validation errors and the shard paths.
+    """
+    processor = PayrollFileProcessor()
+    validator = PayrollFileValidator(
+        start_date=batch.start_date, end_date=batch.end_date, payroll_batch=batch
+    )
+    duplicate_filter = DuplicateRowFilter()
+    chunk_size = settings.PAYROLL_IMPORT_CHUNK_SIZE
+    if chunk_size and processor.can_read_in_chunks(full_path):
+        chunks = processor.read_chunks(full_path, chunk_size)
+    else:
+        chunks = iter([processor.read_file(full_path)])
+
+    stages = [StageMetrics('import'), StageMetrics('validation'), StageMetrics('split')]
+    read_stage, validation_stage, split_stage = stages
+    shard_paths = {}
+    errors = []
+    try:
+        while True:
+            with read_stage.measure():
+                df = next(chunks, None)
+                if df is None:
+                    break
+                df = processor.clean_data(df)
+                read_stage.add_rows(len(df))
+            update_import_progress(batch.pk, rows_read=read_stage.rows)
+
+            with validation_stage.measure():
+                errors = validator.validate_structure(df)
+                if not errors:
+                    df = duplicate_filter.drop_duplicates(df)
+                    errors = validator.validate_data(df)
+                validation_stage.add_rows(len(df))
+            if errors:
+                break
+
+            with split_stage.measure():
+                _append_to_shards(batch, df, shards, shard_paths)
+                split_stage.add_rows(len(df))
+    finally:
+        for stage in stages:
+            record_stage(batch.pk, stage)
+
+    if errors:
+        for shard_path in shard_paths.values():
+            default_storage.delete(shard_path)
+        return errors, []
+    return errors, [shard_paths[shard] for shard in sorted(shard_paths)]
+
+def _append_to_shards(batch: PayrollBatch, df: pd.DataFrame, shards: int, shard_paths: dict) -> None:
+    """Append the rows of a chunk to the files of their shards, created on first use"""
+    # Stable across processes, unlike the builtin hash of strings
+    worker_hashes = pd.util.hash_array(df['field_worker'].astype(str).to_numpy())
+    for shard, shard_df in df.groupby(worker_hashes % shards):
+        is_new = shard not in shard_paths
+        if is_new:
+            shard_paths[shard] = default_storage.save(
+                f"temp/payroll_batch_{batch.pk}_shard_{shard}.csv", ContentFile(b"")
+            )
+        with open(default_storage.path(shard_paths[shard]), 'a') as shard_file:
+            shard_df[list(FILE_COLUMNS)].to_csv(
+                shard_file, index=False, header=is_new, date_format='%Y-%m-%d'
+            )
+
+def _dispatch_shards(batch: PayrollBatch, shard_paths: List[str]):
+    """Insert and calculate the shards in parallel, then mark the batch ready"""
+    # Shards roll back when the batch is in error, clear the one of a previous import
+    PayrollBatch.objects.filter(pk=batch.pk).update(status='processing', error_message=None)
+    shard_tasks = group(
+        import_payroll_shard_task.s(batch.pk, shard_path, shard)
+        for shard, shard_path in enumerate(shard_paths)
+    )
+    chord(shard_tasks)(finalize_sharded_import_task.s(batch.pk))
+
+def _dispatch_batch_calculation(batch: PayrollBatch):
+    """Queue the calculation of a batch for its calculation backend"""
+    backend = batch.get_calculation_backend()
+    if backend in (CALCULATION_BACKEND_FUSED, CALCULATION_BACKEND_SQL):
+        batch_calculation_task.delay(batch.pk, backend)
+        return
+
+    # Chain calculation tasks efficiently
+    calculation_chain = chain(
+        batch_inline_calculation_task.s(batch.pk, backend),
+        batch_day_level_calculation_task.s(),
+        batch_week_level_calculation_task.s(),
+        finalize_batch_task.s()
+    )
+    calculation_chain.apply_async()
+
+def _get_inline_calculator(backend):
+    """Pick the inline calculator for a calculation backend"""
+    if backend == CALCULATION_BACKEND_COLUMNAR:
+        return ColumnarInlineCalculator()
+    return InlineCalculator()
+
+def _fail_sharded_import(batch_id, error_message: str) -> None:
+    """
+    Mark a sharded import as failed and delete the lines the other shards
+    already committed, so the file can be imported again. Shards lock the
+    batch before they commit, one that commits later sees the error and
+    rolls back.
+    """
+    with transaction.atomic():
+        batch = PayrollBatch.objects.select_for_update().get(pk=batch_id)
+        if batch.status != 'error':
+            # The first failed shard gives the message
+            batch.status = 'error'
+            batch.error_message = error_message
+            batch.save(update_fields=['status', 'error_message'])
+        PayrollBatchLine.objects.filter(payroll_batch_id=batch_id).delete()
+        bump_batch_version(batch_id)
+    update_import_progress(batch_id, IMPORT_STAGE_ERROR, rows_inserted=0, rows_calculated=0)
+
 def _handle_batch_error(batch: PayrollBatch, errors: List[ValidationError]) -> None:
     """Handle validation errors by updating batch status"""
     error_msg = "; ".join(str(error) for error in errors[:10])  # Limit error message length
@@ -319,3 +694,4 @@ def _handle_batch_error(batch: PayrollBatch, errors: List[ValidationError]) -> N
     batch.status = 'error'
     batch.error_message = error_msg  # Assuming you have this field
     batch.save(update_fields=['status', 'error_message'])
+    update_import_progress(batch.pk, IMPORT_STAGE_ERROR)
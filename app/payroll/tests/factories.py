@@ -0,0 +1,131 @@
+"""Builders of the payroll test data, shared by the test modules"""
+from datetime import date, timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from payroll.models import (
+    PayrollConfiguration,
+    PayrollBatch,
+    Farm,
+    PayrollBatchLine,
+    FieldWorker,
+    Activity,
+    Tariff,
+    Uom,
+    LaborType,
+    ActivityGroup,
+)
+
+WEEK_START = date(2025, 6, 30)
+
+
+def create_config(**kwargs):
+    values = {
+        'mobilization_percentage': 80,
+        'extra_hours_percentage': 20,
+        'basic_monthly_wage': 480,
+        'extra_hour_multiplier': 1.5,
+        **kwargs,
+    }
+    return PayrollConfiguration.objects.create(id=1, **values)
+
+
+def create_farm(name="Test Farm", code="TSTF"):
+    return Farm.objects.create(name=name, code=code)
+
+
+def create_batch(farm, name="Test Payroll Batch", start_date=WEEK_START):
+    return PayrollBatch.objects.create(
+        name=name,
+        start_date=start_date,
+        end_date=start_date + timedelta(days=6),
+        farm=farm,
+    )
+
+
+def create_worker(number, wage=600):
+    return FieldWorker.objects.create(
+        name=f"Worker {number}",
+        odoo_employee_id=number,
+        odoo_contract_id=number,
+        identification_number=f"{1234567000 + number}",
+        wage=wage,
+        contract_status="open",
+    )
+
+
+def create_activities():
+    """Harvest and Plant are work, Absence is a leave without bonuses"""
+    activity_group = ActivityGroup.objects.create(name="Test Activity Group", code="TSTAG")
+    uom = Uom.objects.create(name="Units")
+    work = LaborType.objects.create(name="Test Work", code="TWT")
+    leave = LaborType.objects.create(
+        name="Test Leave",
+        code="TLT",
+        calculates_integral=False,
+        calculates_thirteenth_bonus=False,
+        calculates_fourteenth_bonus=False
+    )
+    return [
+        Activity.objects.create(name=name, activity_group=activity_group, labor_type=labor_type, uom=uom)
+        for name, labor_type in (("Harvest", work), ("Plant", work), ("Absence", leave))
+    ]
+
+
+def create_line(payroll_batch, worker, activity, line_date, quantity):
+    return PayrollBatchLine.objects.create(
+        payroll_batch=payroll_batch,
+        field_worker=worker,
+        activity=activity,
+        date=line_date,
+        quantity=quantity,
+    )
+
+
+class PayrollBatchFixtureMixin:
+    """
+    A week batch of a farm with its configuration, the Harvest, Plant
+    and Absence activities and tariffs for the first two, without lines
+    """
+    WEEK_START = WEEK_START
+
+    def setUp(self):
+        super().setUp()
+        # Cached tariffs and config of a previous run may share these ids
+        cache.clear()
+        # As if committed, the caches only keep committed values
+        with self.captureOnCommitCallbacks(execute=True):
+            self.farm = create_farm()
+            self.payroll_batch = create_batch(self.farm)
+            self.payroll_config = create_config()
+            self.harvest, self.plant, self.absence = create_activities()
+            Tariff.objects.create(name="Harvest", activity=self.harvest, farm=self.farm, cost_per_unit=2.00)
+            Tariff.objects.create(name="Plant", activity=self.plant, farm=self.farm, cost_per_unit=3.35)
+
+    def _create_line(self, worker, activity, line_date, quantity):
+        return create_line(self.payroll_batch, worker, activity, line_date, quantity)
+
+    def _batch_lines(self):
+        return PayrollBatchLine.objects.filter(payroll_batch=self.payroll_batch)
+
+
+class PayrollWeekFixtureMixin(PayrollBatchFixtureMixin):
+    """
+    Seeds three workers with a week of lines covering weekdays,
+    weekends, split days and missing tariffs
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.workers = [
+            create_worker(i, wage) for i, wage in enumerate([600, 480, 510.50], start=1)
+        ]
+        quantities = [Decimal('10'), Decimal('4.5'), Decimal('0'), Decimal('17.125'), Decimal('7')]
+        for w, worker in enumerate(self.workers):
+            for day in range(7):
+                line_date = self.WEEK_START + timedelta(days=day)
+                # Every worker harvests daily, some days are split with a second activity
+                self._create_line(worker, self.harvest, line_date, quantities[(w + day) % 5] + day)
+                if (w + day) % 3 == 0:
+                    self._create_line(worker, self.plant, line_date, quantities[(w * day) % 5])
+                if (w + day) % 4 == 1:
+                    self._create_line(worker, self.absence, line_date, Decimal('1'))
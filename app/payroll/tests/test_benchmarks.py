@@ -0,0 +1,77 @@
+import json
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from payroll.benchmarks import SyntheticPayrollWorkload, BenchmarkRunner
+from payroll.models import FieldWorker, PayrollBatchLine
+
+SEARCHES = [
+    "PayrollLineFilter.field_worker__name",
+    "PayrollLineFilter.field_worker__id",
+    "PayrollLineFilter.activity__name",
+    "PayrollLineFilter.payroll_batch__name",
+    "FieldWorkerFilter.name",
+]
+
+
+class SyntheticPayrollWorkloadTests(TestCase):
+
+    def test_generates_a_week_of_lines(self):
+        workload = SyntheticPayrollWorkload(workers=4, activities_per_day=3, activities=5)
+        workload.create_reference_data()
+        batch = workload.create_batch()
+        workload.create_lines(batch)
+
+        lines = PayrollBatchLine.objects.filter(payroll_batch=batch)
+        self.assertEqual(lines.count(), 4 * 7 * 3)
+        self.assertEqual(lines.values('date').distinct().count(), 7)
+
+    def test_rejects_more_activities_per_day_than_activities(self):
+        with self.assertRaises(ValueError):
+            SyntheticPayrollWorkload(activities_per_day=3, activities=2)
+
+
+class BenchmarkRunnerTests(TestCase):
+
+    def test_records_queries_and_memory(self):
+        runner = BenchmarkRunner()
+        result = runner.run("count", lambda: list(FieldWorker.objects.all()))
+
+        self.assertEqual(result['queries'], 1)
+        self.assertGreater(result['peak_memory'], 0)
+        self.assertEqual(runner.results, [result])
+
+
+class BenchmarkCommandTests(TestCase):
+
+    def test_writes_json_report(self):
+        out = StringIO()
+        call_command("benchmark_payroll", workers=3, activities_per_day=2, skip_memory=True, stdout=out)
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['parameters']['lines'], 42)
+        self.assertEqual(
+            [result['name'] for result in report['results']],
+            [
+                "import_payroll_file",
+                "InlineCalculator.calculate_batch",
+                "batch_day_level_calculation_task",
+                "batch_week_level_calculation_task",
+                "recalculate_line",
+                *SEARCHES,
+            ]
+        )
+        # The workload is rolled back
+        self.assertFalse(PayrollBatchLine.objects.exists())
+
+    def test_skip_calculation_only_times_the_searches(self):
+        out = StringIO()
+        call_command(
+            "benchmark_payroll", workers=3, activities_per_day=2, skip_memory=True, skip_calculation=True, stdout=out
+        )
+
+        report = json.loads(out.getvalue())
+        self.assertEqual([result['name'] for result in report['results']], SEARCHES)
+        # Count and page
+        self.assertTrue(all(result['queries'] == 2 for result in report['results']))
+        self.assertFalse(PayrollBatchLine.objects.exists())
@@ -0,0 +1,222 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from core.tests import AuthenticatedAPITestCase
+from payroll.models import (
+    PayrollConfiguration,
+    Farm,
+    Tariff,
+    Activity,
+    ActivityGroup,
+    LaborType,
+    Uom,
+)
+from payroll.caches import (
+    TariffIndex,
+    PayrollConfigCache,
+    config_cache,
+    get_payroll_config,
+    invalidate_tariff_index,
+    TARIFF_INDEX_KEY,
+    TARIFF_VERSION_KEY,
+)
+from decimal import Decimal
+
+
+class TariffFixtureMixin:
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        # As if committed, the index only caches committed tariffs
+        with self.captureOnCommitCallbacks(execute=True):
+            activity_group = ActivityGroup.objects.create(name="Test Activity Group", code="TSTAG")
+            labor_type = LaborType.objects.create(name="Test Labor Type", code="TLT")
+            uom = Uom.objects.create(name="Units")
+            self.activity = Activity.objects.create(
+                name="Harvest", activity_group=activity_group, labor_type=labor_type, uom=uom
+            )
+            self.activity2 = Activity.objects.create(
+                name="Plant", activity_group=activity_group, labor_type=labor_type, uom=uom
+            )
+            self.farm1 = Farm.objects.create(name="Test Farm 1", code="TSTF1")
+            self.farm2 = Farm.objects.create(name="Test Farm 2", code="TSTF2")
+            self.tariff1 = Tariff.objects.create(
+                name="Test Tariff 1", activity=self.activity, farm=self.farm1, cost_per_unit=10.00
+            )
+            self.tariff2 = Tariff.objects.create(
+                name="Test Tariff 2", activity=self.activity2, farm=self.farm1, cost_per_unit=20.00
+            )
+
+
+class TariffIndexTests(TariffFixtureMixin, TestCase):
+
+    def test_loads_a_farm_with_one_query(self):
+        index = TariffIndex()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(index.get_price(self.activity.pk, self.farm1.pk), Decimal('10.00'))
+            self.assertEqual(index.get_price(self.activity2.pk, self.farm1.pk), Decimal('20.00'))
+
+    def test_missing_tariff_is_free(self):
+        index = TariffIndex()
+
+        self.assertEqual(index.get_price(self.activity.pk, self.farm2.pk), Decimal(0))
+
+    def test_index_is_shared_through_the_cache(self):
+        TariffIndex().load_farm(self.farm1.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                TariffIndex().get_price(self.activity.pk, self.farm1.pk), Decimal('10.00')
+            )
+
+
+class TariffIndexInvalidationTests(TariffFixtureMixin, AuthenticatedAPITestCase):
+    def _get_tariff_detail_url(self, pk):
+        return reverse("payroll:tariff-detail", kwargs={"pk": pk})
+
+    def setUp(self):
+        super().setUp()
+        # Prime the cache
+        TariffIndex().load_farm(self.farm1.pk)
+        TariffIndex().load_farm(self.farm2.pk)
+
+    def test_update_invalidates_index(self):
+        res = self.client.patch(
+            self._get_tariff_detail_url(self.tariff1.pk), {"cost_per_unit": 12.50}, format="json"
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(TariffIndex().get_price(self.activity.pk, self.farm1.pk), Decimal('12.50'))
+
+    def test_moving_tariff_invalidates_both_farms(self):
+        res = self.client.patch(
+            self._get_tariff_detail_url(self.tariff1.pk), {"farm": self.farm2.pk}, format="json"
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        index = TariffIndex()
+        self.assertEqual(index.get_price(self.activity.pk, self.farm1.pk), Decimal(0))
+        self.assertEqual(index.get_price(self.activity.pk, self.farm2.pk), Decimal('10.00'))
+
+    def test_create_invalidates_index(self):
+        payload = {
+            "name": "Test Tariff 3",
+            "activity": self.activity.pk,
+            "farm": self.farm2.pk,
+            "cost_per_unit": 30.00,
+        }
+        res = self.client.post(reverse("payroll:tariff-list"), payload, format="json")
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(TariffIndex().get_price(self.activity.pk, self.farm2.pk), Decimal('30.00'))
+
+    def test_delete_invalidates_index(self):
+        res = self.client.delete(self._get_tariff_detail_url(self.tariff2.pk))
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertEqual(TariffIndex().get_price(self.activity2.pk, self.farm1.pk), Decimal(0))
+
+    def test_saves_outside_the_api_invalidate_index(self):
+        self.tariff1.cost_per_unit = Decimal('11.00')
+        self.tariff1.save()
+
+        self.assertEqual(TariffIndex().get_price(self.activity.pk, self.farm1.pk), Decimal('11.00'))
+
+    def test_queryset_updates_need_an_explicit_invalidation(self):
+        Tariff.objects.filter(pk=self.tariff1.pk).update(cost_per_unit=Decimal('13.00'))
+        invalidate_tariff_index()
+
+        self.assertEqual(TariffIndex().get_price(self.activity.pk, self.farm1.pk), Decimal('13.00'))
+
+    def test_version_is_published_again_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.tariff1.cost_per_unit = Decimal('14.00')
+            self.tariff1.save()
+        # An index loaded before the commit, with the old prices
+        cache.set(
+            TARIFF_INDEX_KEY.format(version=cache.get(TARIFF_VERSION_KEY), farm_id=self.farm1.pk),
+            {self.activity.pk: Decimal('10.00')},
+        )
+
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(TariffIndex().get_price(self.activity.pk, self.farm1.pk), Decimal('14.00'))
+
+
+    def test_rolled_back_tariff_is_not_cached(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.tariff1.cost_per_unit = Decimal('15.00')
+            self.tariff1.save()
+            # Read by the transaction itself
+            self.assertEqual(TariffIndex().get_price(self.activity.pk, self.farm1.pk), Decimal('15.00'))
+            raise ValueError("Rolled back")
+
+        self.assertEqual(TariffIndex().get_price(self.activity.pk, self.farm1.pk), Decimal('10.00'))
+
+class PayrollConfigCacheTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payroll_config = PayrollConfiguration.objects.create(
+                id=1,
+                mobilization_percentage=80,
+                extra_hours_percentage=20,
+                basic_monthly_wage=480,
+                extra_hour_multiplier=1.5
+            )
+
+    def test_snapshot_is_reused_without_queries(self):
+        get_payroll_config()
+
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                config = get_payroll_config()
+
+        self.assertEqual(config.mobilization_percentage, Decimal('80.00'))
+
+    def test_other_processes_share_the_snapshot(self):
+        get_payroll_config()
+
+        with self.assertNumQueries(0):
+            config = PayrollConfigCache().get()
+
+        self.assertEqual(config.basic_monthly_wage, Decimal('480.00'))
+
+    def test_saving_through_view_publishes_new_version(self):
+        # Another process holding the old snapshot
+        worker_cache = PayrollConfigCache()
+        self.assertEqual(worker_cache.get().basic_monthly_wage, Decimal('480.00'))
+
+        res = self.client.patch(
+            reverse("payroll:configuration"), {"basic_monthly_wage": 700}, format="json"
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        # Next task on the worker
+        worker_cache.expire()
+        self.assertEqual(worker_cache.get().basic_monthly_wage, Decimal('700.00'))
+        self.assertEqual(get_payroll_config().basic_monthly_wage, Decimal('700.00'))
+
+    def test_requests_expire_the_local_copy(self):
+        get_payroll_config()
+        self.client.get(reverse("payroll:configuration"))
+
+        self.assertEqual(config_cache._expires_at, 0)
+
+    def test_rolled_back_config_is_not_cached(self):
+        get_payroll_config()
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            config = PayrollConfiguration.get_config()
+            config.basic_monthly_wage = Decimal('99.00')
+            config.save()
+            self.assertEqual(get_payroll_config().basic_monthly_wage, Decimal('99.00'))
+            raise ValueError("Rolled back")
+
+        self.assertEqual(get_payroll_config().basic_monthly_wage, Decimal('480.00'))
+        self.assertEqual(PayrollConfigCache().get().basic_monthly_wage, Decimal('480.00'))
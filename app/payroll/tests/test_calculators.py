@@ -0,0 +1,342 @@
+from django.test import TestCase, override_settings
+from django.db import connection
+from django.db.models import Count
+from payroll.models import FieldWorker, PayrollBatchLine
+from payroll.calculators import (
+    InlineCalculator,
+    ColumnarInlineCalculator,
+    DayLevelCalculator,
+    WeekLevelCalculator,
+    SqlBatchCalculator,
+)
+from payroll.constants import CALCULATION_BACKEND_SQL
+from payroll.caches import get_payroll_config
+from payroll.orchestrators import OUTPUT_FIELDS, PayrollCalculationOrchestrator
+from payroll.tasks import (
+    batch_inline_calculation_task,
+    batch_day_level_calculation_task,
+    batch_week_level_calculation_task,
+    batch_calculation_task,
+    _dispatch_batch_calculation,
+)
+from decimal import Decimal
+from datetime import timedelta
+from .factories import PayrollWeekFixtureMixin
+
+
+class PayrollCalculationFixtureMixin(PayrollWeekFixtureMixin):
+    """Compares the calculated outputs of the seeded week"""
+
+    def _snapshot(self):
+        return {
+            line['id']: line
+            for line in self._batch_lines().values('id', *OUTPUT_FIELDS)
+        }
+
+    def _reset_outputs(self):
+        self._batch_lines().update(**{field: None for field in OUTPUT_FIELDS})
+
+    def assertSnapshotsMatch(self, expected, actual, fields=OUTPUT_FIELDS, places=Decimal('0.01')):
+        """Values closer than places, or equal when places is None"""
+        self.assertEqual(expected.keys(), actual.keys())
+        for line_id, values in expected.items():
+            for field in fields:
+                if places is None:
+                    self.assertEqual(
+                        values[field], actual[line_id][field], f"{field} differs for line {line_id}"
+                    )
+                    continue
+                self.assertLess(
+                    abs(values[field] - actual[line_id][field]),
+                    places,
+                    f"{field} differs for line {line_id}"
+                )
+
+
+class ColumnarInlineCalculatorTests(PayrollCalculationFixtureMixin, TestCase):
+
+    def test_matches_per_line_calculator(self):
+        InlineCalculator().calculate_batch(
+            self._batch_lines().select_related('field_worker', 'payroll_batch')
+        )
+        expected = self._snapshot()
+
+        self._reset_outputs()
+        ColumnarInlineCalculator().calculate_batch(self._batch_lines())
+
+        # Same values at the stored precision, not only to the cent
+        self.assertSnapshotsMatch(
+            expected, self._snapshot(), fields=ColumnarInlineCalculator.OUTPUT_FIELDS, places=None
+        )
+
+    def test_missing_tariff_costs_nothing(self):
+        ColumnarInlineCalculator().calculate_batch(self._batch_lines())
+
+        for line in self._batch_lines().filter(activity=self.absence):
+            self.assertEqual(line.total_cost, Decimal('0'))
+
+    def test_query_count_does_not_grow_with_lines(self):
+        # Load, tariffs, config and a single bulk update
+        with self.assertNumQueries(4):
+            ColumnarInlineCalculator().calculate_batch(self._batch_lines())
+
+    def test_empty_batch(self):
+        self._batch_lines().delete()
+        df = ColumnarInlineCalculator().calculate_batch(self._batch_lines())
+
+        self.assertTrue(df.empty)
+
+
+class BatchDayLevelCalculatorTests(PayrollCalculationFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        InlineCalculator().calculate_batch(
+            self._batch_lines().select_related('field_worker', 'payroll_batch')
+        )
+        self.inline_snapshot = self._snapshot()
+
+    def _split_days(self):
+        return self._batch_lines().values('field_worker', 'date')\
+            .annotate(lines=Count('id')).filter(lines__gt=1)
+
+    def test_matches_per_day_calculator(self):
+        calculator = DayLevelCalculator()
+        for workers_day in self._split_days():
+            calculator.calculate({
+                'worker': FieldWorker.objects.get(pk=workers_day['field_worker']),
+                'payroll_batch': self.payroll_batch,
+                'date': workers_day['date'],
+            })
+        expected = self._snapshot()
+
+        InlineCalculator().calculate_batch(
+            self._batch_lines().select_related('field_worker', 'payroll_batch')
+        )
+        calculator.calculate_batch(self._batch_lines().select_related('field_worker'))
+
+        self.assertSnapshotsMatch(expected, self._snapshot(), places=Decimal('0.0005'))
+
+    def test_single_line_days_are_left_untouched(self):
+        updated_lines = DayLevelCalculator().calculate_batch(
+            self._batch_lines().select_related('field_worker')
+        )
+
+        updated_ids = {line.pk for line in updated_lines}
+        for line_id, values in self._snapshot().items():
+            if line_id not in updated_ids:
+                self.assertEqual(values, self.inline_snapshot[line_id])
+
+    def test_task_runs_constant_queries(self):
+        # Load the batch, a single bulk update and the stage metrics
+        with self.assertNumQueries(3):
+            batch_day_level_calculation_task(self.payroll_batch.pk)
+
+
+class BatchWeekLevelCalculatorTests(PayrollCalculationFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # A fourth worker who only works four days and one who never works
+        self.workers.append(FieldWorker.objects.create(
+            name="Worker 4", odoo_employee_id=4, identification_number="1234567004", wage=450,
+        ))
+        self.workers.append(FieldWorker.objects.create(
+            name="Worker 5", odoo_employee_id=5, identification_number="1234567005", wage=450,
+        ))
+        for day in range(4):
+            self._create_line(self.workers[3], self.harvest, self.WEEK_START + timedelta(days=day), 5)
+        self._create_line(self.workers[4], self.absence, self.WEEK_START, 1)
+        # Stale values that must be cleared
+        self._batch_lines().update(integral_bonus=Decimal('99'))
+
+    def test_matches_per_worker_calculator(self):
+        calculator = WeekLevelCalculator()
+        for worker in FieldWorker.objects.all():
+            calculator.calculate({'worker': worker, 'payroll_batch': self.payroll_batch})
+        expected = self._snapshot()
+
+        self._batch_lines().update(integral_bonus=Decimal('99'))
+        calculator.calculate_batch(self.payroll_batch)
+
+        self.assertSnapshotsMatch(expected, self._snapshot(), fields=['integral_bonus'], places=Decimal('0.0005'))
+
+    def test_distributes_integral_bonus(self):
+        WeekLevelCalculator().calculate_batch(self.payroll_batch)
+
+        # 7 worked days: two daily wages spread over the worked days
+        line = self._batch_lines().filter(field_worker=self.workers[0], activity=self.harvest).first()
+        self.assertEqual(line.integral_bonus, (Decimal('40') / 7).quantize(Decimal('0.001')))
+        # 4 worked days: one daily wage
+        line = self._batch_lines().filter(field_worker=self.workers[3]).first()
+        self.assertEqual(line.integral_bonus, Decimal('15') / 4)
+        # Non integral activities and idle workers are cleared
+        self.assertFalse(
+            self._batch_lines().filter(activity=self.absence).exclude(integral_bonus=0).exists()
+        )
+
+    def test_update_joins_the_worker_bonuses(self):
+        workers = FieldWorker.objects.bulk_create([
+            FieldWorker(
+                name=f"Worker {i}", odoo_employee_id=i, identification_number=f"{1234560000 + i}", wage=450,
+            )
+            for i in range(10, 3010)
+        ])
+        PayrollBatchLine.objects.bulk_create([
+            PayrollBatchLine(
+                payroll_batch=self.payroll_batch, field_worker=worker, activity=self.harvest,
+                date=self.WEEK_START + timedelta(days=day), quantity=5, iso_year=2025, iso_week=27,
+            )
+            for worker in workers for day in range(5)
+        ])
+        calculator = WeekLevelCalculator()
+
+        sql, params = calculator._update_integral_sql(self.payroll_batch)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN {sql}", params)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+
+        # One hash lookup of the bonus per line, not a check of every worker
+        self.assertRegex(plan, r"Hash Cond: \(.*field_worker_id")
+        self.assertNotIn("SubPlan", plan)
+
+        self.assertEqual(calculator.calculate_batch(self.payroll_batch), self._batch_lines().count())
+        line = self._batch_lines().filter(field_worker=workers[-1]).first()
+        self.assertEqual(line.integral_bonus, Decimal('6'))
+
+    def test_task_runs_constant_queries(self):
+        # Grouped worked days count, one joined update and the stage metrics
+        with self.assertNumQueries(3):
+            batch_week_level_calculation_task(self.payroll_batch.pk)
+
+
+class FusedBatchCalculationTests(PayrollCalculationFixtureMixin, TestCase):
+
+    def _run_chained_tasks(self):
+        batch_inline_calculation_task(self.payroll_batch.pk)
+        batch_day_level_calculation_task(self.payroll_batch.pk)
+        batch_week_level_calculation_task(self.payroll_batch.pk)
+
+    def test_matches_chained_tasks(self):
+        self._run_chained_tasks()
+        expected = self._snapshot()
+
+        self._reset_outputs()
+        self._batch_lines().update(integral_bonus=0)
+        PayrollCalculationOrchestrator().calculate_batch(self.payroll_batch.pk)
+
+        self.assertSnapshotsMatch(expected, self._snapshot(), places=Decimal('0.0005'))
+
+    def test_marks_batch_ready(self):
+        self.payroll_batch.status = 'processing'
+        self.payroll_batch.save(update_fields=['status'])
+
+        batch_calculation_task(self.payroll_batch.pk)
+
+        self.payroll_batch.refresh_from_db()
+        self.assertEqual(self.payroll_batch.status, 'ready')
+
+    def test_runs_constant_queries(self):
+        orchestrator = PayrollCalculationOrchestrator()
+        orchestrator.tariff_index.load_farm(self.farm.pk)
+        get_payroll_config()
+        # Savepoint, load, bulk update, status update and release
+        with self.assertNumQueries(5):
+            orchestrator.calculate_batch(self.payroll_batch.pk)
+
+
+class SqlBatchCalculatorTests(PayrollCalculationFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # A split day with nothing to distribute
+        self._create_line(self.workers[2], self.absence, self.WEEK_START, 2)
+
+    def test_matches_python_calculators(self):
+        batch_inline_calculation_task(self.payroll_batch.pk)
+        batch_day_level_calculation_task(self.payroll_batch.pk)
+        batch_week_level_calculation_task(self.payroll_batch.pk)
+        expected = self._snapshot()
+
+        self._reset_outputs()
+        SqlBatchCalculator().calculate_batch(self.payroll_batch.pk)
+
+        self.assertSnapshotsMatch(expected, self._snapshot(), places=Decimal('0.0015'))
+
+    def test_matches_fused_calculation(self):
+        PayrollCalculationOrchestrator().calculate_batch(self.payroll_batch.pk)
+        expected = self._snapshot()
+
+        self._reset_outputs()
+        PayrollCalculationOrchestrator().calculate_batch_in_database(self.payroll_batch.pk)
+
+        self.assertSnapshotsMatch(expected, self._snapshot(), places=Decimal('0.0015'))
+
+    def test_runs_a_single_statement(self):
+        get_payroll_config()
+        with self.assertNumQueries(1):
+            updated = SqlBatchCalculator().calculate_batch(self.payroll_batch.pk)
+
+        self.assertEqual(updated, self._batch_lines().count())
+
+    def test_selected_per_batch(self):
+        self.payroll_batch.calculation_backend = CALCULATION_BACKEND_SQL
+        self.payroll_batch.status = 'processing'
+        self.payroll_batch.save()
+
+        with override_settings(CELERY_TASK_ALWAYS_EAGER=True):
+            _dispatch_batch_calculation(self.payroll_batch)
+
+        self.payroll_batch.refresh_from_db()
+        self.assertEqual(self.payroll_batch.status, 'ready')
+        self.assertFalse(self._batch_lines().filter(total_cost__isnull=True).exists())
+
+
+class IncrementalRecalculationTests(PayrollCalculationFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.orchestrator = PayrollCalculationOrchestrator()
+        self.orchestrator.calculate_batch(self.payroll_batch.pk)
+        self.orchestrator.tariff_index.load_farm(self.farm.pk)
+        get_payroll_config()
+        # A split day of the first worker
+        self.line = self._batch_lines().get(
+            field_worker=self.workers[0], activity=self.harvest, date=self.WEEK_START
+        )
+
+    def test_matches_full_recalculation(self):
+        self._batch_lines().filter(pk=self.line.pk).update(quantity=Decimal('31.5'))
+        self.orchestrator.recalculate_line(self.line.pk)
+        actual = self._snapshot()
+
+        self.orchestrator.calculate_batch(self.payroll_batch.pk)
+
+        self.assertSnapshotsMatch(self._snapshot(), actual, places=Decimal('0.0015'))
+
+    def test_writes_only_changed_lines(self):
+        self._batch_lines().filter(pk=self.line.pk).update(quantity=Decimal('31.5'))
+
+        # Savepoint, worker's lines, bulk update and release
+        with self.assertNumQueries(4):
+            written = self.orchestrator.recalculate_line(self.line.pk, recalc_week=False)
+
+        # The edited line and the other line of its day
+        self.assertEqual(written, 2)
+
+    def test_unchanged_line_writes_nothing(self):
+        with self.assertNumQueries(3):
+            written = self.orchestrator.recalculate_line(self.line.pk)
+
+        self.assertEqual(written, 0)
+
+    def test_recalculate_after_deletion(self):
+        self.line.delete()
+        self.orchestrator.recalculate_after_deletion(
+            self.workers[0], self.payroll_batch, self.WEEK_START
+        )
+        actual = self._snapshot()
+
+        self.orchestrator.calculate_batch(self.payroll_batch.pk)
+
+        self.assertSnapshotsMatch(self._snapshot(), actual, places=Decimal('0.0015'))
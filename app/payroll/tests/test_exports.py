@@ -0,0 +1,75 @@
+import csv
+import io
+from datetime import timedelta
+from decimal import Decimal
+import pandas as pd
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from core.tests import AuthenticatedAPITestCase
+from payroll.exports import EXPORT_COLUMNS
+from payroll.orchestrators import PayrollCalculationOrchestrator
+from payroll.payroll_processor import FILE_COLUMNS, PayrollFileProcessor
+from .factories import PayrollBatchFixtureMixin, create_worker
+
+
+class PayrollLineExportTests(PayrollBatchFixtureMixin, AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        # More lines than an export chunk, inserted out of the export order
+        workers = [create_worker(2), create_worker(1)]
+        for worker in workers:
+            for day in range(3):
+                self._create_line(worker, self.harvest, self.WEEK_START + timedelta(days=day), Decimal('10.5') + day)
+        self._create_line(workers[1], self.plant, self.WEEK_START, Decimal('4.125'))
+        PayrollCalculationOrchestrator().calculate_batch(self.payroll_batch.pk)
+        self.url = reverse("payroll:payroll-batch-export", kwargs={"pk": self.payroll_batch.pk})
+
+    def _expected_rows(self):
+        lines = self._batch_lines()\
+            .order_by('date', 'field_worker__identification_number', 'id')\
+            .values_list(*(lookup for _header, lookup in EXPORT_COLUMNS))
+        return [[str(value) if value is not None else "" for value in line] for line in lines]
+
+    @override_settings(PAYROLL_EXPORT_CHUNK_SIZE=4)
+    def test_csv_is_streamed(self):
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res["Content-Type"], "text/csv")
+        self.assertIn(f'filename="payroll_batch_{self.payroll_batch.pk}.csv"', res["Content-Disposition"])
+
+        rows = list(csv.reader(io.StringIO(b"".join(res.streaming_content).decode())))
+        self.assertEqual(rows[0], [header for header, _lookup in EXPORT_COLUMNS])
+        self.assertEqual(rows[1:], self._expected_rows())
+
+    def test_csv_reads_back_as_an_import_file(self):
+        res = self.client.get(self.url)
+        export_file = io.StringIO(b"".join(res.streaming_content).decode())
+
+        df = PayrollFileProcessor.clean_data(pd.read_csv(export_file, dtype={"field_worker": str}))
+
+        self.assertEqual(len(df), self._batch_lines().count())
+        self.assertTrue(set(FILE_COLUMNS) <= set(df.columns))
+
+    def test_unknown_file_type(self):
+        res = self.client.get(self.url, {"file_type": "pdf"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_xlsx(self):
+        from openpyxl import load_workbook
+
+        res = self.client.get(self.url, {"file_type": "xlsx"})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        sheet = load_workbook(io.BytesIO(b"".join(res.streaming_content)), read_only=True).active
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(list(rows[0]), [header for header, _lookup in EXPORT_COLUMNS])
+        self.assertEqual(len(rows) - 1, self._batch_lines().count())
+        first_line = self._expected_rows()[0]
+        self.assertEqual(rows[1][1], first_line[1])
+        self.assertEqual(Decimal(str(rows[1][3])), Decimal(first_line[3]))
@@ -0,0 +1,736 @@
+import io
+import pandas as pd
+from datetime import date, timedelta
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from core.tests import AuthenticatedAPITestCase
+from payroll.caches import config_cache, get_payroll_config
+from payroll.models import PayrollBatch, PayrollConfiguration
+from payroll.orchestrators import OUTPUT_FIELDS, PayrollCalculationOrchestrator
+from payroll.payroll_processor import (
+    DuplicateRowFilter,
+    PayrollBatchCreator,
+    PayrollFileProcessor,
+    PayrollFileValidator,
+    ReferenceResolver,
+)
+from payroll.progress import get_import_progress
+from payroll.tasks import import_payroll_file, import_payroll_shard_task, reimport_payroll_file
+from .factories import PayrollBatchFixtureMixin, PayrollWeekFixtureMixin, create_worker
+
+CSV_HEADER = "date,field_worker,activity,quantity"
+
+
+class PayrollImportFixtureMixin(PayrollWeekFixtureMixin):
+    """Turns the seeded lines into CSV rows and empties the batch"""
+
+    def setUp(self):
+        super().setUp()
+        self.rows = [
+            f"{line.date.isoformat()},{line.field_worker.identification_number},{line.activity.name},{line.quantity}"
+            for line in self._batch_lines().select_related('field_worker', 'activity').order_by('pk')
+        ]
+        self._batch_lines().delete()
+
+    def _import_rows(self, rows, name="payroll.csv"):
+        temp_path = default_storage.save(f"temp/{name}", ContentFile("\n".join([CSV_HEADER, *rows])))
+        import_payroll_file(self.payroll_batch.pk, temp_path)
+        self.payroll_batch.refresh_from_db()
+
+    def _imported_lines(self):
+        return set(
+            self._batch_lines().values_list('date', 'field_worker__identification_number', 'activity__name', 'quantity')
+        )
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+class ChunkedImportTests(PayrollImportFixtureMixin, TestCase):
+
+    def test_matches_whole_file_import(self):
+        with override_settings(PAYROLL_IMPORT_CHUNK_SIZE=0):
+            self._import_rows(self.rows)
+        expected = self._imported_lines()
+        self._batch_lines().delete()
+
+        with override_settings(PAYROLL_IMPORT_CHUNK_SIZE=4):
+            self._import_rows(self.rows)
+
+        self.assertEqual(self._imported_lines(), expected)
+        self.assertEqual(self.payroll_batch.status, 'ready')
+        self.assertEqual(self.payroll_batch.metrics['line_creation']['rows'], len(self.rows))
+
+    @override_settings(PAYROLL_IMPORT_CHUNK_SIZE=4)
+    def test_drops_duplicates_across_chunks(self):
+        self._import_rows(self.rows + self.rows[:5])
+
+        self.assertEqual(self._batch_lines().count(), len(self.rows))
+        self.assertEqual(self.payroll_batch.status, 'ready')
+
+    @override_settings(PAYROLL_IMPORT_CHUNK_SIZE=4)
+    def test_invalid_chunk_rolls_back_the_import(self):
+        rows = self.rows + ["2025-07-01,0000000000,Harvest,3"]
+
+        self._import_rows(rows)
+
+        self.assertFalse(self._batch_lines().exists())
+        self.assertEqual(self.payroll_batch.status, 'error')
+        # Header plus every valid row before it
+        self.assertIn(f"Row {len(rows) + 1}: Invalid field worker", self.payroll_batch.error_message)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+class ImportProgressTests(PayrollImportFixtureMixin, AuthenticatedAPITestCase):
+
+    def _upload(self, rows):
+        content = "\n".join([CSV_HEADER, *rows]).encode()
+        return self.client.post(
+            reverse("payroll:payroll-batch-import-lines", kwargs={"pk": self.payroll_batch.pk}),
+            {"file": SimpleUploadedFile("payroll.csv", content, content_type="text/csv")},
+            format="multipart",
+        )
+
+    def test_import_lines_is_queued(self):
+        with mock.patch("payroll.views.import_payroll_file.delay") as delay:
+            res = self._upload(self.rows)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        delay.assert_called_once()
+        temp_path = delay.call_args.args[1]
+        self.addCleanup(default_storage.delete, temp_path)
+        with default_storage.open(temp_path) as temp_file:
+            self.assertEqual(temp_file.read().decode().splitlines()[1:], self.rows)
+
+        res = self.client.get(reverse("payroll:payroll-batch-status", kwargs={"pk": self.payroll_batch.pk}))
+        self.assertEqual(res.data["status"], "processing")
+        self.assertEqual(res.data["progress"]["stage"], "queued")
+
+    @override_settings(PAYROLL_IMPORT_CHUNK_SIZE=4)
+    def test_status_reports_import_progress(self):
+        self._upload(self.rows)
+
+        res = self.client.get(reverse("payroll:payroll-batch-status", kwargs={"pk": self.payroll_batch.pk}))
+
+        self.assertEqual(res.data["status"], "ready")
+        progress = res.data["progress"]
+        self.assertEqual(progress["stage"], "done")
+        self.assertEqual(progress["rows_read"], len(self.rows))
+        self.assertEqual(progress["rows_inserted"], len(self.rows))
+        self.assertEqual(progress["rows_calculated"], len(self.rows))
+
+    @override_settings(PAYROLL_IMPORT_CHUNK_SIZE=4)
+    def test_rolled_back_import_reports_no_inserted_rows(self):
+        self._import_rows(self.rows + ["2025-07-01,0000000000,Harvest,3"])
+
+        progress = get_import_progress(self.payroll_batch.pk)
+        self.assertEqual(progress["stage"], "error")
+        self.assertEqual(progress["rows_read"], len(self.rows) + 1)
+        self.assertEqual(progress["rows_inserted"], 0)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+class ShardedImportTests(PayrollImportFixtureMixin, TestCase):
+
+    def _calculated_lines(self):
+        return {
+            (line.pop('date'), line.pop('field_worker'), line.pop('activity')): line
+            for line in self._batch_lines().values('date', 'field_worker', 'activity', *OUTPUT_FIELDS)
+        }
+
+    def test_matches_single_task_import(self):
+        self.payroll_batch.calculation_backend = 'fused'
+        self.payroll_batch.save()
+        self._import_rows(self.rows)
+        expected = self._calculated_lines()
+        self._batch_lines().delete()
+
+        with override_settings(PAYROLL_IMPORT_SHARDS=3):
+            self._import_rows(self.rows)
+
+        self.assertEqual(self._calculated_lines(), expected)
+        self.assertEqual(self.payroll_batch.status, 'ready')
+        self.assertEqual(get_import_progress(self.payroll_batch.pk)['rows_calculated'], len(self.rows))
+        shard_rows = [
+            stage['rows'] for name, stage in self.payroll_batch.metrics.items() if name.startswith('shard_')
+        ]
+        self.assertEqual(sum(shard_rows), len(self.rows))
+
+    def test_workers_are_not_split_across_shards(self):
+        # The file is split a few rows at a time
+        with override_settings(PAYROLL_IMPORT_SHARDS=2, PAYROLL_IMPORT_CHUNK_SIZE=4), \
+                mock.patch("payroll.tasks._dispatch_shards") as dispatch_shards:
+            self._import_rows(self.rows)
+
+        shard_paths = dispatch_shards.call_args.args[1]
+        shard_files = []
+        for shard_path in shard_paths:
+            self.addCleanup(default_storage.delete, shard_path)
+            with default_storage.open(shard_path) as shard_file:
+                shard_files.append(pd.read_csv(shard_file, dtype=str))
+
+        self.assertEqual(len(shard_paths), 2)
+        self.assertFalse(set(shard_files[0]['field_worker']) & set(shard_files[1]['field_worker']))
+        self.assertEqual(sum(len(shard_file) for shard_file in shard_files), len(self.rows))
+        self.assertFalse(self._batch_lines().exists())
+
+    @override_settings(PAYROLL_IMPORT_SHARDS=3)
+    def test_failed_shard_deletes_the_committed_shards(self):
+        calculate_workers = PayrollCalculationOrchestrator.calculate_workers
+        calls = []
+
+        def fail_second_shard(orchestrator, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError("Shard failed")
+            return calculate_workers(orchestrator, *args, **kwargs)
+
+        with mock.patch.object(PayrollCalculationOrchestrator, "calculate_workers", fail_second_shard), \
+                self.assertRaises(RuntimeError):
+            self._import_rows(self.rows)
+
+        self.payroll_batch.refresh_from_db()
+        self.assertEqual(self.payroll_batch.status, 'error')
+        self.assertEqual(self.payroll_batch.error_message, "Shard failed")
+        self.assertFalse(self._batch_lines().exists())
+
+        # The same file imports cleanly afterwards
+        self._import_rows(self.rows)
+        self.assertEqual(self.payroll_batch.status, 'ready')
+        self.assertEqual(self._batch_lines().count(), len(self.rows))
+
+    def test_shard_rolls_back_when_another_one_failed(self):
+        PayrollBatch.objects.filter(pk=self.payroll_batch.pk).update(status='error')
+        shard_path = default_storage.save(
+            f"temp/payroll_batch_{self.payroll_batch.pk}_shard_0.csv",
+            ContentFile("\n".join([CSV_HEADER, *self.rows])),
+        )
+
+        self.assertEqual(import_payroll_shard_task(self.payroll_batch.pk, shard_path, 0), 0)
+        self.assertFalse(self._batch_lines().exists())
+
+    @override_settings(PAYROLL_IMPORT_SHARDS=3)
+    def test_invalid_file_is_not_sharded(self):
+        self._import_rows(self.rows + ["2025-07-01,0000000000,Harvest,3"])
+
+        self.assertFalse(self._batch_lines().exists())
+        self.assertEqual(self.payroll_batch.status, 'error')
+        self.assertFalse([name for name in default_storage.listdir("temp")[1] if "_shard_" in name])
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+class ReimportTests(PayrollImportFixtureMixin, AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.payroll_batch.calculation_backend = 'fused'
+        self.payroll_batch.save()
+
+    def _reimport_rows(self, rows, delete_missing=False):
+        temp_path = default_storage.save("temp/payroll.csv", ContentFile("\n".join([CSV_HEADER, *rows])))
+        reimport_payroll_file(self.payroll_batch.pk, temp_path, delete_missing=delete_missing)
+        self.payroll_batch.refresh_from_db()
+        return get_import_progress(self.payroll_batch.pk)
+
+    def _calculated_lines(self):
+        return {
+            (line.pop('date'), line.pop('field_worker'), line.pop('activity')): line
+            for line in self._batch_lines().values('date', 'field_worker', 'activity', 'quantity', *OUTPUT_FIELDS)
+        }
+
+    def _full_import(self, rows):
+        self._batch_lines().delete()
+        self._import_rows(rows)
+        return self._calculated_lines()
+
+    def _with_quantity(self, row, quantity):
+        return ",".join([*row.split(",")[:3], quantity])
+
+    def test_unchanged_file_writes_nothing(self):
+        self._import_rows(self.rows)
+        lines = list(self._batch_lines().values('id', 'updated_at').order_by('id'))
+
+        progress = self._reimport_rows(self.rows)
+
+        self.assertEqual(list(self._batch_lines().values('id', 'updated_at').order_by('id')), lines)
+        self.assertEqual(
+            [progress[key] for key in ('rows_inserted', 'rows_updated', 'rows_deleted', 'rows_calculated')],
+            [0, 0, 0, 0],
+        )
+        self.assertEqual(self.payroll_batch.status, 'ready')
+
+    def test_inserts_new_and_updates_changed_rows(self):
+        corrected = self.rows.copy()
+        corrected[3] = self._with_quantity(corrected[3], "21.5")
+        expected = self._full_import(corrected)
+        self._full_import(self.rows[1:])
+        unchanged_line = self._batch_lines().order_by('id').last()
+
+        progress = self._reimport_rows(corrected)
+
+        self.assertEqual(self._calculated_lines(), expected)
+        self.assertEqual(progress['rows_inserted'], 1)
+        self.assertEqual(progress['rows_updated'], 1)
+        self.assertEqual(self._batch_lines().get(pk=unchanged_line.pk).updated_at, unchanged_line.updated_at)
+
+    def test_deletes_missing_rows(self):
+        expected = self._full_import(self.rows[:-2])
+        self._full_import(self.rows)
+
+        self._reimport_rows(self.rows[:-2])
+        self.assertEqual(self._batch_lines().count(), len(self.rows))
+
+        progress = self._reimport_rows(self.rows[:-2], delete_missing=True)
+
+        self.assertEqual(self._calculated_lines(), expected)
+        self.assertEqual(progress['rows_deleted'], 2)
+
+    def test_rejects_lines_of_another_batch(self):
+        other_batch = PayrollBatch.objects.create(
+            name="Other Batch", farm=self.farm,
+            start_date=self.payroll_batch.start_date, end_date=self.payroll_batch.end_date,
+        )
+        self.payroll_batch, batch = other_batch, self.payroll_batch
+        self._import_rows(self.rows[:1])
+        self.payroll_batch = batch
+
+        self._reimport_rows(self.rows)
+
+        self.assertEqual(self.payroll_batch.status, 'error')
+        self.assertIn("Row 2: Line already belongs to another payroll batch", self.payroll_batch.error_message)
+        self.assertFalse(self._batch_lines().exists())
+
+    def test_import_lines_reimport(self):
+        content = "\n".join([CSV_HEADER, *self.rows]).encode()
+        with mock.patch("payroll.views.reimport_payroll_file.delay") as delay:
+            res = self.client.post(
+                reverse("payroll:payroll-batch-import-lines", kwargs={"pk": self.payroll_batch.pk}),
+                {
+                    "file": SimpleUploadedFile("payroll.csv", content, content_type="text/csv"),
+                    "reimport": True,
+                    "delete_missing": True,
+                },
+                format="multipart",
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.addCleanup(default_storage.delete, delay.call_args.args[1])
+        self.assertEqual(delay.call_args.kwargs, {"delete_missing": True})
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+class ImportPreviewTests(PayrollImportFixtureMixin, AuthenticatedAPITestCase):
+
+    def _preview(self, rows):
+        content = "\n".join([CSV_HEADER, *rows]).encode()
+        return self.client.post(
+            reverse("payroll:payroll-batch-import-preview", kwargs={"pk": self.payroll_batch.pk}),
+            {"file": SimpleUploadedFile("payroll.csv", content, content_type="text/csv")},
+            format="multipart",
+        )
+
+    def test_totals_match_the_import(self):
+        res = self._preview(self.rows)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(self._batch_lines().exists())
+        self.assertEqual(res.data["errors"], [])
+        self.assertEqual(res.data["valid_rows"], len(self.rows))
+
+        self._import_rows(self.rows)
+        for field in OUTPUT_FIELDS:
+            self.assertAlmostEqual(
+                res.data["totals"][field], self._batch_lines().aggregate(total=Sum(field))["total"], delta=0.01
+            )
+        worker = self.workers[0]
+        worker_totals = next(
+            totals for totals in res.data["workers"] if totals["field_worker"] == worker.identification_number
+        )
+        self.assertAlmostEqual(
+            worker_totals["total_cost"],
+            self._batch_lines().filter(field_worker=worker).aggregate(total=Sum("total_cost"))["total"],
+            delta=0.01,
+        )
+        harvest_totals = next(totals for totals in res.data["activities"] if totals["activity"] == "Harvest")
+        self.assertEqual(harvest_totals["lines"], self._batch_lines().filter(activity=self.harvest).count())
+
+    def test_lists_every_error_and_skips_invalid_rows(self):
+        invalid_rows = [f"2025-07-01,{9000000000 + i},Harvest,3" for i in range(12)]
+
+        res = self._preview(self.rows + invalid_rows)
+
+        self.assertEqual(len(res.data["errors"]), 12)
+        self.assertEqual(res.data["errors"][0]["row"], len(self.rows) + 2)
+        self.assertEqual(res.data["valid_rows"], len(self.rows))
+        self.assertFalse(self._batch_lines().exists())
+        self.payroll_batch.refresh_from_db()
+        self.assertEqual(self.payroll_batch.status, "draft")
+
+
+    def test_missing_columns_are_reported(self):
+        content = "\n".join(["field_worker,activity,quantity", *[row.split(",", 1)[1] for row in self.rows]])
+
+        res = self.client.post(
+            reverse("payroll:payroll-batch-import-preview", kwargs={"pk": self.payroll_batch.pk}),
+            {"file": SimpleUploadedFile("payroll.csv", content.encode(), content_type="text/csv")},
+            format="multipart",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["errors"], [{"row": 0, "message": "Missing required columns: {'date'}"}])
+        self.assertEqual(res.data["valid_rows"], 0)
+
+    def test_invalid_dates_are_reported_by_row(self):
+        worker = self.workers[0].identification_number
+        invalid_rows = [f"01/07/2025,{worker},Harvest,3", f"2025-13-01,{worker},Plant,3"]
+
+        res = self._preview(self.rows + invalid_rows)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["errors"], [
+            {"row": len(self.rows) + 2, "message": "Invalid date: 01/07/2025"},
+            {"row": len(self.rows) + 3, "message": "Invalid date: 2025-13-01"},
+        ])
+        self.assertEqual(res.data["valid_rows"], len(self.rows))
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+class ColumnarImportTests(PayrollImportFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        df = pd.read_csv(io.StringIO("\n".join([CSV_HEADER, *self.rows])), dtype={"field_worker": str})
+        df["field_worker"] = df["field_worker"].astype("int64")
+        # Columns the import doesn't use are not read
+        df["Notes"] = "collected in the field"
+        self.frame = df.rename(columns={"date": " Date"})
+
+    def _import_frame(self, name, write):
+        buffer = io.BytesIO()
+        write(buffer)
+        temp_path = default_storage.save(f"temp/{name}", ContentFile(buffer.getvalue()))
+        import_payroll_file(self.payroll_batch.pk, temp_path)
+        self.payroll_batch.refresh_from_db()
+
+    def _expected_lines(self):
+        with override_settings(PAYROLL_IMPORT_CHUNK_SIZE=0):
+            self._import_rows(self.rows)
+        expected = self._imported_lines()
+        self._batch_lines().delete()
+        return expected
+
+    def test_reads_needed_columns_as_categoricals(self):
+        buffer = io.BytesIO()
+        self.frame.to_parquet(buffer, index=False)
+        temp_path = default_storage.save("temp/payroll.parquet", ContentFile(buffer.getvalue()))
+        self.addCleanup(default_storage.delete, temp_path)
+
+        df = PayrollFileProcessor().read_file(default_storage.path(temp_path))
+
+        self.assertEqual(list(df.columns), [" Date", "field_worker", "activity", "quantity"])
+        self.assertEqual(df["field_worker"].dtype, "category")
+        self.assertEqual(df["activity"].dtype, "category")
+        self.assertEqual(df["field_worker"].iloc[0], self.rows[0].split(",")[1])
+
+    @override_settings(PAYROLL_IMPORT_CHUNK_SIZE=0)
+    def test_parquet_import(self):
+        expected = self._expected_lines()
+
+        self._import_frame("payroll.parquet", lambda buffer: self.frame.to_parquet(buffer, index=False))
+
+        self.assertEqual(self.payroll_batch.status, "ready")
+        self.assertEqual(self._imported_lines(), expected)
+
+    @override_settings(PAYROLL_IMPORT_CHUNK_SIZE=4)
+    def test_parquet_import_in_chunks(self):
+        expected = self._expected_lines()
+        rows = pd.concat([self.frame, self.frame.head(3)], ignore_index=True)
+
+        self._import_frame(
+            "payroll.parquet", lambda buffer: rows.to_parquet(buffer, index=False, row_group_size=5)
+        )
+
+        self.assertEqual(self.payroll_batch.status, "ready")
+        self.assertEqual(self._imported_lines(), expected)
+
+    def test_arrow_import(self):
+        expected = self._expected_lines()
+
+        self._import_frame("payroll.arrow", self.frame.to_feather)
+
+        self.assertEqual(self.payroll_batch.status, "ready")
+        self.assertEqual(self._imported_lines(), expected)
+
+
+class ExcelEngineTests(PayrollImportFixtureMixin, TestCase):
+
+    def test_calamine_matches_openpyxl(self):
+        df = pd.read_csv(io.StringIO("\n".join([CSV_HEADER, *self.rows])), dtype={"field_worker": str})
+        df["field_worker"] = df["field_worker"].astype("int64")
+        df.loc[1, "quantity"] = None
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False)
+        temp_path = default_storage.save("temp/payroll.xlsx", ContentFile(buffer.getvalue()))
+        self.addCleanup(default_storage.delete, temp_path)
+        full_path = default_storage.path(temp_path)
+
+        expected = PayrollFileProcessor.clean_data(PayrollFileProcessor("openpyxl").read_file(full_path))
+        df = PayrollFileProcessor.clean_data(PayrollFileProcessor("calamine").read_file(full_path))
+
+        pd.testing.assert_frame_equal(df, expected)
+
+
+class DuplicateRowFilterTests(TestCase):
+
+    def test_same_values_of_different_types_are_duplicates(self):
+        duplicate_filter = DuplicateRowFilter()
+        first = pd.DataFrame({
+            'date': pd.to_datetime(['2025-06-30', '2025-07-01']),
+            'field_worker': ['1234567001', '1234567002'],
+            'activity': ['Harvest', 'Harvest'],
+            'quantity': [5, 3],
+        })
+        second = pd.DataFrame({
+            'date': pd.to_datetime(['2025-06-30', '2025-07-02', '2025-07-02']),
+            'field_worker': ['1234567001', '1234567002', '1234567002'],
+            'activity': ['Harvest', 'Harvest', 'Harvest'],
+            'quantity': [5.0, 3.5, 3.5],
+        }, index=[2, 3, 4])
+
+        self.assertEqual(len(duplicate_filter.drop_duplicates(first)), 2)
+        self.assertEqual(list(duplicate_filter.drop_duplicates(second).index), [3])
+
+
+class PayrollFileValidatorTests(TestCase):
+
+    def setUp(self):
+        self.validator = PayrollFileValidator(
+            valid_workers={'1234567001', '1234567002'},
+            valid_activities={'Harvest', 'Plant'},
+            start_date=date(2025, 6, 30),
+            end_date=date(2025, 7, 6),
+        )
+
+    def _frame(self, rows, index=None):
+        df = pd.DataFrame(rows, columns=['date', 'field_worker', 'activity', 'quantity'], index=index)
+        df['date'] = pd.to_datetime(df['date'])
+        return df
+
+    def test_valid_rows(self):
+        df = self._frame([
+            ['2025-06-30', '1234567001', 'Harvest', 10],
+            ['2025-07-06', '1234567002', 'Plant', 0],
+        ])
+
+        self.assertEqual(self.validator.validate_data(df), [])
+
+    def test_errors_are_row_numbered_in_row_order(self):
+        df = self._frame([
+            ['2025-06-30', '1234567001', 'Harvest', 10],
+            ['2025-07-01', None, 'Harvest', 10],
+            ['2025-07-01', '0000000000', 'Mow', 'ten'],
+            ['2025-07-08', '1234567001', 'Plant', -1],
+        ])
+
+        errors = [str(error) for error in self.validator.validate_data(df)]
+
+        self.assertEqual(errors, [
+            "Row 3: One of the required fields is blank",
+            "Row 4: Invalid field worker: 0000000000",
+            "Row 4: Invalid activity: Mow",
+            "Row 4: Invalid quantity: ten",
+            "Row 5: Quantity must be between 0 and 9999999.999: -1",
+            "Row 5: Date outside of the batch period 2025-06-30 - 2025-07-06: 2025-07-08",
+        ])
+
+    def test_row_numbers_follow_the_file_index(self):
+        df = self._frame([['2025-07-01', '1234567001', 'Mow', 1]], index=[50000])
+
+        errors = self.validator.validate_data(df)
+
+        self.assertEqual(errors[0].row_number, 50002)
+
+    def test_dates_are_not_checked_without_batch_period(self):
+        validator = PayrollFileValidator(valid_workers={'1234567001'}, valid_activities={'Harvest'})
+        df = self._frame([['2024-01-01', '1234567001', 'Harvest', 1]])
+
+        self.assertEqual(validator.validate_data(df), [])
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+class DailyLimitTests(PayrollImportFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # The seeded lines have up to 3 lines per worker day
+        self.worker = self.workers[0].identification_number
+        self.extra_rows = [f"2025-07-02,{self.worker},{activity},1" for activity in ("Harvest", "Plant", "Absence")]
+
+    def _frame(self, rows, index=None):
+        df = pd.read_csv(io.StringIO("\n".join([CSV_HEADER, *rows])), dtype={"field_worker": str})
+        df['date'] = pd.to_datetime(df['date'])
+        if index is not None:
+            df.index = index
+        return df
+
+    def _validator(self, **kwargs):
+        return PayrollFileValidator(start_date=self.WEEK_START, end_date=self.WEEK_START + timedelta(days=6), **kwargs)
+
+    def _set_limit(self, limit):
+        with self.captureOnCommitCallbacks(execute=True):
+            PayrollConfiguration.objects.filter(pk=1).update(daily_payroll_line_worker_limit=limit)
+            config_cache.invalidate()
+        # The snapshot of the changed config outlives the test transaction
+        self.addCleanup(config_cache.invalidate)
+
+    def test_rows_over_the_limit_are_numbered(self):
+        self._set_limit(2)
+
+        errors = [str(error) for error in self._validator().validate_data(self._frame(self.extra_rows))]
+
+        self.assertEqual(errors, [
+            f"Row 4: Daily limit of 2 lines per worker has been reached: {self.worker} on 2025-07-02",
+        ])
+
+    def test_blank_and_unknown_workers_are_not_counted(self):
+        rows = [
+            *[f"2025-07-01,,Harvest,{quantity}" for quantity in range(1, 6)],
+            *[f"2025-07-01,0000000000,Harvest,{quantity}" for quantity in range(1, 5)],
+            *self.extra_rows,
+        ]
+
+        errors = [str(error) for error in self._validator().validate_data(self._frame(rows))]
+
+        self.assertEqual(errors, [
+            *[f"Row {row}: One of the required fields is blank" for row in range(2, 7)],
+            *[f"Row {row}: Invalid field worker: 0000000000" for row in range(7, 11)],
+        ])
+
+    def test_counts_lines_already_in_the_batch(self):
+        self._import_rows([f"2025-07-02,{self.worker},Harvest,1"])
+        self._set_limit(2)
+        validator = self._validator(payroll_batch=self.payroll_batch)
+        get_payroll_config()
+
+        # References and one grouped count of the batch lines
+        with self.assertNumQueries(3):
+            errors = validator.validate_data(self._frame(self.extra_rows[1:]))
+
+        self.assertEqual([error.row_number for error in errors], [3])
+
+    def test_counts_carry_over_between_chunks(self):
+        validator = self._validator()
+
+        self.assertEqual(validator.validate_data(self._frame(self.extra_rows[:2])), [])
+        errors = validator.validate_data(
+            self._frame([f"2025-07-02,{self.worker},Absence,{quantity}" for quantity in (1, 2)], index=[2, 3])
+        )
+
+        self.assertEqual([str(error) for error in errors], [
+            f"Row 5: Daily limit of 3 lines per worker has been reached: {self.worker} on 2025-07-02",
+        ])
+
+    def test_import_enforces_the_limit(self):
+        self._set_limit(1)
+
+        with override_settings(PAYROLL_IMPORT_CHUNK_SIZE=0):
+            self._import_rows(self.extra_rows[:2])
+
+        self.assertEqual(self.payroll_batch.status, 'error')
+        self.assertIn("Row 3: Daily limit of 1 lines per worker has been reached", self.payroll_batch.error_message)
+        self.assertFalse(self._batch_lines().exists())
+
+
+class ReferenceResolverTests(PayrollBatchFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.workers = [create_worker(1), create_worker(2)]
+
+    def _frame(self, field_workers, activities):
+        return pd.DataFrame({'field_worker': field_workers, 'activity': activities})
+
+    def test_fetches_only_the_keys_of_the_file(self):
+        resolver = ReferenceResolver()
+
+        resolver.load(self._frame(['1234567001', '0000000000', None], ['Harvest', 'Mow', 'Harvest']))
+
+        self.assertEqual(resolver.field_worker_ids, {'1234567001': self.workers[0].pk})
+        self.assertEqual(resolver.activity_ids, {'Harvest': self.harvest.pk})
+
+    def test_keys_are_looked_up_once(self):
+        resolver = ReferenceResolver()
+        resolver.load(self._frame(['1234567001', '0000000000'], ['Harvest', 'Mow']))
+
+        with self.assertNumQueries(0):
+            resolver.load(self._frame(['0000000000', '1234567001'], ['Mow', 'Harvest']))
+        # Only the new worker is fetched
+        with self.assertNumQueries(1):
+            resolver.load(self._frame(['1234567002'], ['Harvest']))
+
+        self.assertEqual(resolver.field_worker_ids['1234567002'], self.workers[1].pk)
+
+    def test_validation_and_line_creation_share_the_lookup(self):
+        resolver = ReferenceResolver()
+        validator = PayrollFileValidator(resolver=resolver)
+        creator = PayrollBatchCreator(resolver=resolver)
+        df = pd.DataFrame({
+            'date': pd.to_datetime(['2025-07-01']),
+            'field_worker': ['1234567001'],
+            'activity': ['Harvest'],
+            'quantity': [2.0],
+        })
+        get_payroll_config()
+
+        with self.assertNumQueries(2):
+            self.assertEqual(validator.validate_data(df), [])
+        # Only the COPY
+        with self.assertNumQueries(1):
+            creator._create_batch_lines(self.payroll_batch, df)
+
+
+class PayrollBatchCreatorTests(PayrollImportFixtureMixin, TestCase):
+
+    def _frame(self, rows):
+        df = pd.DataFrame(
+            [row.split(",") for row in rows], columns=['date', 'field_worker', 'activity', 'quantity']
+        )
+        df['date'] = pd.to_datetime(df['date'])
+        df['quantity'] = df['quantity'].astype(float)
+        return df
+
+    def _created_lines(self):
+        return list(
+            self._batch_lines().order_by('date', 'field_worker', 'activity').values(
+                'date', 'field_worker', 'activity', 'quantity', 'iso_week', 'iso_year',
+                'total_cost', 'mobilization_bonus', 'integral_bonus',
+            )
+        )
+
+    def test_copy_matches_bulk_create(self):
+        PayrollBatchCreator(use_copy=False)._create_batch_lines(self.payroll_batch, self._frame(self.rows))
+        expected = self._created_lines()
+        self._batch_lines().delete()
+
+        PayrollBatchCreator(copy_batch_size=10)._create_batch_lines(self.payroll_batch, self._frame(self.rows))
+
+        self.assertEqual(self._created_lines(), expected)
+        self.assertTrue(self._batch_lines().filter(created_at__isnull=False).exists())
+
+    def test_copy_runs_constant_queries(self):
+        creator = PayrollBatchCreator()
+        # Worker and activity id maps and a single COPY
+        with self.assertNumQueries(3):
+            creator._create_batch_lines(self.payroll_batch, self._frame(self.rows))
+
+        self.assertEqual(self._batch_lines().count(), len(self.rows))
+
+    def test_copy_rejects_missing_references(self):
+        df = self._frame(self.rows[:2] + ["2025-07-01,0000000000,Harvest,3"])
+
+        with self.assertRaisesMessage(Exception, "Reference not found: '0000000000'"):
+            PayrollBatchCreator()._create_batch_lines(self.payroll_batch, df)
@@ -0,0 +1,102 @@
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from core.tests import AuthenticatedAPITestCase
+from payroll.instrumentation import measure_stage
+from payroll.models import PayrollBatch, PayrollBatchLine
+from payroll.tasks import batch_week_level_calculation_task, import_payroll_file
+from .factories import PayrollBatchFixtureMixin, create_worker
+
+
+class StageFixtureMixin(PayrollBatchFixtureMixin):
+    """One worker with a split day"""
+
+    def setUp(self):
+        super().setUp()
+        self.worker = create_worker(1)
+        self._create_line(self.worker, self.harvest, self.WEEK_START, 10)
+        self._create_line(self.worker, self.absence, self.WEEK_START, 1)
+
+
+class MeasureStageTests(StageFixtureMixin, TestCase):
+
+    def _get_metrics(self):
+        return PayrollBatch.objects.get(pk=self.payroll_batch.pk).metrics
+
+    def test_records_stage(self):
+        with measure_stage(self.payroll_batch.pk, 'lookup') as stage:
+            stage.rows = len(list(self._batch_lines()))
+
+        metrics = self._get_metrics()['lookup']
+        self.assertEqual(metrics['queries'], 1)
+        self.assertEqual(metrics['rows'], self._batch_lines().count())
+        self.assertGreater(metrics['duration'], 0)
+        self.assertGreater(metrics['process_max_rss'], 0)
+        self.assertGreaterEqual(metrics['rss_growth'], 0)
+        self.assertFalse(metrics['failed'])
+
+    @override_settings(PAYROLL_STAGE_MEMORY_TRACING=True)
+    def test_traces_peak_memory(self):
+        with measure_stage(self.payroll_batch.pk, 'lookup'):
+            list(self._batch_lines())
+
+        self.assertGreater(self._get_metrics()['lookup']['peak_memory'], 0)
+
+    def test_peak_memory_needs_tracing(self):
+        with measure_stage(self.payroll_batch.pk, 'lookup'):
+            list(self._batch_lines())
+
+        self.assertIsNone(self._get_metrics()['lookup']['peak_memory'])
+
+    def test_records_failed_stage(self):
+        with self.assertRaises(ValueError):
+            with measure_stage(self.payroll_batch.pk, 'lookup'):
+                raise ValueError("Broken stage")
+
+        self.assertTrue(self._get_metrics()['lookup']['failed'])
+
+    def test_stages_are_merged(self):
+        batch_week_level_calculation_task(self.payroll_batch.pk)
+        with measure_stage(self.payroll_batch.pk, 'lookup'):
+            pass
+
+        self.assertEqual(set(self._get_metrics()), {'week_calculation', 'lookup'})
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+class ImportStageMetricsTests(StageFixtureMixin, TestCase):
+
+    def test_import_records_every_stage(self):
+        rows = [
+            f"{line.date.isoformat()},{line.field_worker.identification_number},{line.activity.name},{line.quantity}"
+            for line in self._batch_lines().select_related('field_worker', 'activity')
+        ]
+        self._batch_lines().delete()
+        temp_path = default_storage.save(
+            "temp/metrics.csv", ContentFile("\n".join(["date,field_worker,activity,quantity", *rows]))
+        )
+
+        import_payroll_file(self.payroll_batch.pk, temp_path)
+
+        metrics = PayrollBatch.objects.get(pk=self.payroll_batch.pk).metrics
+        self.assertEqual(
+            set(metrics),
+            {'import', 'validation', 'line_creation', 'inline_calculation', 'day_calculation', 'week_calculation'}
+        )
+        self.assertEqual(metrics['line_creation']['rows'], len(rows))
+        self.assertEqual(metrics['inline_calculation']['rows'], PayrollBatchLine.objects.count())
+
+
+class PayrollBatchMetricsApiTests(StageFixtureMixin, AuthenticatedAPITestCase):
+
+    def test_metrics_action(self):
+        batch_week_level_calculation_task(self.payroll_batch.pk)
+
+        res = self.client.get(reverse("payroll:payroll-batch-metrics", kwargs={"pk": self.payroll_batch.pk}))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["farm"], self.farm.pk)
+        self.assertEqual(res.data["iso_week"], 27)
+        self.assertIn("week_calculation", res.data["stages"])
@@ -0,0 +1,147 @@
+from datetime import timedelta
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from core.tests import AuthenticatedAPITestCase
+from payroll.filters import FieldWorkerFilter, PayrollLineFilter
+from payroll.models import Activity, FieldWorker, PayrollBatch, PayrollBatchLine
+from .factories import PayrollBatchFixtureMixin, create_worker
+
+
+class PayrollLineFixtureMixin(PayrollBatchFixtureMixin):
+    """Two workers harvesting every day of the week, more lines than a page"""
+
+    def setUp(self):
+        super().setUp()
+        self.workers = [create_worker(1), create_worker(2)]
+        for worker in self.workers:
+            for day in range(7):
+                self._create_line(worker, self.harvest, self.WEEK_START + timedelta(days=day), 10 + day)
+
+
+class PayrollLineCursorPaginationTests(PayrollLineFixtureMixin, AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse("payroll:payroll-line-list", kwargs={"batch_pk": self.payroll_batch.pk})
+        # Imported lines share their created_at
+        self._batch_lines().update(created_at=timezone.now())
+
+    def _expected_ids(self):
+        return list(self._batch_lines().order_by('date', 'created_at', 'id').values_list('id', flat=True))
+
+    def test_pages_follow_the_line_order(self):
+        ids = []
+        url = f"{self.url}?pagination=cursor&limit=5"
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(res.data["results"]), 5)
+            ids += [line["id"] for line in res.data["results"]]
+            url = res.data["next"]
+
+        self.assertEqual(ids, self._expected_ids())
+
+    def test_pages_run_no_count(self):
+        res = self.client.get(f"{self.url}?pagination=cursor&limit=5")
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(res.data["next"])
+
+        self.assertNotIn("count", res.data)
+        self.assertFalse([query for query in queries if "COUNT(" in query["sql"]])
+        self.assertEqual([line["id"] for line in res.data["results"]], self._expected_ids()[5:10])
+
+    def test_invalid_cursor(self):
+        res = self.client.get(f"{self.url}?cursor=not-a-cursor")
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_limit_offset_stays_the_default(self):
+        res = self.client.get(f"{self.url}?limit=5&offset=5")
+
+        self.assertEqual(res.data["count"], self._batch_lines().count())
+        self.assertEqual(len(res.data["results"]), 5)
+
+
+class PayrollLineFlatViewTests(PayrollLineFixtureMixin, AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse("payroll:payroll-line-list", kwargs={"batch_pk": self.payroll_batch.pk})
+
+    def test_flat_rows_match_the_nested_lines(self):
+        nested = self.client.get(f"{self.url}?limit=100").data["results"]
+
+        res = self.client.get(f"{self.url}?view=flat&limit=100")
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data["results"]), len(nested))
+        for flat_line, line in zip(res.data["results"], nested):
+            self.assertEqual(flat_line["id"], line["id"])
+            self.assertEqual(flat_line["payroll_batch"], line["payroll_batch"]["id"])
+            self.assertEqual(flat_line["field_worker"], line["field_worker"]["id"])
+            self.assertEqual(flat_line["identification_number"], line["field_worker"]["identification_number"])
+            self.assertEqual(flat_line["activity_name"], line["activity"]["name"])
+            self.assertEqual(flat_line["labor_type"], line["activity"]["labor_type"]["code"])
+            for field in ("date", "quantity", "total_cost", "integral_bonus", "fourteenth_bonus"):
+                self.assertEqual(flat_line[field], line[field])
+
+    def test_flat_retrieve(self):
+        line = self._batch_lines().first()
+
+        res = self.client.get(
+            reverse("payroll:payroll-line-detail", kwargs={"batch_pk": self.payroll_batch.pk, "pk": line.pk}),
+            {"view": "flat"},
+        )
+
+        self.assertEqual(res.data["field_worker"], line.field_worker_id)
+        self.assertEqual(res.data["activity"], line.activity_id)
+
+    def test_flat_pages_in_cursor_mode(self):
+        res = self.client.get(f"{self.url}?view=flat&pagination=cursor&limit=5")
+        res = self.client.get(res.data["next"])
+
+        expected = list(self._batch_lines().order_by('date', 'created_at', 'id').values_list('id', flat=True))
+        self.assertEqual([line["id"] for line in res.data["results"]], expected[5:10])
+
+    def test_queries_do_not_grow_with_lines(self):
+        for view in ("flat", "nested"):
+            with self.subTest(view=view):
+                # User, count and page
+                with self.assertNumQueries(3):
+                    self.client.get(f"{self.url}?view={view}&limit=100")
+
+
+class TrigramSearchIndexTests(PayrollLineFixtureMixin, TestCase):
+    """The icontains searches compare on the expressions of the trigram indexes"""
+
+    def _plan(self, queryset):
+        with connection.cursor() as cursor:
+            # The fixture tables are small enough to be scanned otherwise
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+    def test_reference_searches_use_the_trigram_indexes(self):
+        searches = [
+            (FieldWorkerFilter({"name": "orker 2"}, queryset=FieldWorker.objects.all()).qs,
+             "payroll_worker_name_trgm_idx"),
+            (FieldWorker.objects.filter(identification_number__icontains="4567002"),
+             "payroll_worker_idnum_trgm_idx"),
+            (Activity.objects.filter(name__icontains="harv"), "payroll_activity_name_trgm_idx"),
+            (PayrollBatch.objects.filter(name__icontains="payroll"), "payroll_batch_name_trgm_idx"),
+        ]
+        for queryset, index in searches:
+            with self.subTest(index=index):
+                self.assertIn(index, self._plan(queryset))
+
+    def test_line_filter_uses_the_worker_index(self):
+        queryset = PayrollLineFilter(
+            {"field_worker__name": "orker 2"}, queryset=PayrollBatchLine.objects.all()
+        ).qs
+
+        self.assertIn("payroll_worker_name_trgm_idx", self._plan(queryset))
+        self.assertEqual(queryset.count(), self._batch_lines().filter(field_worker=self.workers[1]).count())
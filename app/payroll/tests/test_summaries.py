@@ -0,0 +1,133 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from core.tests import AuthenticatedAPITestCase
+from payroll.caches import bump_batch_version, get_batch_summary, get_batch_version
+from payroll.models import PayrollBatch
+from payroll.orchestrators import PayrollCalculationOrchestrator
+from payroll.summaries import SUMMARY_FIELDS
+from .factories import PayrollBatchFixtureMixin, create_worker
+
+
+class PayrollBatchSummaryTests(PayrollBatchFixtureMixin, AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.workers = [create_worker(1), create_worker(2, wage=480)]
+        tuesday = self.WEEK_START + timedelta(days=1)
+        self._create_line(self.workers[0], self.harvest, self.WEEK_START, Decimal('10'))
+        self._create_line(self.workers[0], self.plant, self.WEEK_START, Decimal('4.5'))
+        self._create_line(self.workers[0], self.absence, tuesday, Decimal('1'))
+        self._create_line(self.workers[1], self.harvest, self.WEEK_START, Decimal('7'))
+        self._create_line(self.workers[1], self.harvest, tuesday, Decimal('17.125'))
+        with self.captureOnCommitCallbacks(execute=True):
+            PayrollCalculationOrchestrator().calculate_batch(self.payroll_batch.pk)
+        self.url = reverse("payroll:payroll-batch-summary", kwargs={"pk": self.payroll_batch.pk})
+
+    def _line_detail_url(self, line):
+        return reverse(
+            "payroll:payroll-line-detail", kwargs={"batch_pk": self.payroll_batch.pk, "pk": line.pk}
+        )
+
+    def _expected_totals(self, key):
+        totals = defaultdict(lambda: dict.fromkeys(["lines", *SUMMARY_FIELDS], Decimal(0)))
+        for line in self._batch_lines():
+            line_totals = totals[key(line)]
+            line_totals["lines"] += 1
+            for field in SUMMARY_FIELDS:
+                line_totals[field] += getattr(line, field) or Decimal(0)
+        return totals
+
+    def _assert_totals(self, summary_totals, expected):
+        self.assertEqual(summary_totals["lines"], expected["lines"])
+        for field in SUMMARY_FIELDS:
+            self.assertEqual(Decimal(summary_totals[field]), expected[field], field)
+
+    def test_totals_match_the_lines(self):
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["status"], "ready")
+        self._assert_totals(res.data["totals"], self._expected_totals(lambda line: None)[None])
+
+        per_worker = self._expected_totals(lambda line: line.field_worker_id)
+        self.assertEqual(len(res.data["workers"]), len(self.workers))
+        for worker in res.data["workers"]:
+            self._assert_totals(worker, per_worker[worker["field_worker_id"]])
+
+        per_activity = self._expected_totals(lambda line: line.activity_id)
+        self.assertEqual(
+            {activity["activity"] for activity in res.data["activities"]}, {"Harvest", "Plant", "Absence"}
+        )
+        for activity in res.data["activities"]:
+            self._assert_totals(activity, per_activity[activity["activity_id"]])
+
+    def test_summary_is_one_query_then_cached(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertEqual(len([query for query in queries if "GROUPING SETS" in query["sql"]]), 1)
+
+        # User and batch only
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+    def test_line_changes_bump_the_version(self):
+        line = self._batch_lines().filter(activity=self.harvest).first()
+        quantity = self.client.get(self.url).data["totals"]["quantity"]
+
+        version = get_batch_version(self.payroll_batch.pk)
+        res = self.client.patch(self._line_detail_url(line), {"quantity": line.quantity + 5})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(get_batch_version(self.payroll_batch.pk), version)
+        self.assertEqual(self.client.get(self.url).data["totals"]["quantity"], quantity + 5)
+
+        version = get_batch_version(self.payroll_batch.pk)
+        self.client.delete(self._line_detail_url(line))
+        self.assertNotEqual(get_batch_version(self.payroll_batch.pk), version)
+        self.assertEqual(
+            self.client.get(self.url).data["totals"]["lines"], self._batch_lines().count()
+        )
+
+    def test_recalculation_bumps_the_version(self):
+        self.client.get(self.url)
+        # Queryset updates don't touch the version, the recalculation does
+        self._batch_lines().filter(activity=self.plant).update(quantity=F('quantity') + 1)
+
+        PayrollCalculationOrchestrator().calculate_batch(self.payroll_batch.pk)
+
+        expected = self._expected_totals(lambda line: None)[None]
+        self._assert_totals(self.client.get(self.url).data["totals"], expected)
+
+    def test_empty_batch(self):
+        batch = PayrollBatch.objects.create(
+            name="Empty batch",
+            start_date=self.payroll_batch.start_date,
+            end_date=self.payroll_batch.end_date,
+            farm=self.farm,
+        )
+
+        res = self.client.get(reverse("payroll:payroll-batch-summary", kwargs={"pk": batch.pk}))
+
+        self.assertEqual(res.data["totals"]["lines"], 0)
+        self.assertEqual(res.data["workers"], [])
+        self.assertEqual(res.data["activities"], [])
+
+    def test_rolled_back_lines_are_not_cached(self):
+        quantity = self.client.get(self.url).data["totals"]["quantity"]
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            line = self._batch_lines().filter(activity=self.harvest).first()
+            line.quantity += 5
+            line.save()
+            bump_batch_version(self.payroll_batch.pk)
+            self.assertEqual(get_batch_summary(self.payroll_batch.pk)["totals"]["quantity"], quantity + 5)
+            raise ValueError("Rolled back")
+
+        self.assertEqual(self.client.get(self.url).data["totals"]["quantity"], quantity)
@@ -1,17 +1,19 @@
 from django.shortcuts import get_object_or_404
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.http import FileResponse, StreamingHttpResponse
 from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, viewsets, generics
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny
 from payroll.tasks import (
     sync_employee, 
     sync_contract,
     recalc_line_task,
     recalc_delete_task,
-    import_payroll_file
+    import_payroll_file,
+    reimport_payroll_file
 )
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
@@ -39,6 +41,7 @@ from .serializers import (
     PayrollConfigurationSerializer,
     TariffSerializer,
     PayrollBatchLineSerializer,
+    PayrollBatchLineFlatSerializer,
     PayrollBatchLineWriteSerializer,
     LaborTypeSerializer,
     PayrollBatchImportSerializer
@@ -47,6 +50,11 @@ from .filters import (
     FieldWorkerFilter,
     PayrollLineFilter
 )
+from .caches import bump_batch_version, get_batch_summary
+from .exports import EXPORT_CONTENT_TYPES, EXPORT_FORMATS, PayrollLineExporter
+from .orchestrators import PayrollImportPreview
+from .pagination import PayrollLineCursorPagination
+from .progress import get_import_progress, start_import_progress
 
 from logging import getLogger
 
@@ -157,21 +165,73 @@ class TariffViewSet(viewsets.ModelViewSet):
     search_fields = ['name']
 
 class PayrollBatchViewSet(viewsets.ModelViewSet):
-    queryset = PayrollBatch.objects.all()
+    # Stable pages, the metrics writes of every stage move the rows around
+    queryset = PayrollBatch.objects.order_by('id')
     serializer_class = PayrollBatchSerializer
-    filterset_fields = ['status']
+    filterset_fields = ['status', 'farm', 'iso_year', 'iso_week']
     search_fields = ['name']
 
     def get_serializer_class(self):
-        if self.action == "import_lines":
+        if self.action in ("import_lines", "import_preview"):
             return PayrollBatchImportSerializer
         return super().get_serializer_class()
 
     @action(detail=True, methods=['get'])
     def status(self, request, pk=None):
         batch = self.get_object()
-        return Response({"status": batch.status, "error_message": batch.error_message})
+        return Response({
+            "status": batch.status,
+            "error_message": batch.error_message,
+            "progress": get_import_progress(batch.id),
+        })
+
+    @action(detail=True, methods=['get'])
+    def metrics(self, request, pk=None):
+        """Duration, queries, rows and memory of the last import and calculation stages"""
+        batch = self.get_object()
+        return Response({
+            "id": batch.id,
+            "farm": batch.farm_id,
+            "iso_year": batch.iso_year,
+            "iso_week": batch.iso_week,
+            "calculation_backend": batch.get_calculation_backend(),
+            "stages": batch.metrics,
+        })
+
+    @action(detail=True, methods=['get'])
+    def summary(self, request, pk=None):
+        """Per-worker and per-activity totals of the batch lines"""
+        batch = self.get_object()
+        return Response({"status": batch.status, **get_batch_summary(batch.id)})
     
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        Stream the batch lines with their worker and activity labels,
+        ?file_type=csv (default) or xlsx. DRF keeps ?format= for renderers.
+        """
+        batch = self.get_object()
+        file_type = request.query_params.get('file_type', 'csv')
+        if file_type not in EXPORT_FORMATS:
+            raise ValidationError({"file_type": f"Must be one of {', '.join(EXPORT_FORMATS)}"})
+
+        lines = PayrollBatchLine.objects.filter(payroll_batch=batch)
+        exporter = PayrollLineExporter()
+        filename = f"payroll_batch_{batch.id}.{file_type}"
+        if file_type == 'xlsx':
+            return FileResponse(
+                exporter.write_xlsx(lines),
+                as_attachment=True,
+                filename=filename,
+                content_type=EXPORT_CONTENT_TYPES[file_type],
+            )
+
+        response = StreamingHttpResponse(
+            exporter.stream_csv(lines), content_type=EXPORT_CONTENT_TYPES[file_type]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
     @action(detail=True, methods=['post'], url_path='import-lines')
     def import_lines(self, request, pk=None):
         batch = self.get_object()
@@ -181,21 +241,39 @@ class PayrollBatchViewSet(viewsets.ModelViewSet):
         batch.status = 'processing'
         batch.save(update_fields=['status'])
 
-        # Save uploaded file to a temp location
+        # Save uploaded file to a temp location, the storage copies it in chunks
         upload = serializer.validated_data['file']
-        temp_path = default_storage.save(
-            f"temp/payroll_batch_{batch.id}_{upload.name}",
-            ContentFile(upload.read())
-        )
+        temp_path = default_storage.save(f"temp/payroll_batch_{batch.id}_{upload.name}", upload)
 
         # Fire and forget the import task
-        import_payroll_file(batch.id, temp_path)
+        start_import_progress(batch.id)
+        if serializer.validated_data['reimport']:
+            reimport_payroll_file.delay(
+                batch.id, temp_path, delete_missing=serializer.validated_data['delete_missing']
+            )
+        else:
+            import_payroll_file.delay(batch.id, temp_path)
 
         return Response(
             {"detail": "Payroll batch import queued"},
             status=status.HTTP_202_ACCEPTED
         )
 
+    @action(detail=True, methods=['post'], url_path='import-preview')
+    def import_preview(self, request, pk=None):
+        """Validation errors and projected totals of a file, nothing is imported"""
+        batch = self.get_object()
+        serializer = PayrollBatchImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        upload = serializer.validated_data['file']
+        temp_path = default_storage.save(f"temp/payroll_batch_{batch.id}_preview_{upload.name}", upload)
+        try:
+            preview = PayrollImportPreview().preview_file(batch, default_storage.path(temp_path))
+        finally:
+            default_storage.delete(temp_path)
+
+        return Response(preview)
 
 
 class PayrollConfigurationView(generics.RetrieveUpdateAPIView):
@@ -225,23 +303,52 @@ class PayrollBatchLineViewSet(viewsets.ModelViewSet):
     - PATCH /api/payroll-batches/<batch_pk>/payroll-lines/<pk>/ → updates a line & recalculates
     - DELETE /api/payroll-batches/<batch_pk>/payroll-lines/<pk>/ → deletes a line
     - POST /api/payroll-batches/<batch_pk>/payroll-lines/batch-import/ → uploads a CSV/XLSX
+
+    Lists are limit/offset paginated, ?pagination=cursor switches to keyset
+    pages that stay fast however deep the page is.
+    ?view=flat reads lines with ids and labels instead of nested objects.
     """
-    queryset = PayrollBatchLine.objects.select_related("payroll_batch", "field_worker", "activity")
+    queryset = PayrollBatchLine.objects.select_related(
+        "payroll_batch",
+        "field_worker",
+        "activity__activity_group",
+        "activity__labor_type",
+        "activity__uom",
+    )
     filterset_class = PayrollLineFilter
     serializer_class = PayrollBatchLineSerializer
 
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = PayrollLineCursorPagination()
+            else:
+                self._paginator = self.pagination_class() if self.pagination_class else None
+        return self._paginator
+
     def get_queryset(self):
+        queryset = self.queryset
+        if self._is_flat_view():
+            queryset = PayrollBatchLineFlatSerializer.values(PayrollBatchLine.objects.all())
+
         # If nested under a batch, filter by that batch
         batch_pk = self.kwargs.get("batch_pk")
         if batch_pk:
-            return self.queryset.filter(payroll_batch=batch_pk)
-        return self.queryset
+            return queryset.filter(payroll_batch=batch_pk)
+        return queryset
 
     def get_serializer_class(self):
         if self.action in ('create','update','partial_update'):
             return PayrollBatchLineWriteSerializer
+        if self._is_flat_view():
+            return PayrollBatchLineFlatSerializer
         return PayrollBatchLineSerializer
 
+    def _is_flat_view(self):
+        return self.action in ('list', 'retrieve') and self.request.query_params.get('view') == 'flat'
+
     def perform_create(self, serializer):
         # Set the batch from the param
         batch_pk = self.kwargs.get("batch_pk")
@@ -252,6 +359,7 @@ class PayrollBatchLineViewSet(viewsets.ModelViewSet):
 
         # Create the line
         line = serializer.save(payroll_batch=batch)
+        bump_batch_version(batch.id)
         
         recalc_line_task.delay(line.id, recalc_week=True)
     
@@ -259,6 +367,7 @@ class PayrollBatchLineViewSet(viewsets.ModelViewSet):
         # Original activity may have changed
         original_activity = serializer.instance.activity
         line = serializer.save()
+        bump_batch_version(line.payroll_batch_id)
         activity_changed = original_activity != line.activity
 
         batch = line.payroll_batch
@@ -275,6 +384,7 @@ class PayrollBatchLineViewSet(viewsets.ModelViewSet):
         date = instance.date.isoformat()
 
         super().perform_destroy(instance)
+        bump_batch_version(payroll_batch_id)
         
         batch = PayrollBatch.objects.get(pk=payroll_batch_id)
         batch.status = 'processing'